@@ -0,0 +1,276 @@
+"""Micro-benchmarks for every node in NODE_CLASS_MAPPINGS.
+
+Every node runs on synthetic RGBA cutouts for a grid of image sizes, batch
+sizes and parameter sets (the defaults and the slider extremes). Wall time,
+throughput and peak RSS are recorded per case and written as JSON:
+
+    python benchmarks/bench_nodes.py run --output baseline.json
+    python benchmarks/bench_nodes.py run --sizes 512 1024 2048 4096 8k --batches 1 4 16 --output full.json
+    python benchmarks/bench_nodes.py compare baseline.json current.json --threshold 0.15
+
+`compare` lists every case that got slower (median wall time) or bigger
+(peak RSS) than the threshold allows and exits with 1 if there is any.
+
+Each case runs in a fresh process so that its peak RSS is its own
+(--no-isolate runs everything in this process, which is faster but only
+gives the overall peak). The stage caches are cleared before every
+repetition unless --warm is given. Cases whose estimated pixel count
+exceeds --max-megapixels are recorded as skipped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import importlib.util
+import multiprocessing
+
+import numpy as np
+import torch
+import PIL
+from PIL import Image
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "goede-image-placer")
+
+SIZES = {"512": (512, 512), "1024": (1024, 1024), "2048": (2048, 2048), "4096": (4096, 4096), "8k": (7680, 4320)}
+
+DEFAULT_SIZES = ["512", "1024"]
+DEFAULT_BATCHES = [1, 4]
+
+# (node, case, parameters, pixel factor): the pixel factor estimates how much
+# larger than the input the work gets (e.g. shadow_scale squared)
+CASES = [
+    ("AddPadding", "default", {"left": 64, "top": 64, "right": 64, "bottom": 64}, 1.1),
+    ("AddPadding", "max_padding", {"left": 1024, "top": 1024, "right": 1024, "bottom": 1024}, 4.0),
+    ("DropShadow", "default", {"shadow_angle": 6, "shadow_distance": 50, "shadow_blur": 20, "shadow_scale": 1.5, "shadow_color": "#000000"}, 2.3),
+    ("DropShadow", "max_blur", {"shadow_angle": 6, "shadow_distance": 50, "shadow_blur": 200, "shadow_scale": 1.5, "shadow_color": "#000000"}, 2.3),
+    ("DropShadow", "max_scale", {"shadow_angle": 3, "shadow_distance": 500, "shadow_blur": 20, "shadow_scale": 5.0, "shadow_color": "#000000"}, 25.0),
+    ("DropShadow", "tiled", {"shadow_angle": 6, "shadow_distance": 50, "shadow_blur": 20, "shadow_scale": 1.5, "shadow_color": "#000000", "tiled": "on"}, 2.3),
+    ("Spotlight", "default", {"light_from": 12, "shadow_length": 5, "shadow_blur": 20, "shadow_color": "#000000"}, 1.0),
+    ("Spotlight", "max_length", {"light_from": 4, "shadow_length": 10, "shadow_blur": 200, "shadow_color": "#000000"}, 4.0),
+    ("Spotlight", "tiled", {"light_from": 12, "shadow_length": 5, "shadow_blur": 20, "shadow_color": "#000000", "tiled": "on"}, 1.0),
+    ("PerfectShadow", "default", {"light_from": 4, "shadow_length": 5, "opacity": 1.0}, 1.5),
+    ("PerfectShadow", "max_length", {"light_from": 4.5, "shadow_length": 10, "opacity": 1.0}, 2.5),
+    ("SpotlightSweep", "default", {"shadow_length": 7.5, "shadow_blur": 20, "shadow_color": "#000000"}, 30.0),
+    ("PerfectShadowSweep", "default", {"shadow_length": 5, "opacity": 1.0}, 47.0),
+    ("ImageComposite", "default", {"spacing": 10}, 1.0),
+    ("ImageComposite", "no_spacing", {"spacing": 0}, 1.0),
+    ("ImageComposite", "tiled", {"spacing": 10, "tiled": "on"}, 1.0),
+    ("ShadowComposite", "default", {"spacing": 10, "shadow_angle": 6, "shadow_distance": 50, "shadow_blur": 20, "shadow_scale": 1.5, "shadow_color": "#000000"}, 3.3),
+    ("ShadowComposite", "max_blur", {"spacing": 10, "shadow_angle": 6, "shadow_distance": 50, "shadow_blur": 200, "shadow_scale": 5.0, "shadow_color": "#000000"}, 26.0),
+    ("ImageSelector", "default", {}, 1.0),
+    ("ImageSelector", "max_width", {"max_width": 256}, 1.0),
+    ("ImageFinder", "default", {"min_width": 0, "min_height": 0, "orientation": "any", "color": "", "color_distance": 64, "position": 0}, 1.0),
+]
+
+
+def load_package():
+    # The package directory is not a valid module name, load it by path
+    if "goede_image_placer" in sys.modules:
+        return sys.modules["goede_image_placer"]
+    spec = importlib.util.spec_from_file_location(
+        "goede_image_placer", os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def synthetic_cutout(batch_size, width, height, seed=0):
+    # Soft-edged ellipse per item, slightly shifted so that items differ
+    generator = torch.Generator().manual_seed(seed)
+    image = torch.rand((batch_size, height, width, 4), generator=generator)
+    y = torch.linspace(-1, 1, height).view(-1, 1)
+    x = torch.linspace(-1, 1, width).view(1, -1)
+    for i in range(batch_size):
+        shift = 0.05 * (i % 4)
+        radius = torch.sqrt(((x - shift) / 0.6) ** 2 + (y / 0.7) ** 2)
+        image[i, ..., 3] = ((1.0 - radius) * 20).clamp(0, 1)
+    return image
+
+
+def synthetic_background(batch_size, width, height, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand((batch_size, height, width, 3), generator=generator)
+
+
+def clear_caches(package):
+    package.stage_cache.STAGE_CACHE.clear()
+    package.image_selector.DECODED_CACHE.clear()
+
+
+def build_call(package, node_name, params, width, height, batch_size, backend, workdir):
+    # Returns the bound node function and its keyword arguments
+    node = package.NODE_CLASS_MAPPINGS[node_name]()
+    kwargs = dict(params)
+    if node_name in ("ImageComposite", "ShadowComposite"):
+        kwargs["background_image"] = synthetic_background(1, width, height)
+        kwargs["subject_image"] = synthetic_cutout(batch_size, width // 2, height // 2)
+    elif node_name in ("ImageSelector", "ImageFinder"):
+        path = os.path.join(workdir, f"background_{width}x{height}.jpg")
+        if not os.path.exists(path):
+            Image.fromarray((synthetic_background(1, width, height)[0].numpy() * 255).astype(np.uint8)).save(path, quality=90)
+        package.image_selector.IMAGE_DIR = workdir
+        if node_name == "ImageSelector":
+            kwargs["image"] = os.path.basename(path)
+    else:
+        kwargs["image"] = synthetic_cutout(batch_size, width, height)
+    if backend is not None and "backend" in node.INPUT_TYPES().get("optional", {}):
+        kwargs["backend"] = backend
+    return getattr(node, node.FUNCTION), kwargs
+
+
+def run_case(case):
+    # Runs in its own process (unless --no-isolate), returns the result entry
+    package = load_package()
+    width, height = case["size"]
+    with tempfile.TemporaryDirectory() as workdir:
+        function, kwargs = build_call(
+            package, case["node"], case["params"], width, height, case["batch"], case["backend"], workdir
+        )
+        times = []
+        for _ in range(case["repeat"]):
+            if not case["warm"]:
+                clear_caches(package)
+            start = time.perf_counter()
+            function(**kwargs)
+            times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    return dict(
+        case,
+        status="ok",
+        wall_s_median=median,
+        wall_s_min=min(times),
+        throughput_mpx_s=case["batch"] * width * height / 1e6 / median,
+        peak_rss_mb=peak_rss_mb,
+    )
+
+
+def case_key(entry):
+    return (entry["node"], entry["case"], tuple(entry["size"]), entry["batch"], entry.get("backend"))
+
+
+def build_cases(args, node_names):
+    cases = []
+    for node_name, case_name, params, pixel_factor in CASES:
+        if args.nodes and node_name not in args.nodes:
+            continue
+        for size_name in args.sizes:
+            width, height = SIZES[size_name]
+            # The selectors decode a single file, batches do not apply
+            batches = [1] if node_name in ("ImageSelector", "ImageFinder") else args.batches
+            for batch_size in batches:
+                case = dict(
+                    node=node_name, case=case_name, params=params, size=[width, height], batch=batch_size,
+                    backend=args.backend, repeat=args.repeat, warm=args.warm,
+                )
+                if batch_size * width * height * pixel_factor / 1e6 > args.max_megapixels:
+                    case["status"] = "skipped"
+                cases.append(case)
+    missing = set(node_names) - {node_name for node_name, _, _, _ in CASES}
+    if missing:
+        raise SystemExit(f"No benchmark cases for: {', '.join(sorted(missing))}")
+    return cases
+
+
+def run(args):
+    node_names = load_package().NODE_CLASS_MAPPINGS.keys()
+    cases = build_cases(args, node_names)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        if case.get("status") == "skipped":
+            results.append(case)
+            print(f"{case['node']:16} {case['case']:12} {case['size'][0]}x{case['size'][1]} x{case['batch']:<3} skipped")
+            continue
+        if args.no_isolate:
+            result = run_case(case)
+        else:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (case,))
+        results.append(result)
+        print(f"{result['node']:16} {result['case']:12} {result['size'][0]}x{result['size'][1]} x{result['batch']:<3} "
+              f"{result['wall_s_median'] * 1000:9.1f} ms {result['throughput_mpx_s']:8.1f} MP/s {result['peak_rss_mb']:8.0f} MB")
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+def compare_results(baseline, current, threshold):
+    # Cases where current is slower or needs more memory than the baseline
+    # allows; returns (case key, metric, baseline value, current value) tuples
+    baseline_results = {case_key(entry): entry for entry in baseline["results"] if entry.get("status") == "ok"}
+    regressions = []
+    for entry in current["results"]:
+        reference = baseline_results.get(case_key(entry))
+        if entry.get("status") != "ok" or reference is None:
+            continue
+        for metric in ("wall_s_median", "peak_rss_mb"):
+            if entry[metric] > reference[metric] * (1 + threshold):
+                regressions.append((case_key(entry), metric, reference[metric], entry[metric]))
+    return regressions
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.threshold)
+    for (node, case, size, batch, backend), metric, old, new in regressions:
+        print(f"REGRESSION {node} {case} {size[0]}x{size[1]} x{batch} {backend or 'default'} {metric}: "
+              f"{old:.3f} -> {new:.3f} ({(new / old - 1) * 100:+.0f}%)")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold * 100:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write a JSON report")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, choices=list(SIZES))
+    run_parser.add_argument("--batches", nargs="+", type=int, default=DEFAULT_BATCHES)
+    run_parser.add_argument("--nodes", nargs="+", help="only these nodes (default: all)")
+    run_parser.add_argument("--backend", choices=["pil", "torch"], help="backend for the nodes that have one")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--warm", action="store_true", help="keep the stage caches between repetitions")
+    run_parser.add_argument("--max-megapixels", type=float, default=200.0)
+    run_parser.add_argument("--no-isolate", action="store_true", help="run all cases in this process")
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser("compare", help="flag regressions against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative increase")
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""Equivalence of the rendering paths of the nodes with the original nodes.
+
+The reference of DropShadow, Spotlight, PerfectShadow and ImageComposite are
+frozen copies of the nodes as they were before the performance work
+(reference_nodes/, not edited). Every rendering path of the current nodes
+(PATHS: the default PIL path, the torch backend, tiled, draft, float16) runs
+against them on a corpus of generated cutouts and tests/testring.png, for
+every parameter set of the grid:
+
+    python benchmarks/equivalence.py                       quick grid, every path
+    python benchmarks/equivalence.py --grid full --paths tiled --nodes DropShadow
+    python benchmarks/equivalence.py --tolerance torch=16,2 --output report.json
+
+The grid comes from the slider ranges of the nodes (minimum, default and
+maximum, every clock position, every choice). "quick" varies one parameter
+at a time around the defaults, "full" runs every combination. Options the
+reference does not have (blur_strategy) are passed to the current nodes only.
+
+The reference renders with the changes the nodes make on purpose
+(intended_changes(): PIL's methods are swapped while the frozen nodes run):
+  * The nodes composite with the "over" operator (compositing.py), the
+    reference with PIL's paste(src, box, src), which gives semi-transparent
+    pixels over transparency alpha a * a instead of a. The reference pastes
+    with "over" too, except in the smear of PerfectShadow: the nodes repeat
+    its paste loop on purpose.
+  * The nodes blur, resize and transform a shadow on its alpha only, in its
+    color; the reference did that on a straight alpha RGBA image, a shadow
+    color other than black darkened towards its edges.
+
+Errors are in 8 bit levels: max and mean per channel (the color
+premultiplied with alpha, the color of nearly transparent pixels is not
+visible) and the alpha error on the edges of the reference (pixels whose 3x3
+neighborhood is not of one alpha). A comparison fails when the max or the
+mean error of a channel exceeds its tolerance (or the canvas differs); the
+script exits with 1 if any does. The tolerance of a comparison is the one of
+its path (TOLERANCES) plus the documented bound of every approximation its
+parameters select (APPROXIMATIONS). Both renders are timed, the current
+nodes with cold stage caches.
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import itertools
+import contextlib
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from bench_nodes import load_package, synthetic_cutout, synthetic_background
+import reference_nodes
+
+TESTRING = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests", "testring.png")
+
+NODES = ["DropShadow", "Spotlight", "PerfectShadow", "ImageComposite"]
+
+# Options every path starts from
+DEFAULT_OPTIONS = {"backend": "pil", "quality": "full", "tiled": "off", "output_dtype": "float32"}
+
+PATHS = {
+    "pil": {},
+    "torch": {"backend": "torch"},
+    "tiled": {"tiled": "on"},
+    "draft": {"quality": "draft"},
+    "float16": {"output_dtype": "float16"},
+}
+
+# (max, mean) error in 8 bit levels a path may reach in any channel, set by
+# what the path is for:
+#   pil, tiled  the reference pixels, up to a level of rounding
+#   float16     the same, float16 holds a level to within half a level
+#   torch       PIL's filters in float, PIL rounds to 8 bit after every pass
+#   draft       a preview: no bound per pixel (edges move by a reduced
+#               pixel), the mean within 3 levels; a shadow without blur keeps
+#               the edges of the reduced layer, on the small corpus images
+#               they are up to 3 levels of the mean
+TOLERANCES = {"pil": (1.0, 0.1), "tiled": (1.0, 0.1), "float16": (1.5, 0.1), "torch": (4.0, 1.0), "draft": (255.0, 3.0)}
+
+# (max, mean) levels added to the tolerance of a comparison whose parameters
+# select an approximation of the reference:
+#   box            blur_strategy box, two box passes for the Gaussian
+#                  (max 7/255, blur.py)
+#   downsample     blur_strategy downsample, or auto from
+#                  AUTO_DOWNSAMPLE_RADIUS on (max 3/255, blur.py)
+#   oblique smear  PerfectShadow with light from off the axes, the sheared
+#                  smear instead of the pastes along the digital line (max 16
+#                  on hard edges, perfect_shadow.directional_smear)
+APPROXIMATIONS = {"box": (7.0, 1.0), "downsample": (3.0, 2.0), "oblique smear": (16.0, 1.0)}
+
+# float32 level differences of exactly a level come out a little above it
+LEVEL_SLACK = 1e-3
+
+# Options that are not rendering parameters, they stay at their defaults
+FIXED_OPTIONS = {"max_megapixels", "oversize"}
+
+# Grid values that do not follow from the slider range
+GRID_VALUES = {
+    "shadow_angle": list(range(13)),
+    "light_from": list(range(1, 13)),
+    "shadow_color": ["#000000", "#3060c0"],
+    # The reference takes opacity but does not apply it
+    "opacity": [1.0],
+}
+
+
+def corpus(ring_size=256):
+    # (name, [B,H,W,C] image) of the inputs; ring_size scales the real image
+    # down to at most that many pixels per side (0 keeps it)
+    hard = synthetic_cutout(1, 160, 120, seed=2)
+    hard[..., 3] = (hard[..., 3] > 0.5).float()
+    ring = Image.open(TESTRING).convert("RGBA")
+    if ring_size:
+        ring.thumbnail((ring_size, ring_size), Image.LANCZOS)
+    return [
+        ("cutout", synthetic_cutout(2, 160, 120)),
+        ("hard_edges", hard),
+        ("opaque_rgb", synthetic_background(1, 96, 128)),
+        ("testring", torch.from_numpy(np.asarray(ring, dtype=np.float32) / 255)[None]),
+    ]
+
+
+def node_inputs(node_class):
+    # Rendering parameters of a node: name -> grid values, default
+    inputs = node_class.INPUT_TYPES()
+    parameters = {}
+    for name, (kind, *config) in {**inputs["required"], **inputs.get("optional", {})}.items():
+        config = config[0] if config else {}
+        if kind == "IMAGE" or name in FIXED_OPTIONS or name in DEFAULT_OPTIONS:
+            continue
+        default = config.get("default")
+        if name in GRID_VALUES:
+            values = GRID_VALUES[name]
+        elif isinstance(kind, list):
+            values = list(kind)
+        elif "min" in config:
+            values = sorted({config["min"], default, config["max"]})
+        else:
+            values = [default]
+        parameters[name] = (values, default)
+    return parameters
+
+
+def parameter_grid(node_class, grid="quick"):
+    # Keyword arguments of every parameter set
+    parameters = node_inputs(node_class)
+    defaults = {name: default for name, (_, default) in parameters.items()}
+    if grid == "full":
+        names = list(parameters)
+        return [dict(zip(names, values)) for values in itertools.product(*(parameters[name][0] for name in names))]
+    sets = [defaults]
+    for name, (values, default) in parameters.items():
+        sets.extend(dict(defaults, **{name: value}) for value in values if value != default)
+    return sets
+
+
+def path_options(node_class, path):
+    # Node options of a path, None if the node does not have all of them
+    optional = node_class.INPUT_TYPES().get("optional", {})
+    options = PATHS[path]
+    if not all(name in optional for name in options):
+        return None
+    return options
+
+
+def _background(image):
+    # Background of ImageComposite, room for the largest spacing (50 on each side)
+    return synthetic_background(1, image.shape[2] + 100, image.shape[1] * 2)
+
+
+def render(package, node_name, image, params, options):
+    # First output of the node and the wall time, with cold stage caches
+    node = package.NODE_CLASS_MAPPINGS[node_name]()
+    optional = node.INPUT_TYPES().get("optional", {})
+    kwargs = dict(params, **{name: value for name, value in {**DEFAULT_OPTIONS, **options}.items() if name in optional})
+    if node_name == "ImageComposite":
+        kwargs["background_image"] = _background(image)
+        kwargs["subject_image"] = image
+    else:
+        kwargs["image"] = image
+    package.stage_cache.STAGE_CACHE.clear()
+    start = time.perf_counter()
+    result = getattr(node, node.FUNCTION)(**kwargs)[0]
+    return result.cpu().float(), time.perf_counter() - start
+
+
+def _smear_paste():
+    # (code, line) of the paste loop of the reference PerfectShadow
+    function = reference_nodes.perfect_shadow.PerfectShadow.apply_shadow
+    lines, first = inspect.getsourcelines(function)
+    return function.__code__, first + next(i for i, line in enumerate(lines) if "long_shadow.paste(shadow" in line)
+
+
+@contextlib.contextmanager
+def intended_changes():
+    # The frozen nodes with the changes the nodes make on purpose, PIL's
+    # methods are swapped while they render:
+    #   * paste(src, box, src) of RGBA onto RGBA is "over" (compositing.py),
+    #     except the paste loop of PerfectShadow the smear reproduces
+    #   * a shadow (a single color with putalpha) is resized, blurred and
+    #     transformed on its alpha only, in its color (shadow_layer.py)
+    originals = {name: getattr(Image.Image, name) for name in ("paste", "putalpha", "resize", "filter", "transform")}
+    smear_code, smear_line = _smear_paste()
+
+    def paste(self, im, box=None, mask=None):
+        caller = sys._getframe(1)
+        if (mask is not im or self.mode != "RGBA" or getattr(im, "mode", None) != "RGBA"
+                or (caller.f_code is smear_code and caller.f_lineno == smear_line)):
+            return originals["paste"](self, im, box, mask)
+        x, y = box[:2]
+        self.alpha_composite(im, dest=(max(x, 0), max(y, 0)), source=(max(-x, 0), max(-y, 0)))
+
+    def putalpha(self, alpha):
+        originals["putalpha"](self, alpha)
+        bands = self.getextrema()[:3]
+        if all(low == high for low, high in bands):
+            self.shadow_color = tuple(low for low, _ in bands)
+
+    def alpha_only(name):
+        def method(self, *args, **kwargs):
+            color = getattr(self, "shadow_color", None) if self.mode == "RGBA" else None
+            if color is None:
+                return originals[name](self, *args, **kwargs)
+            alpha = originals[name](self.getchannel("A"), *args, **kwargs)
+            shadow = Image.new("RGBA", alpha.size, color)
+            putalpha(shadow, alpha)
+            return shadow
+        return method
+
+    patches = {"paste": paste, "putalpha": putalpha, "resize": alpha_only("resize"),
+               "filter": alpha_only("filter"), "transform": alpha_only("transform")}
+    try:
+        for name, method in patches.items():
+            setattr(Image.Image, name, method)
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(Image.Image, name, method)
+
+
+def render_reference(node_name, image, params):
+    # First output of the frozen node (with the intended changes) and the
+    # wall time. It renders a single item, the items are padded to a common
+    # canvas (zeros at the bottom/right) like the batches of the nodes.
+    node = reference_nodes.NODE_CLASS_MAPPINGS[node_name]()
+    required = node.INPUT_TYPES()["required"]
+    kwargs = {name: value for name, value in params.items() if name in required}
+    function = getattr(node, node.FUNCTION)
+    with intended_changes():
+        start = time.perf_counter()
+        if node_name == "ImageComposite":
+            background = _background(image)
+            items = [function(background_image=background, subject_image=item[None], **kwargs)[0][0] for item in image]
+        else:
+            items = [function(image=item[None], **kwargs)[0][0] for item in image]
+        elapsed = time.perf_counter() - start
+    out = torch.zeros((len(items), max(item.shape[0] for item in items), max(item.shape[1] for item in items), items[0].shape[2]))
+    for item_out, item in zip(out, items):
+        item_out[:item.shape[0], :item.shape[1]] = item
+    return out, elapsed
+
+
+def approximations(package, node_name, params):
+    # Names of the APPROXIMATIONS the parameters select
+    names = []
+    radius = params.get("shadow_blur", 0)
+    if radius > 0:
+        strategy = package.blur.resolve_strategy(radius, params.get("blur_strategy", "auto"))
+        if strategy == "downsample" and package.blur.downsample_factor(radius) == 1:
+            strategy = "exact"
+        if strategy in APPROXIMATIONS:
+            names.append(strategy)
+    if node_name == "PerfectShadow" and params["light_from"] % 3:
+        names.append("oblique smear")
+    return names
+
+
+def case_tolerance(tolerance, names):
+    # (max, mean) of a path tolerance plus the approximations
+    max_error, mean_error = tolerance
+    for name in names:
+        max_error += APPROXIMATIONS[name][0]
+        mean_error += APPROXIMATIONS[name][1]
+    return max_error, mean_error
+
+
+def _premultiplied(image):
+    return torch.cat((image[..., :3] * image[..., 3:], image[..., 3:]), -1)
+
+
+def _edges(alpha):
+    # Pixels whose 3x3 neighborhood is not of one alpha, alpha is [B,H,W]
+    alpha = alpha[:, None]
+    highest = F.max_pool2d(alpha, 3, stride=1, padding=1)
+    lowest = -F.max_pool2d(-alpha, 3, stride=1, padding=1)
+    return (highest > lowest)[:, 0]
+
+
+def compare_outputs(reference, result):
+    # Errors of result against reference (both [B,H,W,C]) in 8 bit levels
+    if reference.shape != result.shape:
+        return {"shape": [list(reference.shape), list(result.shape)]}
+    if reference.shape[-1] == 4:
+        error = (_premultiplied(result) - _premultiplied(reference)).abs() * 255
+    else:
+        error = (result - reference).abs() * 255
+    channels = error.reshape(-1, error.shape[-1])
+    errors = {
+        "max": channels.max(dim=0).values.tolist(),
+        "mean": channels.mean(dim=0).tolist(),
+        "alpha_edge_max": 0.0,
+        "alpha_edge_mean": 0.0,
+    }
+    if reference.shape[-1] == 4:
+        edges = _edges(reference[..., 3])
+        if edges.any():
+            edge_error = error[..., 3][edges]
+            errors["alpha_edge_max"] = edge_error.max().item()
+            errors["alpha_edge_mean"] = edge_error.mean().item()
+    return errors
+
+
+def run_comparisons(nodes=NODES, paths=tuple(PATHS), grid="quick", inputs=None, tolerances=None, report=None):
+    # One result per (node, input, parameter set, path); report(result) is
+    # called as they come in
+    package = load_package()
+    tolerances = dict(TOLERANCES, **(tolerances or {}))
+    inputs = corpus() if inputs is None else inputs
+    results = []
+    for node_name in nodes:
+        node_class = package.NODE_CLASS_MAPPINGS[node_name]
+        node_paths = [(path, path_options(node_class, path)) for path in paths]
+        node_paths = [(path, options) for path, options in node_paths if options is not None]
+        if not node_paths:
+            continue
+        for (input_name, image), params in itertools.product(inputs, parameter_grid(node_class, grid)):
+            reference, reference_s = render_reference(node_name, image, params)
+            names = approximations(package, node_name, params)
+            for path, options in node_paths:
+                result = dict(node=node_name, path=path, input=input_name, params=params, approximations=names,
+                              tolerance=case_tolerance(tolerances[path], names), reference_s=reference_s)
+                try:
+                    output, result["path_s"] = render(package, node_name, image, params, options)
+                except Exception as error:
+                    result.update(status="error", error=f"{type(error).__name__}: {error}")
+                else:
+                    result.update(compare_outputs(reference, output))
+                    max_error, mean_error = result["tolerance"]
+                    ok = ("shape" not in result and max(result["max"]) <= max_error + LEVEL_SLACK
+                          and max(result["mean"]) <= mean_error + LEVEL_SLACK)
+                    result["status"] = "ok" if ok else "fail"
+                results.append(result)
+                if report is not None:
+                    report(result)
+    return results
+
+
+def _describe(result):
+    params = " ".join(f"{name}={value}" for name, value in result["params"].items())
+    return f"{result['node']} {result['path']} {result['input']} {params}"
+
+
+def summarize(results):
+    # One line per node and path: worst errors, failures and the times
+    lines = []
+    groups = {}
+    for result in results:
+        groups.setdefault((result["node"], result["path"]), []).append(result)
+    for (node, path), group in groups.items():
+        compared = [result for result in group if "max" in result]
+        failed = sum(result["status"] != "ok" for result in group)
+        worst = np.max([result["max"] for result in compared], axis=0) if compared else []
+        mean = np.mean([result["mean"] for result in compared], axis=0) if compared else []
+        edge = max((result["alpha_edge_max"] for result in compared), default=0.0)
+        reference_s = sum(result["reference_s"] for result in group)
+        path_s = sum(result.get("path_s", 0.0) for result in group)
+        lines.append(
+            f"{node:15} {path:8} {len(group):5} cases {failed:4} failed  "
+            f"max {'/'.join(f'{v:.1f}' for v in worst):19}  mean {'/'.join(f'{v:.2f}' for v in mean):23}  "
+            f"edge {edge:5.1f}  {reference_s * 1000:8.0f} -> {path_s * 1000:8.0f} ms ({reference_s / max(path_s, 1e-9):.2f}x)"
+        )
+    return lines
+
+
+def _tolerance(value):
+    # PATH=MAX[,MEAN]; the mean keeps its default when only the max is given
+    path, _, levels = value.partition("=")
+    if path not in PATHS:
+        raise argparse.ArgumentTypeError(f"Unknown path: {path}")
+    max_error, _, mean_error = levels.partition(",")
+    return path, (float(max_error), float(mean_error) if mean_error else TOLERANCES[path][1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", nargs="+", choices=NODES, default=NODES)
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    parser.add_argument("--grid", choices=["quick", "full"], default="quick")
+    parser.add_argument("--ring-size", type=int, default=256, help="largest side of testring.png (0: original size)")
+    parser.add_argument("--tolerance", type=_tolerance, action="append", default=[], metavar="PATH=MAX[,MEAN]",
+                        help="max (and mean) error of a path in 8 bit levels")
+    parser.add_argument("--verbose", action="store_true", help="print every comparison")
+    parser.add_argument("--output", help="write every comparison as JSON")
+    args = parser.parse_args(argv)
+
+    def report(result):
+        if args.verbose or result["status"] != "ok":
+            errors = result.get("error") or (f"canvas {result['shape']}" if "shape" in result else
+                                             f"max {'/'.join(f'{v:.1f}' for v in result['max'])} edge {result['alpha_edge_max']:.1f}")
+            timing = f"{result['reference_s'] * 1000:.0f} -> {result.get('path_s', 0.0) * 1000:.0f} ms"
+            if result["status"] == "fail":
+                timing += ", tolerance {:.1f}/{:.2f}".format(*result["tolerance"])
+            print(f"{result['status'].upper():5} {_describe(result)}: {errors} ({timing})")
+
+    tolerances = dict(TOLERANCES, **dict(args.tolerance))
+    results = run_comparisons(args.nodes, args.paths, args.grid, corpus(args.ring_size), tolerances, report)
+    print("\n".join(summarize(results)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"default_options": DEFAULT_OPTIONS, "paths": PATHS, "tolerances": tolerances,
+                       "approximations": APPROXIMATIONS, "results": results}, f, indent=1)
+    failed = sum(result["status"] != "ok" for result in results)
+    if failed:
+        print(f"{failed} of {len(results)} comparisons beyond their tolerance")
+        return 1
+    print(f"All {len(results)} comparisons within their tolerance")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
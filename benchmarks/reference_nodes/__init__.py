@@ -0,0 +1,11 @@
+# Frozen copies of DropShadow, Spotlight, PerfectShadow and ImageComposite as
+# they were before the performance work (baseline commit bd06a0b), the
+# reference of equivalence.py. They are not edited: every change of the
+# nodes is measured against them. They render a single item; PerfectShadow
+# takes opacity but does not apply it.
+from .image_composite import NODE_CLASS_MAPPINGS as image_composite_mappings
+from .drop_shadow import NODE_CLASS_MAPPINGS as drop_shadow_mappings
+from .spotlight import NODE_CLASS_MAPPINGS as spotlight_mappings
+from .perfect_shadow import NODE_CLASS_MAPPINGS as perfect_shadow_mappings
+
+NODE_CLASS_MAPPINGS = {**image_composite_mappings, **drop_shadow_mappings, **spotlight_mappings, **perfect_shadow_mappings}
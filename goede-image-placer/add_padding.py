@@ -1,6 +1,9 @@
 import torch
-from PIL import Image
-import numpy as np
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
 
 class AddPadding:
     @classmethod
@@ -39,34 +42,40 @@ class AddPadding:
             },
         }
 
-    RETURN_TYPES = ("IMAGE", "IMAGE",)
-    RETURN_NAMES = ("image_4_channel", "image_3_channel",)
+    RETURN_TYPES = ("IMAGE", "IMAGE", "MASK",)
+    RETURN_NAMES = ("image_4_channel", "image_3_channel", "mask",)
     FUNCTION = "add_padding"
 
     CATEGORY = "Goede"
 
+    @profiling.profiled("AddPadding")
     def add_padding(self, image, left, top, right, bottom):
-        # Convert tensor to PIL image
-        pil_image = Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
-
-        # Calculate new dimensions
-        new_width = pil_image.width + left + right
-        new_height = pil_image.height + top + bottom
-
-        # Create a new image with transparent background
-        padded_image = Image.new("RGBA", (new_width, new_height), (0, 0, 0, 0))
+        # Plain tensor padding: the whole batch is written once into a
+        # transparent canvas, on the device and with the dtype of the input
+        image = torch.as_tensor(image)
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+        batch_size, height, width, channels = image.shape
 
-        # Paste the original image
-        padded_image.paste(pil_image, (left, top))
+        with profiling.stage("pad") as s:
+            padded = image.new_zeros((batch_size, height + top + bottom, width + left + right, 4))
+            region = padded[:, top:top + height, left:left + width]
+            region[..., :3] = image[..., :3]
+            # Images without alpha are opaque within the original area
+            if channels == 4:
+                region[..., 3] = image[..., 3]
+            else:
+                region[..., 3] = 1.0
+            s.output(padded)
 
-        # Convert to 4-channel tensor
-        image_4_channel_tensor = torch.from_numpy(np.array(padded_image).astype(np.float32) / 255.0).unsqueeze(0)
+        # The 3-channel image is a view of the same buffer
+        image_3_channel = padded[..., :3]
 
-        # Convert to 3-channel image
-        image_3_channel = padded_image.convert("RGB")
-        image_3_channel_tensor = torch.from_numpy(np.array(image_3_channel).astype(np.float32) / 255.0).unsqueeze(0)
+        # ComfyUI masks are 1 - alpha (like LoadImage): the padding is masked
+        with profiling.stage("mask") as s:
+            mask = s.output(1.0 - padded[..., 3])
 
-        return (image_4_channel_tensor, image_3_channel_tensor,)
+        return (padded, image_3_channel, mask,)
 
 NODE_CLASS_MAPPINGS = {
     "AddPadding": AddPadding
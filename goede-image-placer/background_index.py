@@ -0,0 +1,272 @@
+"""Index of the background library in images/.
+
+An SQLite file next to the images records, per background, the size and mode,
+a content hash, the mtime and file size it was scanned at, the mean color and
+a small JPEG thumbnail. Listing and filtering read only the index, no image is
+opened:
+
+    python goede-image-placer/background_index.py              refresh the index
+    python goede-image-placer/background_index.py --list --min-width 3000
+
+update() is incremental: files whose mtime and size match their row are not
+opened, new and changed files are scanned (on the thread pool of the nodes),
+rows of removed files are dropped. The nodes of image_selector.py only read
+the index; refresh_index() updates it on a background thread when the
+directory changed (files rewritten under the same name are picked up by the
+command above).
+"""
+import io
+import os
+import sys
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+import contextlib
+from collections import namedtuple
+from urllib.request import pathname2url
+
+from PIL import Image, ImageColor, ImageStat
+
+try:
+    from . import parallel
+except ImportError:
+    import parallel
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images")
+
+INDEX_NAME = ".goede_index.sqlite"
+THUMBNAIL_SIZE = 128
+SCHEMA_VERSION = 1
+
+ORIENTATIONS = ["portrait", "landscape", "square"]
+
+# width, height and mode are None for files PIL cannot read; they are kept so
+# that the file is not opened again until it changes
+Entry = namedtuple("Entry", ["name", "mtime_ns", "file_size", "width", "height", "mode", "content_hash", "mean_color"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backgrounds (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    content_hash TEXT NOT NULL,
+    mean_color TEXT,
+    thumbnail BLOB
+)
+"""
+
+_COLUMNS = ", ".join(Entry._fields)
+
+
+# Directory listing, valid as long as the mtime of the directory is unchanged.
+# Hidden files (e.g. the index) are not listed.
+_listing_lock = threading.Lock()
+_listing = (None, [])
+
+
+def list_images(image_dir=IMAGE_DIR):
+    global _listing
+    mtime = os.stat(image_dir).st_mtime_ns
+    with _listing_lock:
+        if _listing[0] != (image_dir, mtime):
+            with os.scandir(image_dir) as entries:
+                image_files = sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith("."))
+            _listing = ((image_dir, mtime), image_files)
+        return list(_listing[1])
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def scan_file(path):
+    # (width, height, mode, content_hash, mean_color, thumbnail) of one file
+    content_hash = file_hash(path)
+    try:
+        with Image.open(path) as image:
+            width, height, mode = image.width, image.height, image.mode
+            # JPEGs decode at 1/8 of the size at most for the thumbnail
+            image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            thumbnail = image.convert("RGB")
+    except (OSError, SyntaxError, ValueError):
+        return None, None, None, content_hash, None, None
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    mean_color = "#%02x%02x%02x" % tuple(round(c) for c in ImageStat.Stat(thumbnail).mean)
+    data = io.BytesIO()
+    thumbnail.save(data, format="JPEG", quality=85)
+    return width, height, mode, content_hash, mean_color, data.getvalue()
+
+
+class BackgroundIndex:
+    def __init__(self, image_dir=IMAGE_DIR, path=None):
+        self.image_dir = image_dir
+        self.path = path or os.path.join(image_dir, INDEX_NAME)
+
+    def _connect(self):
+        # For writing, the file and the table are created
+        db = sqlite3.connect(self.path)
+        if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # An index of another version is rebuilt
+            db.execute("DROP TABLE IF EXISTS backgrounds")
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.execute(_SCHEMA)
+        return contextlib.closing(db)
+
+    def _read(self, sql, parameters=()):
+        # Rows of a query on the index as it is, opened read-only (nothing is
+        # created or locked for writing); none before the first update
+        if not os.path.exists(self.path):
+            return []
+        with contextlib.closing(sqlite3.connect(f"file:{pathname2url(self.path)}?mode=ro", uri=True)) as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                return []
+            return db.execute(sql, parameters).fetchall()
+
+    def update(self):
+        # Brings the index in line with the directory; returns the number of
+        # added, updated, removed and unchanged files
+        names = list_images(self.image_dir)
+        with self._connect() as db:
+            known = {name: (mtime_ns, file_size) for name, mtime_ns, file_size in
+                     db.execute("SELECT name, mtime_ns, file_size FROM backgrounds")}
+            stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+            pending = []
+            for name in names:
+                stat = os.stat(os.path.join(self.image_dir, name))
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if known.get(name) == signature:
+                    stats["unchanged"] += 1
+                else:
+                    stats["updated" if name in known else "added"] += 1
+                    pending.append((name, signature))
+
+            scanned = parallel.map_items(lambda item: scan_file(os.path.join(self.image_dir, item[0])), pending)
+            with db:
+                db.executemany(
+                    f"INSERT OR REPLACE INTO backgrounds ({_COLUMNS}, thumbnail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(name,) + signature + result for (name, signature), result in zip(pending, scanned)]
+                )
+                removed = set(known) - set(names)
+                db.executemany("DELETE FROM backgrounds WHERE name = ?", [(name,) for name in removed])
+            stats["removed"] = len(removed)
+        return stats
+
+    def entries(self):
+        # Every readable background, by name
+        rows = self._read(f"SELECT {_COLUMNS} FROM backgrounds WHERE width IS NOT NULL ORDER BY name")
+        return [Entry(*row) for row in rows]
+
+    def unreadable(self):
+        # Names of the files PIL could not read
+        return {name for name, in self._read("SELECT name FROM backgrounds WHERE width IS NULL")}
+
+    def get(self, name):
+        rows = self._read(f"SELECT {_COLUMNS} FROM backgrounds WHERE name = ?", (name,))
+        return Entry(*rows[0]) if rows else None
+
+    def thumbnail(self, name):
+        # PIL image of at most THUMBNAIL_SIZE pixels per side, None if unknown
+        rows = self._read("SELECT thumbnail FROM backgrounds WHERE name = ?", (name,))
+        if not rows or rows[0][0] is None:
+            return None
+        return Image.open(io.BytesIO(rows[0][0]))
+
+    def find(self, min_width=0, min_height=0, orientation=None, color=None, color_distance=64):
+        # Backgrounds at least min_width x min_height, of an orientation
+        # ("portrait", "landscape" or "square"), with a mean color within
+        # color_distance (euclidean, 8 bit RGB) of color
+        entries = [entry for entry in self.entries() if entry.width >= min_width and entry.height >= min_height]
+        if orientation is not None:
+            entries = [entry for entry in entries if _orientation(entry) == orientation]
+        if color is not None:
+            target = ImageColor.getrgb(color)[:3]
+            entries = [entry for entry in entries if _distance(ImageColor.getrgb(entry.mean_color), target) <= color_distance]
+        return entries
+
+
+# Background refreshes: directory -> (listing it was started for, thread)
+_refresh_lock = threading.Lock()
+_refreshes = {}
+
+
+def refresh_index(image_dir=IMAGE_DIR):
+    # Starts an update() of the index of image_dir on a background thread if
+    # files were added or removed since the last one; returns the running
+    # thread, None if there is nothing to do. Costs the cached listing.
+    names = list_images(image_dir)
+    with _refresh_lock:
+        last = _refreshes.get(image_dir)
+        if last is not None and last[1].is_alive():
+            return last[1]
+        if last is not None and last[0] == names:
+            return None
+        thread = threading.Thread(target=_refresh, args=(image_dir,), name="goede-background-index", daemon=True)
+        _refreshes[image_dir] = (names, thread)
+        thread.start()
+        return thread
+
+
+def wait_for_refresh(image_dir=IMAGE_DIR):
+    # Brings the index of image_dir up to date (as far as the listing tells)
+    # before returning
+    thread = refresh_index(image_dir)
+    while thread is not None:
+        thread.join()
+        thread = refresh_index(image_dir)
+
+
+def _refresh(image_dir):
+    try:
+        stats = BackgroundIndex(image_dir).update()
+    except (sqlite3.Error, OSError) as error:
+        logger.warning("Background index of %s not updated (%s)", image_dir, error)
+    else:
+        logger.info("Background index of %s: %s", image_dir, stats)
+
+
+def _orientation(entry):
+    if entry.width == entry.height:
+        return "square"
+    return "portrait" if entry.height > entry.width else "landscape"
+
+
+def _distance(a, b):
+    return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default=IMAGE_DIR, help="background directory (default: images/)")
+    parser.add_argument("--index", help=f"index file (default: {INDEX_NAME} in the directory)")
+    parser.add_argument("--list", action="store_true", help="list the indexed backgrounds instead of updating")
+    parser.add_argument("--min-width", type=int, default=0)
+    parser.add_argument("--min-height", type=int, default=0)
+    parser.add_argument("--orientation", choices=ORIENTATIONS)
+    parser.add_argument("--color", help="mean color close to this one, e.g. #e0d8c8")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.images):
+        parser.error(f"Not a directory: {args.images}")
+
+    index = BackgroundIndex(args.images, args.index)
+    if args.list:
+        for entry in index.find(args.min_width, args.min_height, args.orientation, args.color):
+            print(f"{entry.name}\t{entry.width}x{entry.height}\t{entry.mode}\t{entry.mean_color}")
+        return 0
+    stats = index.update()
+    print(f"{stats['added']} added, {stats['updated']} updated, {stats['removed']} removed, {stats['unchanged']} unchanged")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
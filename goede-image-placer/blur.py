@@ -0,0 +1,105 @@
+import math
+
+from PIL import Image, ImageFilter
+
+# Blur backend shared by the shadow nodes. Shadows are a single color with an
+# alpha channel, so only the alpha ("L") channel is blurred.
+#
+# Strategies (radius is the Gaussian standard deviation, like PIL's
+# GaussianBlur):
+#   exact       PIL GaussianBlur, the reference the nodes always used.
+#   box         two box blur passes with the same variance (a tent filter).
+#               Slightly cheaper than exact. Max error: 7/255.
+#   downsample  box-reduce by an integer factor so that the remaining radius
+#               is at least DOWNSAMPLE_MIN_RADIUS, blur exactly, and upsample
+#               bilinearly. Cost shrinks with the factor squared.
+#               Max error: 3/255.
+#   auto        exact below AUTO_DOWNSAMPLE_RADIUS, downsample above.
+# The error bounds hold for silhouettes with transparent margins (hard 0/255
+# edges are the worst case) and are checked by tests/test_blur.py. Noise
+# right at the image border can be off by more, PIL clamps the border pixel.
+
+BLUR_STRATEGIES = ["auto", "exact", "box", "downsample"]
+
+AUTO_DOWNSAMPLE_RADIUS = 24
+DOWNSAMPLE_MIN_RADIUS = 8
+
+
+def choose_strategy(radius):
+    if radius < AUTO_DOWNSAMPLE_RADIUS:
+        return "exact"
+    return "downsample"
+
+
+def downsample_factor(radius):
+    return max(1, int(radius // DOWNSAMPLE_MIN_RADIUS))
+
+
+def box_half_width(radius):
+    # Two passes of a box with variance radius^2 / 2 each; BoxBlur takes the
+    # half width, a box of width w has variance (w^2 - 1) / 12
+    return (math.sqrt(6 * radius * radius + 1) - 1) / 2
+
+
+def downsample_radius(radius, factor):
+    # The box reduce and the bilinear upsample add a variance of f^2/12 and
+    # f^2/6, the blur on the small image makes up the rest
+    return math.sqrt(max(radius * radius - factor * factor / 4, 0)) / factor
+
+
+def _box_blur(alpha, radius):
+    half_width = box_half_width(radius)
+    return alpha.filter(ImageFilter.BoxBlur(half_width)).filter(ImageFilter.BoxBlur(half_width))
+
+
+def _downsample_blur(alpha, radius):
+    factor = downsample_factor(radius)
+    if factor == 1:
+        return alpha.filter(ImageFilter.GaussianBlur(radius))
+    width, height = alpha.size
+    small = alpha.reduce(factor)
+    small = small.filter(ImageFilter.GaussianBlur(downsample_radius(radius, factor)))
+    return small.resize((width, height), Image.BILINEAR, box=(0, 0, width / factor, height / factor))
+
+
+def resolve_strategy(radius, strategy):
+    if strategy == "auto":
+        return choose_strategy(radius)
+    return strategy
+
+
+def blur_margin(radius, strategy="auto"):
+    # How far (in pixels) a blur spreads a silhouette. A region padded with
+    # this many transparent pixels blurs exactly like the full canvas.
+    if radius <= 0:
+        return 0
+    strategy = resolve_strategy(radius, strategy)
+    if strategy == "box":
+        return 2 * (math.ceil(box_half_width(radius)) + 2)
+    if strategy == "downsample" and downsample_factor(radius) > 1:
+        factor = downsample_factor(radius)
+        return factor * (3 * (math.ceil(downsample_radius(radius, factor)) + 2) + 2)
+    # PIL's GaussianBlur: three extended box passes of at most radius + 2
+    return 3 * (math.ceil(radius) + 2)
+
+
+def blur_alignment(radius, strategy="auto"):
+    # Regions blurred on their own must start on multiples of this, so that
+    # the downsample strategy reduces the same pixel blocks as on the canvas
+    if radius > 0 and resolve_strategy(radius, strategy) == "downsample":
+        return downsample_factor(radius)
+    return 1
+
+
+def blur_alpha(alpha, radius, strategy="auto"):
+    # alpha is an "L" image, the blurred "L" image is returned
+    if radius <= 0:
+        return alpha
+    strategy = resolve_strategy(radius, strategy)
+    if strategy == "exact":
+        return alpha.filter(ImageFilter.GaussianBlur(radius))
+    if strategy == "box":
+        return _box_blur(alpha, radius)
+    if strategy == "downsample":
+        return _downsample_blur(alpha, radius)
+    raise ValueError(f"Unknown blur strategy: {strategy}")
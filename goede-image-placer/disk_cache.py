@@ -0,0 +1,135 @@
+import os
+import hashlib
+import logging
+import threading
+import tempfile
+
+import numpy as np
+
+# Decoded images on disk, for backgrounds that are used again and again. A
+# decoded image is stored once as an 8 bit .npy file (the exact pixels of the
+# decode, a quarter of the float32 size); a later load memory-maps it, so
+# the only work left is the conversion to the float tensor, and pages that are
+# already in the OS cache are not read again.
+#
+# GOEDE_DECODE_CACHE_DIR enables the cache (off when unset),
+# GOEDE_DECODE_CACHE_MB caps its size (default 4096). The key of an entry
+# contains the mtime and size of the source file, so a changed file gets a
+# new entry and the stale one ages out: when the cap is exceeded, the entries
+# that were used longest ago (their mtime is touched on every hit) are removed.
+# The directory is created on the first write; if that fails, a warning is
+# logged and the cache stays off (decoding works as without it).
+
+DEFAULT_MAX_MB = 4096
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._created = False
+        self.enabled = True
+
+    @classmethod
+    def from_env(cls):
+        directory = os.environ.get("GOEDE_DECODE_CACHE_DIR")
+        if not directory:
+            return None
+        try:
+            max_mb = float(os.environ.get("GOEDE_DECODE_CACHE_MB", DEFAULT_MAX_MB))
+        except ValueError as error:
+            logger.warning("Decode cache disabled, invalid GOEDE_DECODE_CACHE_MB: %s", error)
+            return None
+        return cls(directory, int(max_mb * 1024 * 1024))
+
+    def _create_directory(self):
+        # True once the directory exists; disables the cache if it cannot
+        # be created
+        with self._lock:
+            if not self._created and self.enabled:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._created = True
+                except OSError as error:
+                    logger.warning("Decode cache disabled, cannot create %s: %s", self.directory, error)
+                    self.enabled = False
+            return self._created
+
+    def path(self, key):
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest + ".npy")
+
+    def get(self, key):
+        # Read-only memory map of the array, None on a miss
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes or not self._create_directory():
+            return
+        path = self.path(key)
+        # Written under a temporary name, concurrent readers never see a
+        # partial file
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(temporary, path)
+        except OSError as error:
+            logger.warning("Could not write %s: %s", path, error)
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every entry, least recently used first
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".npy"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    # A memory map that is still open keeps its pages
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
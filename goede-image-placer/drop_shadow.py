@@ -1,7 +1,85 @@
 import torch
-from PIL import Image, ImageFilter, ImageOps
+from PIL import ImageOps
 import numpy as np
 import math
+import functools
+
+try:
+    from .image_utils import image_batch_to_rgba, image_to_numpy, alpha_image, uint8_batch_to_tensor
+    from .blur import BLUR_STRATEGIES
+    from .shadow_layer import blurred_layer, ellipse_layer, placed_layer, draft_alpha, upsample_layer, QUALITIES, DRAFT_FACTOR
+    from .stage_cache import STAGE_CACHE, content_hash
+    from .memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    from . import torch_backend
+    from . import compositing
+    from . import tiling
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_batch_to_rgba, image_to_numpy, alpha_image, uint8_batch_to_tensor
+    from blur import BLUR_STRATEGIES
+    from shadow_layer import blurred_layer, ellipse_layer, placed_layer, draft_alpha, upsample_layer, QUALITIES, DRAFT_FACTOR
+    from stage_cache import STAGE_CACHE, content_hash
+    from memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    import torch_backend
+    import compositing
+    import tiling
+    import profiling
+    import parallel
+
+# Die Schattenellipse ist etwas weniger gestaucht
+ELLIPSE_SCALE = 0.6
+
+# Every value of the shadow_angle slider (clock hours)
+SHADOW_ANGLES = tuple(range(13))
+
+def ray_direction(shadow_angle):
+    # Direction of the contour search: towards the light
+    light_angle = (shadow_angle - 3) * 30
+    angle_rad = math.radians(light_angle)
+    return math.cos(angle_rad), math.sin(angle_rad)
+
+@functools.lru_cache(maxsize=32)
+def contour_rays(width, height, shadow_angles=SHADOW_ANGLES):
+    # Pixels the contour search visits, from the center outwards, one row per
+    # angle: xs, ys [angles, max_radius] and the number of pixels of each ray
+    # before the first one outside of the image
+    cx, cy = width // 2, height // 2
+    max_radius = int(1.5 * max(cx, cy))
+    r = np.arange(max_radius, dtype=np.float64)
+    dx, dy = np.array([ray_direction(angle) for angle in shadow_angles]).reshape(-1, 2).T
+    xs = np.rint(cx + r * dx[:, None]).astype(np.intp)
+    ys = np.rint(cy + r * dy[:, None]).astype(np.intp)
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    if max_radius == 0:
+        # 1 px wide or high: nothing to search (see contour_points)
+        lengths = np.zeros(len(xs), dtype=np.intp)
+    else:
+        lengths = np.where(inside.all(axis=1), max_radius, np.argmin(inside, axis=1))
+    xs = np.clip(xs, 0, max(width - 1, 0))
+    ys = np.clip(ys, 0, max(height - 1, 0))
+    for array in (xs, ys, lengths):
+        array.flags.writeable = False
+    return xs, ys, lengths
+
+def contour_points(transparent, width, height, shadow_angles=SHADOW_ANGLES):
+    # Edge point per angle from the pixels sampled along contour_rays()
+    # (transparent: [angles, max_radius] booleans): the last pixel of the ray
+    # before the first transparent one (the center itself does not count),
+    # the center if the ray leaves the image first
+    xs, ys, lengths = contour_rays(width, height, shadow_angles)
+    points = np.empty((len(xs), 2), dtype=np.intp)
+    points[:] = (width // 2, height // 2)
+    if xs.shape[1] == 0:
+        return points
+    r = np.arange(xs.shape[1])
+    hits = np.asarray(transparent) & (r > 0) & (r < lengths[:, None])
+    found = hits.any(axis=1)
+    first = np.argmax(hits, axis=1)
+    rows = np.flatnonzero(found)
+    points[rows, 0] = xs[rows, first[rows] - 1]
+    points[rows, 1] = ys[rows, first[rows] - 1]
+    return points
 
 class DropShadow:
     @classmethod
@@ -41,6 +119,32 @@ class DropShadow:
                     "default": "#000000"
                 }),
             },
+            "optional": {
+                "blur_strategy": (BLUR_STRATEGIES, {
+                    "default": "auto"
+                }),
+                "backend": (torch_backend.BACKENDS, {
+                    "default": "auto"
+                }),
+                "output_dtype": (OUTPUT_DTYPES, {
+                    "default": "float32"
+                }),
+                "max_megapixels": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 10000.0,
+                    "step": 1.0
+                }),
+                "oversize": (OVERSIZE_POLICIES, {
+                    "default": "downscale"
+                }),
+                "quality": (QUALITIES, {
+                    "default": "full"
+                }),
+                "tiled": (tiling.TILING_MODES, {
+                    "default": "auto"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -48,100 +152,247 @@ class DropShadow:
 
     CATEGORY = "Goede"
 
-    def add_shadow(self, image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color):
-        # Convert tensor to PIL image
-        image_pil = Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+    @profiling.profiled("DropShadow")
+    def add_shadow(self, image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", backend="auto",
+                   output_dtype="float32", max_megapixels=0.0, oversize="downscale", quality="full", tiled="auto"):
+        limit = MemoryLimit(max_megapixels, oversize, output_dtype)
+        if torch_backend.resolve_backend(backend, image) == "torch":
+            # Stays on the device of the input
+            composites = self.render_torch(image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality)
+            return (torch_backend.planes_to_image(torch_backend.stack_planes(composites)).to(limit.dtype),)
+
+        # [B,H,W,C] (unbatched images get a batch axis), a view of CPU
+        # float32 tensors. The largest canvas the edge point can lead to decides
+        image = image_to_numpy(image)
+        height, width = image.shape[1:3]
+        canvas_sizes = self._corner_canvas_sizes(width, height, *self._offset(shadow_angle, shadow_distance), shadow_scale)
+        largest = (max(w for w, _ in canvas_sizes), max(h for _, h in canvas_sizes))
+        use_tiles = tiling.use_tiles(tiled, largest)
+        limit.check_peak(largest, len(image), use_tiles)
+        if use_tiles:
+            return (self.render_tiled(image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality),)
 
-        # Ensure image is RGBA
-        if image_pil.mode != 'RGBA':
-            image_pil = image_pil.convert('RGBA')
+        composite_images = self.render_pil(image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality)
+        # Items can end up with different canvas sizes, they are padded to a common one
+        composite_tensor = uint8_batch_to_tensor(composite_images, limit.dtype)
+        return (composite_tensor,)
+
+    def _offset(self, shadow_angle, shadow_distance):
+        # Richtungen hängen nur von den Parametern ab und gelten für den ganzen Batch
+        light_angle = (shadow_angle - 3) * 30
+        shadow_dir = (light_angle + 180) % 360
+        angle_rad_shadow = math.radians(shadow_dir)
+        offset_x = int(round(math.cos(angle_rad_shadow) * shadow_distance))
+        offset_y = int(round(math.sin(angle_rad_shadow) * shadow_distance))
+        return offset_x, offset_y
+
+    def render_pil(self, image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", limit=None, quality="full"):
+        # Subject with shadow as one RGBA uint8 array per batch item (PIL
+        # renders the shadow stages)
+        offset_x, offset_y = self._offset(shadow_angle, shadow_distance)
+        limit = limit or MemoryLimit()
+        return parallel.map_items(
+            lambda image_np: self._add_shadow_single(image_np, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality),
+            image_batch_to_rgba(image)
+        )
 
-        # Extract alpha channel to create shadow
-        alpha = image_pil.getchannel('A')
-        shadow = Image.new('RGBA', image_pil.size, color=shadow_color)
-        shadow.putalpha(alpha)
+    def render_tiled(self, image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", limit=None, quality="full"):
+        # Same output tensor as render_pil() and uint8_batch_to_tensor(), the
+        # items rendered strip by strip straight into it (see tiling)
+        offset_x, offset_y = self._offset(shadow_angle, shadow_distance)
+        limit = limit or MemoryLimit()
+        items = image_to_numpy(image)
+        layouts = parallel.map_items(
+            lambda item: self._layout(tiling.alpha_channel(item), shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, blur_strategy, limit, quality, tiling.STRIP_ROWS),
+            items
+        )
+        out = tiling.allocate([size for _, _, _, size in layouts], 4, limit.dtype)
+        for item, item_out, (shadow_layer, shadow_position, (image_x, image_y), (width, height)) in zip(items, out, layouts):
+            shadow = placed_layer(shadow_layer, shadow_color, *shadow_position)
+            tiling.render_strips(
+                item_out[:height, :width],
+                lambda y0, y1: [shadow, tiling.subject_layer(item, image_x, image_y, y0, y1)]
+            )
+        return out
 
+    def render_torch(self, image, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", limit=None, quality="full"):
+        # Subject with shadow as [4,H,W] planes per batch item, on the device of the input
+        offset_x, offset_y = self._offset(shadow_angle, shadow_distance)
+        limit = limit or MemoryLimit()
+        return [
+            self._add_shadow_torch(planes, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality)
+            for planes in torch_backend.image_planes(image)
+        ]
+
+    def _contour_point(self, alpha, alpha_key, shadow_angle):
+        w, h = alpha.size
+        if shadow_angle in SHADOW_ANGLES:
+            shadow_angles = SHADOW_ANGLES
+            key = ("contour", alpha_key)
+        else:
+            shadow_angles = (shadow_angle,)
+            key = ("contour", alpha_key, shadow_angle)
+
+        def search():
+            with profiling.stage("contour") as s:
+                xs, ys, _ = contour_rays(w, h, shadow_angles)
+                return s.output(contour_points(np.asarray(alpha)[ys, xs] == 0, w, h, shadow_angles))
+
+        points = STAGE_CACHE.get_or_compute(key, search)
+        return tuple(int(v) for v in points[shadow_angles.index(shadow_angle)])
+
+    def _shadow_offset(self, width, height, shadow_width, shadow_height, edge_x, edge_y, offset_x, offset_y, shadow_scale):
+        # Position of the (scaled, elliptic) shadow relative to the image, the
+        # edge point found by the contour search ends up under the subject
+        cx, cy = width // 2, height // 2
         # Schatten ggf. skalieren (um Mittelpunkt)
         if shadow_scale != 1.0:
-            cx, cy = image_pil.width // 2, image_pil.height // 2
-            new_w = int(shadow.width * shadow_scale)
-            new_h = int(shadow.height * shadow_scale)
-            shadow = shadow.resize((new_w, new_h), Image.LANCZOS)
+            new_w = int(width * shadow_scale)
+            new_h = int(height * shadow_scale)
             scale_offset_x = cx - new_w // 2
             scale_offset_y = cy - new_h // 2
         else:
             scale_offset_x = 0
             scale_offset_y = 0
+        scale_offset_y = int(scale_offset_y * ELLIPSE_SCALE)
+        if shadow_scale != 1.0:
+            new_w = shadow_width
+            new_h = shadow_height
+            new_cx, new_cy = new_w // 2, int(new_h // 2)
+            edge_x = int((edge_x - cx) * shadow_scale + new_cx)
+            edge_y = int((edge_y - cy) * shadow_scale * ELLIPSE_SCALE + new_cy)
+        else:
+            edge_y = int(edge_y * ELLIPSE_SCALE)
+        total_offset_x = scale_offset_x + (edge_x - width // 2) + offset_x
+        total_offset_y = scale_offset_y + (edge_y - height // 2) + offset_y
+        return total_offset_x, total_offset_y
 
-        # Schatten weichzeichnen
-        if shadow_blur > 0:
-            shadow = shadow.filter(ImageFilter.GaussianBlur(shadow_blur))
+    def _canvas_size(self, width, height, edge_x, edge_y, offset_x, offset_y, shadow_scale):
+        # Output canvas of one item, known before any shadow stage runs
+        shadow_width = int(width * shadow_scale)
+        shadow_height = int(int(height * shadow_scale) * ELLIPSE_SCALE)
+        total_offset_x, total_offset_y = self._shadow_offset(
+            width, height, shadow_width, shadow_height, edge_x, edge_y, offset_x, offset_y, shadow_scale
+        )
+        return (max(width, total_offset_x + shadow_width) - min(0, total_offset_x),
+                max(height, total_offset_y + shadow_height) - min(0, total_offset_y))
+
+    def _corner_canvas_sizes(self, width, height, offset_x, offset_y, shadow_scale):
+        # Output canvas for an edge point in each corner of the image
+        corners = [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]
+        return [self._canvas_size(width, height, x, y, offset_x, offset_y, shadow_scale) for x, y in corners]
+
+    def _shadow_layer(self, alpha, alpha_key, shadow_scale, shadow_blur, blur_strategy, quality="full", strip_rows=0):
+        if quality == "draft":
+            # Same stages on the reduced alpha, upsampled to the full size layer
+            reduced, draft_key = draft_alpha(alpha, alpha_key)
+            layer = self._shadow_layer(reduced, draft_key, shadow_scale, shadow_blur / DRAFT_FACTOR, blur_strategy, strip_rows=strip_rows)
+            w, h = alpha.size
+            return upsample_layer(layer, int(w * shadow_scale), int(int(h * shadow_scale) * ELLIPSE_SCALE))
 
-        # --- Robuste Konturpunktsuche an der gewünschten Uhrzeit-Position ---
-        light_angle = (shadow_angle - 3) * 30
-        shadow_dir = (light_angle + 180) % 360
-        angle_rad = math.radians(light_angle)
-        dx = math.cos(angle_rad)
-        dy = math.sin(angle_rad)
-        alpha_np = np.array(alpha)
-        h, w = alpha_np.shape
-        cx, cy = w // 2, h // 2
-        max_radius = int(1.5 * max(cx, cy))
-        edge_x, edge_y = cx, cy
-        found = False
-        for r in range(0, max_radius):
-            x = int(round(cx + r * dx))
-            y = int(round(cy + r * dy))
-            if 0 <= x < w and 0 <= y < h:
-                if alpha_np[y, x] == 0 and r > 0:
-                    edge_x = int(round(cx + (r-1) * dx))
-                    edge_y = int(round(cy + (r-1) * dy))
-                    found = True
-                    break
-            else:
-                break  # Aus dem Bild raus
-        if not found or not (0 <= edge_x < w and 0 <= edge_y < h):
-            edge_x = cx
-            edge_y = cy
         # --- Schatten perspektivisch verzerren (elliptisch) ---
-        ellipse_scale = 0.6  # etwas weniger gestaucht
-        shadow = shadow.transform(
-            (shadow.width, int(shadow.height * ellipse_scale)),
-            Image.AFFINE,
-            (1, 0, 0, 0, ellipse_scale, 0),
-            resample=Image.BICUBIC
+        return STAGE_CACHE.get_or_compute(
+            ("ellipse", alpha_key, shadow_scale, shadow_blur, blur_strategy, ELLIPSE_SCALE),
+            lambda: ellipse_layer(blurred_layer(alpha, alpha_key, shadow_scale, shadow_blur, blur_strategy, strip_rows), ELLIPSE_SCALE)
         )
-        scale_offset_y = int(scale_offset_y * ellipse_scale)
-        if shadow_scale != 1.0:
-            new_w = shadow.width
-            new_h = shadow.height
-            new_cx, new_cy = new_w // 2, int(new_h // 2)
-            edge_x = int((edge_x - cx) * shadow_scale + new_cx)
-            edge_y = int((edge_y - cy) * shadow_scale * ellipse_scale + new_cy)
+
+    def _add_shadow_single(self, image_np, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality="full"):
+        # image_np is an RGBA uint8 array. Extract alpha channel to create
+        # shadow. The shadow has a single color, so only its alpha channel is
+        # scaled, blurred and transformed, and only within the bounding box
+        # of the silhouette (see shadow_layer). The stages are cached, moving
+        # the offset or the angle reuses them.
+        alpha = alpha_image(image_np)
+        shadow_layer, shadow_position, image_position, size = self._layout(
+            alpha, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, blur_strategy, limit, quality
+        )
+        # Schatten und Bild in einem Durchgang (alpha over)
+        return compositing.composite([
+            placed_layer(shadow_layer, shadow_color, *shadow_position),
+            compositing.image_layer(image_np, *image_position),
+        ], size)
+
+    def _layout(self, alpha, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, blur_strategy, limit, quality="full", strip_rows=0):
+        # The shadow layer of an item ('L' alpha), the positions of the shadow
+        # and of the image on the output canvas and the size of the canvas
+        alpha_key = content_hash(alpha)
+
+        # --- Robuste Konturpunktsuche an der gewünschten Uhrzeit-Position ---
+        # All slider positions are searched at once and cached per alpha.
+        # The canvas grows with the distance of the edge point from the
+        # center; if it fits the memory limit for an edge point in any corner,
+        # the search runs next to the shadow stages.
+        w, h = alpha.size
+        if all(limit.fits(size) for size in self._corner_canvas_sizes(w, h, offset_x, offset_y, shadow_scale)):
+            edge = parallel.submit(self._contour_point, alpha, alpha_key, shadow_angle)
+            shadow_layer = self._shadow_layer(alpha, alpha_key, shadow_scale, shadow_blur, blur_strategy, quality, strip_rows)
+            edge_x, edge_y = edge.result()
         else:
-            edge_y = int(edge_y * ellipse_scale)
-        angle_rad_shadow = math.radians(shadow_dir)
-        dx_shadow = math.cos(angle_rad_shadow)
-        dy_shadow = math.sin(angle_rad_shadow)
-        offset_x = int(round(dx_shadow * shadow_distance))
-        offset_y = int(round(dy_shadow * shadow_distance))
-        total_offset_x = scale_offset_x + (edge_x - image_pil.width // 2) + offset_x
-        total_offset_y = scale_offset_y + (edge_y - image_pil.height // 2) + offset_y
+            edge_x, edge_y = self._contour_point(alpha, alpha_key, shadow_angle)
+
+            # Größe der Ausgabe prüfen, bevor etwas angelegt wird
+            shadow_scale, shadow_blur = limit.fit_shadow(
+                lambda scale: self._canvas_size(w, h, edge_x, edge_y, offset_x, offset_y, scale), shadow_scale, shadow_blur
+            )
+            shadow_layer = self._shadow_layer(alpha, alpha_key, shadow_scale, shadow_blur, blur_strategy, quality, strip_rows)
+
+        total_offset_x, total_offset_y = self._shadow_offset(
+            w, h, shadow_layer.width, shadow_layer.height, edge_x, edge_y, offset_x, offset_y, shadow_scale
+        )
         min_x = min(0, total_offset_x)
         min_y = min(0, total_offset_y)
-        max_x = max(image_pil.width, total_offset_x + shadow.width)
-        max_y = max(image_pil.height, total_offset_y + shadow.height)
+        max_x = max(w, total_offset_x + shadow_layer.width)
+        max_y = max(h, total_offset_y + shadow_layer.height)
         composite_width = max_x - min_x
         composite_height = max_y - min_y
-        composite_image = Image.new("RGBA", (composite_width, composite_height), (0, 0, 0, 0))
         shadow_x = total_offset_x - min_x
         shadow_y = total_offset_y - min_y
-        composite_image.paste(shadow, (shadow_x, shadow_y), shadow)
         image_x = -min_x
         image_y = -min_y
-        composite_image.paste(image_pil, (image_x, image_y), image_pil)
-        composite_tensor = torch.from_numpy(np.array(composite_image).astype(np.float32) / 255.0).unsqueeze(0)
-        return (composite_tensor,)
+        return shadow_layer, (shadow_x, shadow_y), (image_x, image_y), (composite_width, composite_height)
+
+    def _add_shadow_torch(self, planes, shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality="full"):
+        # Same as _add_shadow_single on [4,H,W] planes, with torch_backend
+        alpha = planes[3]
+        h, w = alpha.shape
+
+        # Only the pixels along the ray are read back for the contour search
+        shadow_angles = (shadow_angle,)
+        xs, ys, _ = contour_rays(w, h, shadow_angles)
+        index = torch.as_tensor(ys * w + xs, device=alpha.device)
+        transparent = torch_backend.transparent(alpha.reshape(-1)[index]).cpu().numpy()
+        edge_x, edge_y = (int(v) for v in contour_points(transparent, w, h, shadow_angles)[0])
+        shadow_scale, shadow_blur = limit.fit_shadow(
+            lambda scale: self._canvas_size(w, h, edge_x, edge_y, offset_x, offset_y, scale), shadow_scale, shadow_blur
+        )
+
+        # Draft: the stages run at 1/DRAFT_FACTOR of the size
+        factor = DRAFT_FACTOR if quality == "draft" else 1
+        full_w, full_h = int(w * shadow_scale), int(h * shadow_scale)
+        shadow_alpha = alpha
+        if shadow_scale != 1.0 or factor > 1:
+            shadow_alpha = torch_backend.resize(shadow_alpha, (max(1, full_w // factor), max(1, full_h // factor)))
+        shadow_alpha = torch_backend.blur(shadow_alpha, shadow_blur / factor, blur_strategy)
+        shadow_h, shadow_w = shadow_alpha.shape
+        shadow_alpha = torch_backend.affine(
+            shadow_alpha, (shadow_w, int(shadow_h * ELLIPSE_SCALE)), (1, 0, 0, 0, ELLIPSE_SCALE, 0)
+        )
+        if factor > 1:
+            shadow_alpha = torch_backend.resize(shadow_alpha, (full_w, int(full_h * ELLIPSE_SCALE)), "bilinear")
+        shadow_h, shadow_w = shadow_alpha.shape
+
+        total_offset_x, total_offset_y = self._shadow_offset(
+            w, h, shadow_w, shadow_h, edge_x, edge_y, offset_x, offset_y, shadow_scale
+        )
+        min_x = min(0, total_offset_x)
+        min_y = min(0, total_offset_y)
+        max_x = max(w, total_offset_x + shadow_w)
+        max_y = max(h, total_offset_y + shadow_h)
+        color = torch_backend.color_planes(shadow_color, planes)
+        return compositing.composite_planes([
+            compositing.color_plane_layer(shadow_alpha, color, total_offset_x - min_x, total_offset_y - min_y),
+            compositing.plane_layer(planes, -min_x, -min_y),
+        ], (max_x - min_x, max_y - min_y), like=planes)
 
 NODE_CLASS_MAPPINGS = {
     "DropShadow": DropShadow
@@ -1,7 +1,21 @@
 import torch
-from PIL import Image
 import numpy as np
 
+try:
+    from .image_utils import image_batch_to_pil, image_to_numpy, quantize_to_tensor, uint8_to_pil, uint8_to_tensor, rgb_view
+    from . import torch_backend
+    from . import compositing
+    from . import tiling
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_batch_to_pil, image_to_numpy, quantize_to_tensor, uint8_to_pil, uint8_to_tensor, rgb_view
+    import torch_backend
+    import compositing
+    import tiling
+    import profiling
+    import parallel
+
 class ImageComposite:
     @classmethod
     def INPUT_TYPES(s):
@@ -17,6 +31,14 @@ class ImageComposite:
                     "display": "slider"
                 }),
             },
+            "optional": {
+                "backend": (torch_backend.BACKENDS, {
+                    "default": "auto"
+                }),
+                "tiled": (tiling.TILING_MODES, {
+                    "default": "auto"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE", "IMAGE")
@@ -24,42 +46,131 @@ class ImageComposite:
 
     CATEGORY = "Goede"
 
-    def composite(self, background_image, subject_image, spacing):
-        # Convert tensors to PIL images
-        background_pil = Image.fromarray(np.clip(255. * background_image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
-        subject_pil = Image.fromarray(np.clip(255. * subject_image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+    @profiling.profiled("ImageComposite")
+    def composite(self, background_image, subject_image, spacing, backend="auto", tiled="auto"):
+        # The subject decides, it is the image that comes from the GPU nodes
+        if torch_backend.resolve_backend(backend, subject_image) == "torch":
+            return self.composite_torch(background_image, torch_backend.image_planes(subject_image), spacing)
 
-        # Calculate the new size of the subject
-        new_width = background_pil.width - 2 * spacing
-        aspect_ratio = subject_pil.height / subject_pil.width
-        new_height = int(new_width * aspect_ratio)
+        # [B,H,W,C] (an unbatched background gets a batch axis)
+        background_image = image_to_numpy(background_image)
+        height, width = background_image.shape[1:3]
+        if tiling.use_tiles(tiled, (width, height)):
+            with profiling.stage("to_pil") as s:
+                subjects = s.output([uint8_to_pil(tiling.to_uint8(item)) for item in image_to_numpy(subject_image)])
+            return self.composite_pil(background_image, subjects, spacing, tiling.STRIP_ROWS)
 
-        # Resize the subject
-        resized_subject = subject_pil.resize((new_width, new_height))
+        return self.composite_pil(background_image, image_batch_to_pil(subject_image), spacing)
 
-        # Create a new image with the background
-        composite_image = Image.new("RGBA", background_pil.size)
-        composite_image.paste(background_pil, (0, 0))
+    def composite_pil(self, background_image, subjects, spacing, strip_rows=0):
+        # subjects: one PIL image per batch item.
+        # The backgrounds are written once into the output tensor, only the
+        # rectangle covered by the subject is blended. Memory and time of the
+        # paste grow with the subject, not with the background.
+        # strip_rows > 0 blends the rectangle in strips of that many rows
+        # (tiled), its 8 bit copy then never exists as a whole.
+        backgrounds = image_to_numpy(background_image)
 
-        # Calculate the position to paste the subject
-        paste_x = spacing
-        paste_y = (background_pil.height - new_height) // 2
+        # A single background (or subject) is shared by the whole batch
+        if len(backgrounds) != len(subjects) and 1 not in (len(backgrounds), len(subjects)):
+            raise ValueError(f"Batch sizes do not match: {len(backgrounds)} backgrounds, {len(subjects)} subjects")
+        batch_size = max(len(backgrounds), len(subjects))
+
+        # All items of a batch share their size, so the geometry is computed once
+        background_height, background_width = backgrounds.shape[1:3]
+        new_width, new_height, paste_x, paste_y = self.placement(
+            (background_width, background_height), subjects[0].size, spacing
+        )
+
+        # Resize the subjects and ensure they are RGBA
+        def resize(subject_pil):
+            with profiling.stage("resize") as s:
+                return s.output(np.asarray(subject_pil.resize((new_width, new_height)).convert("RGBA")))
+        resized_subjects = parallel.map_items(resize, subjects)
+
+        # Destination rectangle of the subject, clipped to the background
+        x0, y0 = max(paste_x, 0), max(paste_y, 0)
+        x1 = min(background_width, paste_x + new_width)
+        y1 = min(background_height, paste_y + new_height)
 
-        # Ensure subject is RGBA
-        resized_subject = resized_subject.convert("RGBA")
+        composite_tensor = torch.empty((batch_size, background_height, background_width, 4), dtype=torch.float32)
 
-        # Paste the subject onto the background
-        composite_image.paste(resized_subject, (paste_x, paste_y), resized_subject)
+        # Every item writes its own slice of the output
+        def composite_item(i):
+            composite = composite_tensor[i]
+            self.fill_background(composite, backgrounds[i % len(backgrounds)])
+            # Subject over the background, in 8 bit
+            resized_subject = resized_subjects[i % len(resized_subjects)]
+            self.blend(composite, [compositing.image_layer(resized_subject, paste_x, paste_y)], (x0, y0, x1, y1), strip_rows)
 
-        # Convert the composite image back to a tensor
-        composite_tensor = torch.from_numpy(np.array(composite_image).astype(np.float32) / 255.0).unsqueeze(0)
+        parallel.map_items(composite_item, range(batch_size))
 
-        # Create a 3-channel version of the composite image
-        composite_image_rgb = composite_image.convert("RGB")
-        composite_tensor_rgb = torch.from_numpy(np.array(composite_image_rgb).astype(np.float32) / 255.0).unsqueeze(0)
+        # The 3-channel version is a view of the same buffer
+        composite_tensor_rgb = rgb_view(composite_tensor)
 
         return (composite_tensor, composite_tensor_rgb)
 
+    def placement(self, background_size, subject_size, spacing):
+        # Size and position of the subject: the width of the background less
+        # the spacing on both sides, vertically centered
+        background_width, background_height = background_size
+        new_width = background_width - 2 * spacing
+        aspect_ratio = subject_size[1] / subject_size[0]
+        new_height = int(new_width * aspect_ratio)
+        paste_x = spacing
+        paste_y = (background_height - new_height) // 2
+        return new_width, new_height, paste_x, paste_y
+
+    def fill_background(self, composite, background):
+        # One [H,W,C] float background into composite, its [H,W,4] output
+        # item, as RGBA with the 8 bit levels of a PIL image
+        channels = background.shape[-1]
+        with profiling.stage("background") as s:
+            quantize_to_tensor(background, composite[..., :channels])
+            if channels == 1:
+                composite[..., 1:3] = composite[..., :1]
+            if channels < 4:
+                composite[..., 3] = 1.0
+            return s.output(composite)
+
+    def blend(self, composite, layers, box, strip_rows=0):
+        # The layers (compositing.composite() layers in output coordinates)
+        # over the rectangle box = (x0, y0, x1, y1) of composite, in 8 bit;
+        # in strips of strip_rows rows if it is > 0
+        x0, y0, x1, y1 = box
+        if x1 <= x0 or y1 <= y0:
+            return composite
+        for strip_y0, strip_y1 in tiling.strips(y1 - y0, strip_rows or y1 - y0):
+            region = composite[y0 + strip_y0:y0 + strip_y1, x0:x1]
+            background_region = np.rint(region.numpy() * 255).astype(np.uint8)
+            compositing.composite([
+                layer._replace(x=layer.x - x0, y=layer.y - y0 - strip_y0) for layer in layers if layer is not None
+            ], out=background_region)
+            uint8_to_tensor(background_region, region)
+        return composite
+
+    def composite_torch(self, background_image, subjects, spacing):
+        # Same as composite_pil() with torch_backend, subjects are [B,4,H,W]
+        # planes; runs on their device
+        backgrounds = torch_backend.image_planes(background_image).to(subjects.device)
+        if len(backgrounds) != len(subjects) and 1 not in (len(backgrounds), len(subjects)):
+            raise ValueError(f"Batch sizes do not match: {len(backgrounds)} backgrounds, {len(subjects)} subjects")
+        batch_size = max(len(backgrounds), len(subjects))
+
+        background_height, background_width = backgrounds.shape[2:]
+        new_width, new_height, paste_x, paste_y = self.placement(
+            (background_width, background_height), (subjects.shape[3], subjects.shape[2]), spacing
+        )
+
+        resized_subjects = torch_backend.resize_rgba(subjects, (new_width, new_height))
+        composites = backgrounds.expand(batch_size, -1, -1, -1).clone()
+        for i, composite in enumerate(composites):
+            resized_subject = resized_subjects[i % len(resized_subjects)]
+            compositing.composite_planes([compositing.plane_layer(resized_subject, paste_x, paste_y)], out=composite)
+
+        composite_tensor = torch_backend.planes_to_image(composites)
+        return (composite_tensor, rgb_view(composite_tensor))
+
 NODE_CLASS_MAPPINGS = {
     "ImageComposite": ImageComposite
 }
@@ -1,17 +1,90 @@
 import os
-import torch
+import math
+import logging
+import sqlite3
 import numpy as np
 from PIL import Image
 
+try:
+    from .image_utils import uint8_to_tensor
+    from .stage_cache import StageCache
+    from .disk_cache import DiskCache
+    from .background_index import BackgroundIndex, IMAGE_DIR, ORIENTATIONS, list_images, refresh_index, wait_for_refresh
+    from . import profiling
+except ImportError:
+    from image_utils import uint8_to_tensor
+    from stage_cache import StageCache
+    from disk_cache import DiskCache
+    from background_index import BackgroundIndex, IMAGE_DIR, ORIENTATIONS, list_images, refresh_index, wait_for_refresh
+    import profiling
+
+logger = logging.getLogger(__name__)
+
+# Decoded backgrounds, keyed by path, mtime and size of the file.
+# GOEDE_IMAGE_CACHE_MB sets the budget (default 1024), 0 disables the cache.
+DECODED_CACHE = StageCache(int(float(os.environ.get("GOEDE_IMAGE_CACHE_MB", 1024)) * 1024 * 1024))
+
+# The decoded 8 bit pixels on disk, across runs (see disk_cache.py); None
+# unless GOEDE_DECODE_CACHE_DIR is set
+DISK_CACHE = DiskCache.from_env()
+
+# Options of the decoded size, shared by the selector nodes
+DECODE_OPTIONS = {
+    # 0: full resolution
+    "max_width": ("INT", {
+        "default": 0,
+        "min": 0,
+        "max": 16384,
+        "step": 1
+    }),
+    "max_megapixels": ("FLOAT", {
+        "default": 0.0,
+        "min": 0.0,
+        "max": 1000.0,
+        "step": 0.1
+    }),
+}
+
+
+def file_signature(image_path):
+    stat = os.stat(image_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def decode_size(width, height, max_width=0, max_megapixels=0.0):
+    # Size an image is decoded at: at most max_width wide and max_megapixels
+    # large (0: no limit). The height follows the width like the subject
+    # size in ImageComposite, int(width * height / width of the original).
+    target_width = width
+    if max_width > 0:
+        target_width = min(target_width, max_width)
+    if max_megapixels > 0:
+        target_width = min(target_width, int(width * math.sqrt(max_megapixels * 1e6 / (width * height))))
+    target_width = max(1, target_width)
+    if target_width == width:
+        return width, height
+    return target_width, max(1, int(target_width * (height / width)))
+
+
 class ImageSelector:
     @classmethod
     def INPUT_TYPES(s):
-        image_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images")
-        image_files = [f for f in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, f))]
+        # The cached directory listing without the files the index found
+        # unreadable. No file is opened here: a changed directory is indexed
+        # in the background, until then (or without an index) every file is
+        # listed.
+        refresh_index(IMAGE_DIR)
+        try:
+            unreadable = BackgroundIndex(IMAGE_DIR).unreadable()
+        except sqlite3.Error as error:
+            logger.warning("Background index of %s unavailable (%s), listing the directory", IMAGE_DIR, error)
+            unreadable = set()
+        image_files = [name for name in list_images(IMAGE_DIR) if name not in unreadable]
         return {
             "required": {
                 "image": (image_files, ),
             },
+            "optional": dict(DECODE_OPTIONS),
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -19,18 +92,135 @@ class ImageSelector:
 
     CATEGORY = "Goede"
 
-    def select_image(self, image):
-        image_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images", image)
-        i = Image.open(image_path)
-        i = i.convert("RGB")
-        image = np.array(i).astype(np.float32) / 255.0
-        image = torch.from_numpy(image)[None,]
-        return (image,)
+    @classmethod
+    def IS_CHANGED(s, image, **kwargs):
+        # ComfyUI skips the node while the file keeps its mtime and size
+        mtime, size = file_signature(os.path.join(IMAGE_DIR, image))
+        return f"{image}:{mtime}:{size}"
+
+    @profiling.profiled("ImageSelector")
+    def select_image(self, image, max_width=0, max_megapixels=0.0):
+        image_path = os.path.join(IMAGE_DIR, image)
+        key = ("decoded", image_path, max_width, max_megapixels) + file_signature(image_path)
+        image = DECODED_CACHE.get_or_compute(key, lambda: self._load(key, image_path, max_width, max_megapixels))
+        # Downstream nodes may write into their input, the cached tensor
+        # stays untouched
+        with profiling.stage("copy") as s:
+            return (s.output(image.clone()),)
+
+    def _load(self, key, image_path, max_width=0, max_megapixels=0.0):
+        # Memory-mapped from the disk cache, decoded on a miss
+        pixels = DISK_CACHE.get(key) if DISK_CACHE is not None else None
+        if pixels is None:
+            pixels = np.asarray(self._decode(image_path, max_width, max_megapixels))
+            if DISK_CACHE is not None:
+                with profiling.stage("disk_cache") as s:
+                    DISK_CACHE.put(key, pixels)
+                    s.output(pixels)
+        with profiling.stage("to_tensor") as s:
+            return s.output(uint8_to_tensor(pixels[np.newaxis, ...]))
+
+    def _decode(self, image_path, max_width=0, max_megapixels=0.0):
+        # RGB PIL image
+        with profiling.stage("decode") as s:
+            i = Image.open(image_path)
+            size = decode_size(i.width, i.height, max_width, max_megapixels)
+            if size != i.size:
+                # JPEG decodes at 1/2, 1/4 or 1/8 of the size in the DCT
+                # domain, the largest reduction that stays above the target
+                i.draft("RGB", size)
+            if i.mode != "RGB":
+                i = i.convert("RGB")
+            if i.size != size:
+                # Other formats are reduced by whole factors before the resize
+                i = i.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            s.output(i)
+        return i
+
+class ImageFinder(ImageSelector):
+    # Picks a background by its properties in the index instead of its name:
+    # the backgrounds matching the filters, sorted by name, `position` counts
+    # through them (wrapping around)
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "min_width": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 1
+                }),
+                "min_height": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 1
+                }),
+                "orientation": (["any"] + ORIENTATIONS, {
+                    "default": "any"
+                }),
+                # Mean color close to this one, e.g. #e0d8c8 (empty: any)
+                "color": ("STRING", {
+                    "default": ""
+                }),
+                "color_distance": ("INT", {
+                    "default": 64,
+                    "min": 0,
+                    "max": 442,
+                    "step": 1
+                }),
+                "position": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 1000000,
+                    "step": 1
+                }),
+            },
+            "optional": dict(DECODE_OPTIONS),
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("image", "name")
+    FUNCTION = "find_image"
+
+    CATEGORY = "Goede"
+
+    @classmethod
+    def IS_CHANGED(s, min_width, min_height, orientation, color, color_distance, position, **kwargs):
+        # From the index as it is (a refresh is only started); without a
+        # match the node runs and reports it
+        try:
+            name = s.match(min_width, min_height, orientation, color, color_distance, position, wait=False)
+        except (ValueError, sqlite3.Error):
+            return float("nan")
+        return ImageSelector.IS_CHANGED(name)
+
+    @classmethod
+    def match(s, min_width, min_height, orientation, color, color_distance, position, wait=True):
+        # Name of the background the filters and the position select; wait
+        # for the index to take in added and removed files first
+        if wait:
+            wait_for_refresh(IMAGE_DIR)
+        else:
+            refresh_index(IMAGE_DIR)
+        entries = BackgroundIndex(IMAGE_DIR).find(
+            min_width, min_height, None if orientation == "any" else orientation, color.strip() or None, color_distance
+        )
+        if not entries:
+            raise ValueError("No background in the library matches the filters")
+        return entries[position % len(entries)].name
+
+    def find_image(self, min_width, min_height, orientation, color, color_distance, position, max_width=0, max_megapixels=0.0):
+        name = self.match(min_width, min_height, orientation, color, color_distance, position)
+        return self.select_image(name, max_width, max_megapixels) + (name,)
 
 NODE_CLASS_MAPPINGS = {
-    "ImageSelector": ImageSelector
+    "ImageSelector": ImageSelector,
+    "ImageFinder": ImageFinder
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "ImageSelector": "Goede Image Selector"
+    "ImageSelector": "Goede Image Selector",
+    "ImageFinder": "Goede Image Finder"
 }
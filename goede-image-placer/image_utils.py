@@ -0,0 +1,203 @@
+import threading
+
+import torch
+from PIL import Image
+import numpy as np
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+# Conversion layer shared by all nodes. ComfyUI images are [B,H,W,C] float
+# tensors in 0..1, the nodes work on 8 bit PIL images. The helpers below keep
+# the number of full-frame copies down:
+#   * float -> uint8 scales in a reused float32 scratch buffer, strip by
+#     strip (no temporary arrays per call, the buffer stays below
+#     SCRATCH_VALUES whatever the size of the batch),
+#   * uint8 -> PIL maps the numpy memory instead of copying it; the nodes
+#     keep the 8 bit RGBA arrays themselves where they can (a PIL image can
+#     only be read back as an array through a copy),
+#   * channel conversions only happen when the data is not in the requested
+#     mode yet,
+#   * uint8 -> float writes once into the output tensor, the 3 channel output
+#     is a view of the 4 channel one.
+
+_scratch = threading.local()
+
+# Float values (16 MB) the scratch buffer of a thread holds at most
+SCRATCH_VALUES = 1 << 22
+
+
+def _scratch_buffer(shape):
+    # One float32 buffer per thread, grown up to SCRATCH_VALUES; a larger
+    # request (a single row wider than that) gets a buffer of its own
+    size = int(np.prod(shape))
+    if size > SCRATCH_VALUES:
+        return np.empty(shape, dtype=np.float32)
+    buffer = getattr(_scratch, "buffer", None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(size, dtype=np.float32)
+        _scratch.buffer = buffer
+    return buffer[:size].reshape(shape)
+
+
+def image_to_numpy(image):
+    # Tensors (any device/float dtype) and numpy arrays, batched or not.
+    # CPU float32 tensors are returned as a view without copying.
+    if isinstance(image, torch.Tensor):
+        image = image.detach()
+        if image.device.type != "cpu" or image.dtype != torch.float32:
+            image = image.to("cpu", torch.float32)
+        image = image.numpy()
+    image = np.asarray(image)
+    if image.ndim == 3:
+        image = image[np.newaxis, ...]
+    return image
+
+
+def image_to_uint8(image):
+    # Same values as np.clip(255. * image, 0, 255).astype(np.uint8)
+    image = image_to_numpy(image)
+    if image.dtype == np.uint8:
+        return image
+    out = np.empty(image.shape, dtype=np.uint8)
+    height = image.shape[1]
+    rows = max(1, min(height, SCRATCH_VALUES // max(1, int(np.prod(image.shape[2:])))))
+    for item, item_out in zip(image, out):
+        for y0 in range(0, height, rows):
+            scaled = _scratch_buffer(item[y0:y0 + rows].shape)
+            np.multiply(item[y0:y0 + rows], 255, out=scaled, casting="unsafe")
+            np.clip(scaled, 0, 255, out=scaled)
+            np.copyto(item_out[y0:y0 + rows], scaled, casting="unsafe")
+    return out
+
+
+def uint8_to_pil(image_np, mode=None):
+    # image_np is a single [H,W,C] uint8 array; the PIL image shares its memory
+    if image_np.shape[-1] == 1:
+        image_np = image_np[..., 0]
+    image_pil = Image.fromarray(np.ascontiguousarray(image_np))
+    if mode is not None and image_pil.mode != mode:
+        image_pil = image_pil.convert(mode)
+    return image_pil
+
+
+def image_batch_to_pil(image, mode=None):
+    # One PIL image per batch item, converted to `mode` only where needed
+    with profiling.stage("to_pil") as s:
+        return s.output([uint8_to_pil(item, mode) for item in image_to_uint8(image)])
+
+
+def image_batch_to_rgba(image):
+    # One [H,W,4] uint8 RGBA array per batch item, the same pixels as
+    # image_batch_to_pil(image, mode='RGBA'). 4 channel items are views of
+    # the 8 bit batch, RGB items get an opaque alpha channel.
+    def rgba(item):
+        if item.shape[-1] == 4:
+            return item
+        if item.shape[-1] == 3:
+            out = np.empty(item.shape[:2] + (4,), dtype=np.uint8)
+            out[..., :3] = item
+            out[..., 3] = 255
+            return out
+        return np.asarray(uint8_to_pil(item, 'RGBA'))
+
+    with profiling.stage("to_uint8") as s:
+        return s.output([rgba(item) for item in image_to_uint8(image)])
+
+
+def alpha_image(image_np):
+    # 'L' image of the alpha channel of an [H,W,4] uint8 array
+    return Image.fromarray(np.ascontiguousarray(image_np[..., 3]))
+
+
+def pil_batch_to_uint8(images):
+    # Batch items can end up with different canvas sizes (e.g. DropShadow
+    # places the shadow per item). Smaller items are padded with zeros at the
+    # bottom/right so that the batch can be stacked into one array.
+    arrays = [np.asarray(img) for img in images]
+    if len(arrays) == 1:
+        return arrays[0][np.newaxis, ...]
+    height = max(a.shape[0] for a in arrays)
+    width = max(a.shape[1] for a in arrays)
+    same_size = all(a.shape[:2] == (height, width) for a in arrays)
+    allocate = np.empty if same_size else np.zeros
+    batch = allocate((len(arrays), height, width) + arrays[0].shape[2:], dtype=np.uint8)
+    for item, a in zip(batch, arrays):
+        item[:a.shape[0], :a.shape[1]] = a
+    return batch
+
+
+def uint8_to_tensor(image_np, out=None, dtype=torch.float32):
+    # uint8 -> float in 0..1, written once into the (optionally given) output
+    # tensor; same values as image_np.astype(np.float32) / 255.0
+    if out is None:
+        out = torch.empty(image_np.shape, dtype=dtype)
+    np.copyto(out.numpy(), image_np, casting="unsafe")
+    out.div_(255.0)
+    return out
+
+
+def quantize_to_tensor(image_np, out):
+    # Float image -> float32 tensor `out` with the 8 bit levels of the PIL
+    # path, same values as uint8_to_tensor(image_to_uint8(image_np)) but
+    # written directly into `out` (which can be a view, e.g. the RGB channels
+    # of a batch item)
+    if image_np.dtype == np.uint8:
+        return uint8_to_tensor(image_np, out)
+    if out.dtype != torch.float32:
+        # The levels are taken in float32 (a float16 product can round up
+        # to the next level before the floor)
+        return out.copy_(quantize_to_tensor(image_np, torch.empty(out.shape)))
+    out_np = out.numpy()
+    np.multiply(image_np, 255, out=out_np, casting="unsafe")
+    np.clip(out_np, 0, 255, out=out_np)
+    np.floor(out_np, out=out_np)
+    out.div_(255.0)
+    return out
+
+
+def uint8_batch_to_tensor(arrays, dtype=torch.float32):
+    # Like uint8_to_tensor(pil_batch_to_uint8(arrays)) for [H,W(,C)] uint8
+    # arrays, but the items are written one by one into the output, without
+    # a stacked 8 bit copy of the batch
+    with profiling.stage("to_tensor") as s:
+        if len(arrays) == 1:
+            return s.output(uint8_to_tensor(arrays[0][np.newaxis, ...], dtype=dtype))
+        height = max(a.shape[0] for a in arrays)
+        width = max(a.shape[1] for a in arrays)
+        same_size = all(a.shape[:2] == (height, width) for a in arrays)
+        allocate = torch.empty if same_size else torch.zeros
+        out = allocate((len(arrays), height, width) + arrays[0].shape[2:], dtype=dtype)
+        for item, a in zip(out, arrays):
+            uint8_to_tensor(a, item[:a.shape[0], :a.shape[1]])
+        return s.output(out)
+
+
+def pil_batch_to_tensor(images, dtype=torch.float32):
+    # Same for PIL images
+    return uint8_batch_to_tensor([np.asarray(img) for img in images], dtype)
+
+
+def align_images(images, anchors):
+    # Pads PIL images onto one canvas size so that their anchor points
+    # (e.g. where the subject sits) coincide; returns the new images
+    left = max(x for x, _ in anchors)
+    top = max(y for _, y in anchors)
+    width = max(left - x + image.width for image, (x, _) in zip(images, anchors))
+    height = max(top - y + image.height for image, (_, y) in zip(images, anchors))
+    aligned = []
+    for image, (x, y) in zip(images, anchors):
+        if image.size == (width, height) and (x, y) == (left, top):
+            aligned.append(image)
+            continue
+        canvas = Image.new(image.mode, (width, height))
+        canvas.paste(image, (left - x, top - y))
+        aligned.append(canvas)
+    return aligned
+
+
+def rgb_view(image):
+    # 3 channel output sharing the memory of a 4 channel result
+    return image[..., :3]
@@ -0,0 +1,146 @@
+import os
+import math
+import logging
+
+import torch
+
+# Memory limit of the shadow nodes. DropShadow and Spotlight grow the canvas
+# with shadow_scale (up to 5x) and the shadow offset, and the float output
+# takes 16 bytes per pixel on top of the 8 bit canvas. The canvas size only
+# depends on the parameters (and the contour point), so it is checked before
+# any stage allocates:
+#   downscale  the shadow is rendered smaller (shadow_scale and shadow_blur
+#              reduced by the same factor) until the canvas fits
+#   error      CanvasTooLargeError with the size and the estimated memory
+# The limit is in megapixels of the output canvas of one batch item. 0 on the
+# node uses GOEDE_MAX_MEGAPIXELS; without it there is no limit and every
+# graph renders as it always has.
+#
+# Independent of the limit, the peak memory of a node (estimate_peak_bytes)
+# is checked against the memory that is available before the canvas is
+# allocated: GOEDE_MAX_MEMORY_MB if set (0: no check), otherwise what the
+# system reports as available. A node that would not fit raises
+# CanvasTooLargeError instead of running out of memory halfway.
+#
+# output_dtype "float16" halves the output tensor. The PIL path keeps every
+# intermediate in 8 bit and writes the items one by one into the output;
+# tiled (see tiling) only a strip of the 8 bit canvas exists at a time.
+
+OVERSIZE_POLICIES = ["downscale", "error"]
+OUTPUT_DTYPES = ["float32", "float16"]
+
+# No limit
+DEFAULT_MAX_MEGAPIXELS = 0.0
+
+# Lower end of the shadow_scale slider
+MIN_SHADOW_SCALE = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class CanvasTooLargeError(ValueError):
+    pass
+
+
+def torch_dtype(output_dtype):
+    if output_dtype not in OUTPUT_DTYPES:
+        raise ValueError(f"Unknown output dtype: {output_dtype}")
+    return getattr(torch, output_dtype)
+
+
+def resolve_max_megapixels(limit=0):
+    # 0: no limit
+    if limit and limit > 0:
+        return float(limit)
+    return float(os.environ.get("GOEDE_MAX_MEGAPIXELS", DEFAULT_MAX_MEGAPIXELS))
+
+
+def available_bytes():
+    # Memory a node may use: GOEDE_MAX_MEMORY_MB (0: no check), otherwise
+    # MemAvailable of the system; None if there is nothing to check against
+    max_memory = os.environ.get("GOEDE_MAX_MEMORY_MB")
+    if max_memory is not None:
+        max_memory = float(max_memory)
+        return max_memory * 2 ** 20 if max_memory > 0 else None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def estimate_peak_bytes(canvas_size, batch_size=1, output_dtype="float32", tiled=False):
+    # Per pixel of the canvas of every item: the RGBA canvas (4 bytes) and
+    # the float output (4 channels); plus the 8 bit shadow stages of one item
+    # (scaled, blurred and elliptic, each at most the size of the canvas).
+    # Tiled, only the output and the alpha channel (1 byte) exist at full
+    # size.
+    width, height = canvas_size
+    output_bytes = 4 * torch_dtype(output_dtype).itemsize
+    if tiled:
+        return width * height * (batch_size * output_bytes + 1 + 3)
+    return width * height * (batch_size * (4 + output_bytes) + 3)
+
+
+class MemoryLimit:
+    def __init__(self, max_megapixels=0, oversize="downscale", output_dtype="float32"):
+        if oversize not in OVERSIZE_POLICIES:
+            raise ValueError(f"Unknown oversize policy: {oversize}")
+        max_megapixels = resolve_max_megapixels(max_megapixels)
+        self.max_pixels = max_megapixels * 1e6 if max_megapixels > 0 else math.inf
+        self.oversize = oversize
+        self.output_dtype = output_dtype
+        self.dtype = torch_dtype(output_dtype)
+
+    def fits(self, canvas_size):
+        width, height = canvas_size
+        return width * height <= self.max_pixels
+
+    def check_peak(self, canvas_size, batch_size=1, tiled=False):
+        # Before anything is allocated: raises CanvasTooLargeError if a batch
+        # of canvases of (at most) canvas_size would not fit into the
+        # available memory. A canvas over the limit counts with the size
+        # fit_shadow() brings it down to.
+        width, height = canvas_size
+        if not self.fits(canvas_size):
+            width, height = self.max_pixels, 1
+        estimate = estimate_peak_bytes((width, height), batch_size, self.output_dtype, tiled)
+        available = available_bytes()
+        if available is not None and estimate > available:
+            raise CanvasTooLargeError(
+                f"Rendering {batch_size} canvas(es) of {canvas_size[0]}x{canvas_size[1]} "
+                f"({canvas_size[0] * canvas_size[1] / 1e6:.1f} megapixels) needs about {estimate / 2 ** 30:.1f} GiB, "
+                f"{available / 2 ** 30:.1f} GiB are available. Make the shadow smaller or shorter, render tiled, "
+                f"use float16 output or set max_megapixels / GOEDE_MAX_MEGAPIXELS."
+            )
+        return estimate
+
+    def fit_shadow(self, canvas_size, shadow_scale, shadow_blur):
+        # canvas_size(shadow_scale) -> (width, height) of the output canvas.
+        # Returns the shadow_scale and shadow_blur to render with.
+        width, height = canvas_size(shadow_scale)
+        if self.fits((width, height)):
+            return shadow_scale, shadow_blur
+        requested = (width, height)
+        if self.oversize == "downscale":
+            scale = shadow_scale
+            while scale > MIN_SHADOW_SCALE:
+                # The canvas grows roughly with the square of the scale
+                factor = min(0.95, math.sqrt(self.max_pixels / (width * height)))
+                scale = max(MIN_SHADOW_SCALE, scale * factor)
+                width, height = canvas_size(scale)
+                if self.fits((width, height)):
+                    logger.warning(
+                        "Shadow canvas of %dx%d exceeds %.1f megapixels, shadow_scale reduced from %.2f to %.2f",
+                        requested[0], requested[1], self.max_pixels / 1e6, shadow_scale, scale
+                    )
+                    return scale, shadow_blur * scale / shadow_scale
+        estimate = estimate_peak_bytes(requested, output_dtype=self.output_dtype)
+        raise CanvasTooLargeError(
+            f"Shadow canvas of {requested[0]}x{requested[1]} ({requested[0] * requested[1] / 1e6:.1f} megapixels, "
+            f"about {estimate / 2 ** 30:.1f} GiB) exceeds the limit of {self.max_pixels / 1e6:.1f} megapixels. "
+            f"Make the shadow smaller or shorter, or raise max_megapixels / GOEDE_MAX_MEGAPIXELS."
+        )
@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+# Shared thread pool of the nodes. PIL releases the GIL in resize, filter,
+# transform and paste (numpy in most array operations), so batch items and
+# independent stages of one item run concurrently. Results keep the order of
+# their inputs and every task computes the same pixels as the serial code,
+# the output does not depend on the scheduling.
+#
+# The pool is off by default: every task runs on the calling thread, as it
+# always has (ComfyUI and the batch runner bring their own parallelism).
+# GOEDE_THREADS turns it on with that many worker threads (0: the number of
+# CPUs, at most 32), set_max_workers() changes it at runtime. Tasks
+# submitted from a worker thread run inline, so nested use cannot exhaust
+# the pool.
+
+MAX_DEFAULT_WORKERS = 32
+
+_lock = threading.Lock()
+_pool = None
+_max_workers = None
+_local = threading.local()
+
+
+def default_workers():
+    value = os.environ.get("GOEDE_THREADS")
+    if not value:
+        return 1
+    if int(value) == 0:
+        return min(MAX_DEFAULT_WORKERS, os.cpu_count() or 1)
+    return max(1, int(value))
+
+
+def max_workers():
+    return default_workers() if _max_workers is None else _max_workers
+
+
+def set_max_workers(count):
+    # None goes back to GOEDE_THREADS. The pool is swapped under the lock
+    # submit() holds, so no task goes to a pool that is shutting down: the
+    # current pool finishes the tasks it has, the next task starts a pool of
+    # the new size. Waiting for the pool from one of its own tasks would never
+    # return, that is refused.
+    global _pool, _max_workers
+    if getattr(_local, "worker", False):
+        raise RuntimeError("set_max_workers() cannot be called from a task of the pool")
+    with _lock:
+        pool, _pool = _pool, None
+        _max_workers = None if count is None else max(1, int(count))
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+def _get_pool():
+    # Called with _lock held
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max_workers(), thread_name_prefix="goede", initializer=_mark_worker)
+    return _pool
+
+
+def _inline():
+    return max_workers() <= 1 or getattr(_local, "worker", False)
+
+
+def submit(function, *args):
+    # Future of function(*args)
+    if _inline():
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+    # Stages run on the worker are recorded with the current profiled call
+    context = profiling.current_context()
+    with _lock:
+        return _get_pool().submit(context.run, function, *args)
+
+
+def map_items(function, items):
+    # [function(item) for item in items], concurrently
+    items = list(items)
+    if len(items) <= 1 or _inline():
+        return [function(item) for item in items]
+    futures = [submit(function, item) for item in items]
+    return [future.result() for future in futures]
@@ -1,19 +1,206 @@
-from PIL import Image, ImageFilter
+from PIL import Image
 import numpy as np
 import math
 import torch
 
+try:
+    from .image_utils import image_batch_to_rgba, alpha_image, pil_batch_to_tensor, uint8_batch_to_tensor, align_images
+    from .shadow_layer import alpha_layer, blur_layer, is_empty, placed_layer, upsample_layer, QUALITIES, DRAFT_FACTOR, LIGHT_POSITIONS
+    from . import compositing
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_batch_to_rgba, alpha_image, pil_batch_to_tensor, uint8_batch_to_tensor, align_images
+    from shadow_layer import alpha_layer, blur_layer, is_empty, placed_layer, upsample_layer, QUALITIES, DRAFT_FACTOR, LIGHT_POSITIONS
+    import compositing
+    import profiling
+    import parallel
+
+def _paste_sweep(rows, length, repeat=1):
+    # Only the rows and columns the smeared silhouette can reach are swept,
+    # every pixel outside of them stays transparent. With `repeat` the rows
+    # are at full size (a multiple of `repeat` in both directions) and the
+    # result is reduced by `repeat`, `length` counts reduced pixels.
+    height, width = rows.shape
+    smeared = np.zeros((height // repeat, width // repeat), dtype=np.uint8)
+    active_rows = np.flatnonzero(rows.any(axis=1))
+    if len(active_rows) == 0:
+        return smeared
+    active_columns = np.flatnonzero(rows.any(axis=0)) // repeat
+    y0 = active_rows[0] // repeat
+    y1 = active_rows[-1] // repeat + 1
+    x0 = active_columns[0]
+    # The sweep runs on reversed rows, x1 keeps its blocks aligned with the
+    # ones of the whole row (same float rounding as sweeping the whole row)
+    reduced_width = width // repeat
+    end = min(reduced_width, active_columns[-1] + length)
+    x1 = reduced_width - (reduced_width - end) // length * length
+    smeared[y0:y1, x0:x1] = _paste_sweep_rows(rows[y0 * repeat:y1 * repeat, x0 * repeat:x1 * repeat], length, repeat)
+    return smeared
+
+
+# Paste of an alpha value as an affine map: scale and shift per value
+_PASTE_SCALE = 1.0 - np.arange(256, dtype=np.float32) / np.float32(255.0)
+_PASTE_SHIFT = (np.arange(256, dtype=np.float32) / np.float32(255.0)) ** 2 * np.float32(255.0)
+
+
+def _paste_sweep_rows(rows, length, repeat=1):
+    # Alpha of every row pixel after the silhouette row has been pasted onto
+    # itself (with its own alpha as mask) at the offsets 0..length-1, the
+    # farthest copy last. One paste is the affine map
+    #     out -> out * (1 - a/255) + a * a/255
+    # and composing affine maps is associative, so the window of `length`
+    # pastes ending at every pixel can be evaluated blockwise
+    # (van Herk/Gil-Werman): one prefix and one suffix sweep per block.
+    # The work per pixel does not depend on `length`.
+    # With `repeat` (the draft quality) one paste of the sweep stands for the
+    # pastes of `repeat` neighbouring pixels of the full row, composed in
+    # their order, and `repeat` full rows are averaged into one. Composing
+    # keeps a hard edge inside a reduced pixel opaque, a mean alpha pasted
+    # `repeat` times would darken everything behind it.
+    height, width = rows.shape
+    reduced_width = width // repeat
+    # Reverse the rows: the pastes of a pixel then run forward over the window
+    # [y, y + length) of the reversed row, padded with empty pixels
+    padded_width = -(-(reduced_width + length - 1) // length) * length
+    scale = np.ones((height, padded_width), dtype=np.float32)
+    shift = np.zeros((height, padded_width), dtype=np.float32)
+    # Within a group the pastes run from its last pixel to its first
+    groups = rows.reshape(height, reduced_width, repeat)
+    group_scale = _PASTE_SCALE[groups[:, :, repeat - 1]]
+    group_shift = _PASTE_SHIFT[groups[:, :, repeat - 1]]
+    for j in range(repeat - 2, -1, -1):
+        pixel_scale = _PASTE_SCALE[groups[:, :, j]]
+        group_shift *= pixel_scale
+        group_shift += _PASTE_SHIFT[groups[:, :, j]]
+        group_scale *= pixel_scale
+    scale[:, :reduced_width] = group_scale[:, ::-1]
+    shift[:, :reduced_width] = group_shift[:, ::-1]
+    scale = scale.reshape(height, -1, length)
+    shift = shift.reshape(height, -1, length)
+
+    # Prefix within each block: pastes from the block start up to j
+    prefix_scale = np.empty_like(scale)
+    prefix_shift = np.empty_like(shift)
+    prefix_scale[:, :, 0] = scale[:, :, 0]
+    prefix_shift[:, :, 0] = shift[:, :, 0]
+    for j in range(1, length):
+        np.multiply(prefix_scale[:, :, j - 1], scale[:, :, j], out=prefix_scale[:, :, j])
+        np.multiply(prefix_shift[:, :, j - 1], scale[:, :, j], out=prefix_shift[:, :, j])
+        prefix_shift[:, :, j] += shift[:, :, j]
+
+    # Suffix within each block: pastes from j up to the block end, applied to
+    # an empty pixel
+    suffix_scale = scale[:, :, length - 1].copy()
+    suffix_value = np.empty_like(shift)
+    suffix_value[:, :, length - 1] = shift[:, :, length - 1]
+    for j in range(length - 2, -1, -1):
+        np.multiply(suffix_scale, shift[:, :, j], out=suffix_value[:, :, j])
+        suffix_value[:, :, j] += suffix_value[:, :, j + 1]
+        suffix_scale *= scale[:, :, j]
+
+    prefix_scale = prefix_scale.reshape(height, padded_width)
+    prefix_shift = prefix_shift.reshape(height, padded_width)
+    suffix_value = suffix_value.reshape(height, padded_width)
+
+    # Window [y, y + length): suffix of the block of y, then the prefix of the
+    # next block. Windows starting on a block boundary are a whole block.
+    start = np.arange(reduced_width)
+    end = start + length - 1
+    combined = prefix_scale[:, end] * suffix_value[:, start] + prefix_shift[:, end]
+    result = np.where(start % length == 0, suffix_value[:, start], combined)[:, ::-1]
+    if repeat > 1:
+        result = result.reshape(height // repeat, repeat, reduced_width).mean(axis=1)
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+
+
+def _reduced_sweep(rows, length, repeat):
+    # Sweep of full size rows reduced by `repeat` (rows a multiple of it).
+    # A reduced pixel holds the alpha at the last full pixel of its group;
+    # the groups start `phase` pixels early so that pixel is near the middle
+    # of the reduced pixel (half a pixel beyond it for an even `repeat`).
+    phase = (repeat - 1) // 2
+    if phase == 0:
+        return _paste_sweep(rows, length, repeat)
+    padded = np.pad(rows, ((0, 0), (phase, repeat - phase)))
+    return _paste_sweep(padded, length, repeat)[:, :-1]
+
+
+def directional_smear(alpha, dx, dy, length, repeat=1):
+    # Alpha of the silhouette pasted `length` times along (dx, dy), one pixel
+    # further per paste, computed in a single sweep. With `repeat` the
+    # result is reduced by that factor (rounded up like Image.reduce), one
+    # of the `length` pastes stands for `repeat` pastes of the full size.
+    # Axis aligned directions run directly on rows/columns, every other angle
+    # is rotated onto the x axis, smeared and rotated back. The rotation uses
+    # nearest neighbour sampling so the sweep sees the original alpha values,
+    # the way back is bilinear. The pastes went to (int(i * dx), int(i * dy)),
+    # on average half a pixel closer to the silhouette than the exact line,
+    # so the result is moved back by that half pixel.
+    # Oblique edges differ from the pastes along the digital line by up to a
+    # pixel; after the blur of the node (radius 10, the draft blurs the
+    # reduced result by the same amount) at most 4 levels on anti-aliased
+    # edges, 16 on hard 0/255 edges.
+    alpha_np = np.asarray(alpha)
+    height, width = alpha_np.shape
+    if abs(dy) < 1e-9 or abs(dx) < 1e-9:
+        if repeat > 1:
+            alpha_np = np.pad(alpha_np, ((0, -height % repeat), (0, -width % repeat)))
+        rows = alpha_np if abs(dy) < 1e-9 else alpha_np.T
+        step = dx if abs(dy) < 1e-9 else dy
+        if step < 0:
+            rows = rows[:, ::-1]
+        smeared = _reduced_sweep(rows, length, repeat)
+        if step < 0:
+            smeared = smeared[:, ::-1]
+        if abs(dy) >= 1e-9:
+            smeared = smeared.T
+        return Image.fromarray(np.ascontiguousarray(smeared))
+
+    alpha_pil = Image.fromarray(alpha_np)
+    cos_a, sin_a = dx / math.hypot(dx, dy), dy / math.hypot(dx, dy)
+    # One pixel of room on each side, the rotated corners are not cut off,
+    # rounded up to a multiple of `repeat`
+    rotated_width = int(math.ceil(abs(cos_a) * width + abs(sin_a) * height)) + 2
+    rotated_height = int(math.ceil(abs(sin_a) * width + abs(cos_a) * height)) + 2
+    rotated_width += -rotated_width % repeat
+    rotated_height += -rotated_height % repeat
+    cx, cy = width / 2, height / 2
+    rcx, rcy = rotated_width / 2, rotated_height / 2
+
+    # Rotated frame: the x axis points along the shadow direction
+    rotated = alpha_pil.transform(
+        (rotated_width, rotated_height),
+        Image.AFFINE,
+        (cos_a, -sin_a, cx - cos_a * rcx + sin_a * rcy, sin_a, cos_a, cy - sin_a * rcx - cos_a * rcy),
+        resample=Image.NEAREST
+    )
+    smeared = Image.fromarray(_reduced_sweep(np.asarray(rotated), length, repeat))
+    # Back, moved by half a pixel towards the silhouette. A reduced pixel of
+    # the sweep holds the alpha `bias` full pixels beyond its middle.
+    cx -= math.copysign(0.5, dx)
+    cy -= math.copysign(0.5, dy)
+    bias = (repeat - 1) / 2 - (repeat - 1) // 2
+    return smeared.transform(
+        (-(-width // repeat), -(-height // repeat)),
+        Image.AFFINE,
+        (cos_a, sin_a, (rcx - cos_a * cx - sin_a * cy - bias) / repeat,
+         -sin_a, cos_a, (rcy + sin_a * cx - cos_a * cy) / repeat),
+        resample=Image.BILINEAR
+    )
+
+
 class PerfectShadow:
     @classmethod
     def INPUT_TYPES(s):
         return {
             "required": {
                 "image": ("IMAGE",),
-                "light_from": ("INT", {
+                "light_from": ("FLOAT", {
                     "default": 12,
-                    "min": 1,
+                    "min": 0,
                     "max": 12,
-                    "step": 1,
+                    "step": 0.1,
                     "display": "slider"
                 }),
                 "shadow_length": ("INT", {
@@ -31,6 +218,11 @@ class PerfectShadow:
                     "display": "slider"
                 }),
             },
+            "optional": {
+                "quality": (QUALITIES, {
+                    "default": "full"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -38,34 +230,26 @@ class PerfectShadow:
 
     CATEGORY = "Goede"
 
-    def apply_shadow(self, image, light_from, shadow_length, opacity):
-        # The input is a tensor, but we will treat it as a numpy array
-        # and convert it to a PIL image.
-        if hasattr(image, 'cpu'):
-            image = image.cpu().numpy()
-        image_np = np.clip(255. * image.squeeze(), 0, 255).astype(np.uint8)
-        image_pil = Image.fromarray(image_np)
-
-        # Ensure image is RGBA
-        if image_pil.mode != 'RGBA':
-            image_pil = image_pil.convert('RGBA')
-
-        # Create a silhouette
-        alpha = image_pil.getchannel('A')
-        shadow_color = (0, 0, 0, int(opacity * 255))
-        shadow = Image.new('RGBA', image_pil.size, shadow_color)
-        shadow.putalpha(alpha)
-
+    @profiling.profiled("PerfectShadow")
+    def apply_shadow(self, image, light_from, shadow_length, opacity, quality="full"):
         # Shadow parameters
         shadow_length = shadow_length * 100  # A large value to create a long shadow
         blur_radius = 10
+        x_shear, y_shear = self._shear(light_from)
+
+        # The input can be a tensor or a numpy array, every batch item
+        # is converted to an RGBA uint8 array.
+        final_images = parallel.map_items(
+            lambda image_np: self._apply_shadow_single(image_np, shadow_length, blur_radius, x_shear, y_shear, quality, opacity),
+            image_batch_to_rgba(image)
+        )
+        return (uint8_batch_to_tensor(final_images),)
 
+    def _shear(self, light_from):
         # Angle mapping from clock hour to degrees
-        angle_map = {
-            1: 150, 2: 120, 3: 90, 4: 60, 5: 30, 6: 0,
-            7: 330, 8: 300, 9: 270, 10: 240, 11: 210, 12: 180
-        }
-        angle = angle_map[light_from]
+        # (1: 150, 2: 120, 3: 90, ... 6: 0, 7: 330, ... 12: 180),
+        # fractional hours lie in between
+        angle = (180 - 30 * light_from) % 360
         angle_rad = math.radians(angle)
 
         # The direction of the shadow is opposite to the light source
@@ -74,46 +258,100 @@ class PerfectShadow:
         # Create a long shadow by shearing the image
         x_shear = math.cos(shadow_angle_rad)
         y_shear = math.sin(shadow_angle_rad)
+        return x_shear, y_shear
 
-        # We create a new image large enough to hold the sheared shadow
-        new_width = image_pil.width + abs(int(shadow_length * x_shear))
-        new_height = image_pil.height + abs(int(shadow_length * y_shear))
+    def _apply_shadow_single(self, image_np, shadow_length, blur_radius, x_shear, y_shear, quality="full", opacity=1.0):
+        # image_np is an RGBA uint8 array, the result is one as well
+        height, width = image_np.shape[:2]
+
+        # Create a silhouette
+        alpha = alpha_image(image_np)
 
-        long_shadow = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
+        # We create a new image large enough to hold the sheared shadow
+        new_width = width + abs(int(shadow_length * x_shear))
+        new_height = height + abs(int(shadow_length * y_shear))
 
-        # Paste the silhouette multiple times to create the long shadow effect
-        for i in range(shadow_length):
-            x_offset = int(i * x_shear)
-            y_offset = int(i * y_shear)
+        # The silhouette starts centered in the new canvas
+        silhouette = Image.new('L', (new_width, new_height), 0)
+        silhouette.paste(alpha, ((new_width - width) // 2, (new_height - height) // 2))
 
-            # Adjust position to keep the shadow within the new canvas
-            paste_x = (new_width - image_pil.width) // 2 + x_offset
-            paste_y = (new_height - image_pil.height) // 2 + y_offset
+        if quality == "draft":
+            # Smear the silhouette into a reduced layer and blur it,
+            # upsampled for the composite. One paste along the reduced row
+            # stands for DRAFT_FACTOR pastes of the full row.
+            with profiling.stage("smear") as s:
+                shadow_alpha = s.output(directional_smear(
+                    silhouette, x_shear, y_shear, max(1, round(shadow_length / DRAFT_FACTOR)), DRAFT_FACTOR
+                ))
+            shadow_layer = upsample_layer(blur_layer(alpha_layer(shadow_alpha), blur_radius / DRAFT_FACTOR), new_width, new_height)
+        else:
+            # Smear the silhouette along the shadow direction in a single pass
+            # (same as pasting it at every offset 0..shadow_length-1)
+            with profiling.stage("smear") as s:
+                shadow_alpha = s.output(directional_smear(silhouette, x_shear, y_shear, shadow_length))
 
-            long_shadow.paste(shadow, (paste_x, paste_y), shadow)
+            # Blur the shadow (only its alpha, the color is black), only within
+            # the bounding box of the smeared silhouette
+            shadow_layer = blur_layer(alpha_layer(shadow_alpha), blur_radius)
 
-        # Blur the shadow
-        if blur_radius > 0:
-            long_shadow = long_shadow.filter(ImageFilter.GaussianBlur(blur_radius))
+        # The shadow alpha is scaled by the opacity
+        if opacity < 1.0 and not is_empty(shadow_layer):
+            lut = [round(value * opacity) for value in range(256)]
+            shadow_layer = shadow_layer._replace(image=shadow_layer.image.point(lut))
 
         # Composite the original image over the shadow
         # The original image should be centered in the new canvas
-        img_x = (new_width - image_pil.width) // 2
-        img_y = (new_height - image_pil.height) // 2
+        img_x = (new_width - width) // 2
+        img_y = (new_height - height) // 2
+
+        return compositing.composite([
+            placed_layer(shadow_layer, (0, 0, 0), 0, 0),
+            compositing.image_layer(image_np, img_x, img_y),
+        ], (new_width, new_height))
+
+class PerfectShadowSweep(PerfectShadow):
+    # Renders the image once for every full hour of light_from (1-12): a
+    # batch of 12 items per input item, in the order of LIGHT_POSITIONS. The
+    # image is converted once, the smear, blur and composite run per position
+    # in parallel. All items share one canvas with the subject at the same
+    # position.
+    @classmethod
+    def INPUT_TYPES(s):
+        input_types = super().INPUT_TYPES()
+        required = dict(input_types["required"])
+        del required["light_from"]
+        return {"required": required, "optional": input_types["optional"]}
 
-        final_image = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
-        final_image.paste(long_shadow, (0,0), long_shadow)
-        final_image.paste(image_pil, (img_x, img_y), image_pil)
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "sweep"
 
-        # Convert back to numpy array, which is what the test expects
-        final_array = np.array(final_image).astype(np.float32) / 255.0
-        # We need to add the batch dimension back
-        return (torch.from_numpy(final_array[np.newaxis, ...]),)
+    CATEGORY = "Goede"
+
+    @profiling.profiled("PerfectShadowSweep")
+    def sweep(self, image, shadow_length, opacity, quality="full"):
+        shadow_length = shadow_length * 100
+        blur_radius = 10
+        shears = [self._shear(light_from) for light_from in LIGHT_POSITIONS]
+        final_images = []
+        for image_np in image_batch_to_rgba(image):
+            placed = parallel.map_items(
+                lambda shear: Image.fromarray(self._apply_shadow_single(image_np, shadow_length, blur_radius, *shear, quality, opacity)),
+                shears
+            )
+            # The image is centered in every canvas
+            height, width = image_np.shape[:2]
+            final_images.extend(align_images(placed, [
+                ((final_image.width - width) // 2, (final_image.height - height) // 2)
+                for final_image in placed
+            ]))
+        return (pil_batch_to_tensor(final_images),)
 
 NODE_CLASS_MAPPINGS = {
-    "PerfectShadow": PerfectShadow
+    "PerfectShadow": PerfectShadow,
+    "PerfectShadowSweep": PerfectShadowSweep
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "PerfectShadow": "Perfect Shadow"
+    "PerfectShadow": "Perfect Shadow",
+    "PerfectShadowSweep": "Perfect Shadow Sweep"
 }
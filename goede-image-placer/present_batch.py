@@ -0,0 +1,218 @@
+"""Headless batch run of the Present workflow over RGBA cutouts.
+
+workflow/Present.json places a cutout on a background with padding and a drop
+shadow: ImageSelector -> AddPadding -> DropShadow -> ImageComposite. This
+script calls the node classes directly, one input image at a time:
+
+    python goede-image-placer/present_batch.py --input cutouts/ --output presented/ --background bgimage_02.jpg
+    python goede-image-placer/present_batch.py --manifest nightly.txt --output presented/ --background /srv/bg.jpg --workers 16
+
+The inputs are read lazily and handed to a pool of worker processes through
+a bounded queue (--queue-size), every result is written as soon as it is
+done, so memory stays flat for any number of inputs. Outputs are written
+atomically and existing ones are skipped, an interrupted run continues where
+it stopped (--overwrite renders everything again). A summary with the
+throughput is printed at the end; the exit status is 1 if any input failed.
+
+The cutouts already have their alpha channel, so the background removal of
+the workflow (RMBG) is not part of the chain. DropShadow and ImageComposite
+run as ShadowComposite, which gives the same pixels without the
+intermediate tensor.
+"""
+import os
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from PIL import Image
+
+try:
+    from .image_utils import image_batch_to_pil, pil_batch_to_tensor
+    from .image_selector import ImageSelector, IMAGE_DIR
+    from .add_padding import AddPadding
+    from .shadow_composite import ShadowComposite
+    from . import parallel
+except ImportError:
+    from image_utils import image_batch_to_pil, pil_batch_to_tensor
+    from image_selector import ImageSelector, IMAGE_DIR
+    from add_padding import AddPadding
+    from shadow_composite import ShadowComposite
+    import parallel
+
+IMAGE_EXTENSIONS = (".png", ".webp", ".tif", ".tiff")
+
+# Widget values of workflow/Present.json
+DEFAULT_PADDING = (196, 217, 186, 146)
+DEFAULT_SPACING = 50
+
+# Settings and background of a worker process, set by _init_worker
+_worker = {}
+
+
+def iter_inputs(input_dir=None, manifest=None):
+    # Input paths, lazily: the image files of a directory (sorted), or the
+    # lines of a manifest (paths relative to the manifest, # comments)
+    if manifest is not None:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.join(base, line)
+        return
+    for name in sorted(os.listdir(input_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield os.path.join(input_dir, name)
+
+
+def output_path(input_path, output_dir, extension):
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, name + extension)
+
+
+def load_background(background):
+    # A file name of the selector's image directory, or a path
+    if os.path.exists(os.path.join(IMAGE_DIR, background)):
+        return ImageSelector().select_image(background)[0]
+    with Image.open(background) as image:
+        return pil_batch_to_tensor([image.convert("RGB")])
+
+
+def load_cutout(path):
+    with Image.open(path) as image:
+        return pil_batch_to_tensor([image.convert("RGBA")])
+
+
+def present(cutout, background, settings):
+    # The node chain of the workflow for one [1,H,W,4] cutout
+    padded, _, _ = AddPadding().add_padding(cutout, *settings["padding"])
+    _, composite_rgb = ShadowComposite().composite(
+        background, padded, settings["spacing"], settings["shadow_angle"], settings["shadow_distance"],
+        settings["shadow_blur"], settings["shadow_scale"], settings["shadow_color"], settings["blur_strategy"]
+    )
+    return composite_rgb
+
+
+def _init_worker(settings, processes=True):
+    if processes:
+        # The processes share the cores, the thread pool of the nodes stays off
+        import torch
+        torch.set_num_threads(1)
+        parallel.set_max_workers(1)
+    _worker["settings"] = settings
+    _worker["background"] = load_background(settings["background"])
+
+
+def process_item(input_path, destination):
+    # Runs in a worker process; returns the number of output pixels
+    settings = _worker["settings"]
+    composite = present(load_cutout(input_path), _worker["background"], settings)
+    image = image_batch_to_pil(composite)[0]
+    temporary = destination + ".part"
+    image.save(temporary, format=Image.registered_extensions()[os.path.splitext(destination)[1].lower()])
+    os.replace(temporary, destination)
+    return image.width * image.height
+
+
+def _process_or_error(input_path, destination):
+    try:
+        return process_item(input_path, destination), None
+    except Exception:
+        return 0, traceback.format_exc()
+
+
+def run(args):
+    settings = {
+        "background": args.background,
+        "padding": tuple(args.padding),
+        "spacing": args.spacing,
+        "shadow_angle": args.shadow_angle,
+        "shadow_distance": args.shadow_distance,
+        "shadow_blur": args.shadow_blur,
+        "shadow_scale": args.shadow_scale,
+        "shadow_color": args.shadow_color,
+        "blur_strategy": args.blur_strategy,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    stats = {"done": 0, "skipped": 0, "failed": 0, "pixels": 0}
+
+    def pending():
+        for input_path in iter_inputs(args.input, args.manifest):
+            destination = output_path(input_path, args.output, args.extension)
+            if not args.overwrite and os.path.exists(destination):
+                stats["skipped"] += 1
+                continue
+            yield input_path, destination
+
+    def finished(input_path, pixels, error):
+        if error is None:
+            stats["done"] += 1
+            stats["pixels"] += pixels
+        else:
+            stats["failed"] += 1
+            print(f"FAILED {input_path}\n{error}", file=sys.stderr)
+        if args.progress and (stats["done"] + stats["failed"]) % args.progress == 0:
+            print(f"{stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped")
+
+    start = time.perf_counter()
+    if args.workers == 0:
+        # In this process, e.g. for debugging
+        _init_worker(settings, processes=False)
+        for input_path, destination in pending():
+            finished(input_path, *_process_or_error(input_path, destination))
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.workers, mp_context=context, initializer=_init_worker, initargs=(settings,)) as pool:
+            # At most queue_size inputs are in flight, the next one is only
+            # read when a result came back
+            running = {}
+            for input_path, destination in pending():
+                if len(running) >= args.queue_size:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished(running.pop(future), *future.result())
+                running[pool.submit(_process_or_error, input_path, destination)] = input_path
+            for future in list(running):
+                finished(running.pop(future), *future.result())
+    elapsed = time.perf_counter() - start
+
+    print(f"{stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped in {elapsed:.1f} s: "
+          f"{stats['done'] / elapsed if elapsed else 0:.2f} images/s, {stats['pixels'] / 1e6 / elapsed if elapsed else 0:.1f} MP/s")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--input", help="directory of RGBA cutouts")
+    inputs.add_argument("--manifest", help="text file with one cutout path per line")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--extension", default=".png", help="output format (default: .png)")
+    parser.add_argument("--background", required=True, help="image of the selector's directory or a path")
+    parser.add_argument("--padding", nargs=4, type=int, default=DEFAULT_PADDING, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"))
+    parser.add_argument("--spacing", type=int, default=DEFAULT_SPACING)
+    parser.add_argument("--shadow-angle", type=int, default=6)
+    parser.add_argument("--shadow-distance", type=int, default=50)
+    parser.add_argument("--shadow-blur", type=int, default=20)
+    parser.add_argument("--shadow-scale", type=float, default=1.5)
+    parser.add_argument("--shadow-color", default="#000000")
+    parser.add_argument("--blur-strategy", default="auto")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 0 runs in this process")
+    parser.add_argument("--queue-size", type=int, help="inputs in flight (default: 2 per worker)")
+    parser.add_argument("--overwrite", action="store_true", help="render inputs whose output exists")
+    parser.add_argument("--progress", type=int, default=100, help="print progress every N images, 0 disables it")
+    args = parser.parse_args(argv)
+    if not os.path.exists(os.path.join(IMAGE_DIR, args.background)) and not os.path.exists(args.background):
+        parser.error(f"Background not found: {args.background}")
+    if args.queue_size is None:
+        args.queue_size = 2 * max(args.workers, 1)
+
+    stats = run(args)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
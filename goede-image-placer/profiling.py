@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+import contextvars
+from collections import deque
+
+# Opt-in per-stage timing of the nodes. Every node call records the duration
+# and output size of its stages (conversions, resize, blur, affine transform,
+# paste, ...):
+#
+#   GOEDE_PROFILE=1                  enable at import time
+#   GOEDE_PROFILE_TRACE=trace.json   enable, and write a Chrome trace
+#                                    (chrome://tracing, Perfetto) at exit
+#   profiling.enable() / disable()   switch at runtime
+#
+# Finished calls are kept in RECORDS (the most recent ones) and passed to
+# every listener registered with add_listener(), e.g. to forward them to a
+# metrics system. A call looks like
+#   {"node": "DropShadow", "start": <epoch s>, "duration": <s>, "thread": ...,
+#    "stages": [{"name": "blur", "start": <s since call start>,
+#                "duration": <s>, "depth": 0, "output": [w, h],
+#                "thread": ...}, ...]}
+# Stages can also run on the worker threads of parallel.py, with the depth
+# they were submitted at.
+#
+# When profiling is disabled, stage() returns a shared no-op object and the
+# node wrappers only check a flag.
+
+ENABLED = bool(os.environ.get("GOEDE_PROFILE") not in (None, "", "0") or os.environ.get("GOEDE_PROFILE_TRACE"))
+
+RECORDS = deque(maxlen=1000)
+
+_listeners = []
+_lock = threading.Lock()
+_current_call = contextvars.ContextVar("goede_profile_call", default=None)
+_depth = contextvars.ContextVar("goede_profile_depth", default=0)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def disable():
+    enable(False)
+
+
+def add_listener(callback):
+    # callback(record) is called for every finished node call
+    with _lock:
+        _listeners.append(callback)
+    return callback
+
+
+def remove_listener(callback):
+    with _lock:
+        _listeners.remove(callback)
+
+
+def output_size(value):
+    # Size of a stage result: [w, h] for PIL images, the shape for arrays and
+    # tensors, the image size for shadow layers
+    if hasattr(value, "shape"):
+        return list(value.shape)
+    if hasattr(value, "getbands"):
+        return list(value.size)
+    if hasattr(value, "image") and hasattr(value.image, "size"):
+        return list(value.image.size)
+    if isinstance(value, (tuple, list)) and value:
+        return output_size(value[0])
+    return None
+
+
+class _NullStage:
+    # Returned by stage() while profiling is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def output(self, value):
+        return value
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, call, name):
+        self.call = call
+        self.entry = {"name": name, "start": 0.0, "duration": 0.0, "depth": 0, "output": None,
+                      "thread": threading.current_thread().name}
+
+    def __enter__(self):
+        self.entry["depth"] = _depth.get()
+        self._token = _depth.set(self.entry["depth"] + 1)
+        self.entry["start"] = time.perf_counter() - self.call["_t0"]
+        return self
+
+    def __exit__(self, *exc):
+        self.entry["duration"] = time.perf_counter() - self.call["_t0"] - self.entry["start"]
+        _depth.reset(self._token)
+        with _lock:
+            self.call["stages"].append(self.entry)
+        return False
+
+    def output(self, value):
+        # Records the size of the result; accelerator work is waited for so
+        # that the duration covers it
+        if getattr(value, "is_cuda", False):
+            import torch
+            torch.cuda.synchronize(value.device)
+        self.entry["output"] = output_size(value)
+        return value
+
+
+def stage(name):
+    # with profiling.stage("blur") as s:
+    #     result = s.output(blur(...))
+    call = _current_call.get() if ENABLED else None
+    if call is None:
+        return _NULL_STAGE
+    return _Stage(call, name)
+
+
+def timed(name):
+    # Decorator: every call of the function is one stage, its result the output
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with stage(name) as s:
+                return s.output(function(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def current_context():
+    # Context to run per-item work of the current call in (e.g. on worker
+    # threads), so that its stages are recorded with the call
+    return contextvars.copy_context()
+
+
+def _finish(call):
+    record = {key: value for key, value in call.items() if not key.startswith("_")}
+    record["stages"].sort(key=lambda entry: entry["start"])
+    RECORDS.append(record)
+    with _lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        callback(record)
+
+
+def profiled(node_name):
+    # Decorator for the FUNCTION of a node
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED or _current_call.get() is not None:
+                return function(*args, **kwargs)
+            call = {
+                "node": node_name,
+                "start": time.time(),
+                "duration": 0.0,
+                "thread": threading.current_thread().name,
+                "stages": [],
+                "_t0": time.perf_counter(),
+            }
+            token = _current_call.set(call)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                call["duration"] = time.perf_counter() - call["_t0"]
+                _current_call.reset(token)
+                _finish(call)
+        return wrapper
+    return decorator
+
+
+def trace_events(records=None):
+    # Chrome trace events ("X" complete events, microseconds) for the records
+    events = []
+    for record in RECORDS if records is None else records:
+        start_us = record["start"] * 1e6
+        events.append({
+            "name": record["node"], "ph": "X", "ts": start_us, "dur": record["duration"] * 1e6,
+            "pid": os.getpid(), "tid": record["thread"], "cat": "node",
+        })
+        for entry in record["stages"]:
+            events.append({
+                "name": entry["name"], "ph": "X", "ts": start_us + entry["start"] * 1e6, "dur": entry["duration"] * 1e6,
+                "pid": os.getpid(), "tid": entry["thread"], "cat": record["node"],
+                "args": {"output": entry["output"]},
+            })
+    return events
+
+
+def dump_trace(path, records=None):
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events(records)}, f)
+
+
+if os.environ.get("GOEDE_PROFILE_TRACE"):
+    atexit.register(dump_trace, os.environ["GOEDE_PROFILE_TRACE"])
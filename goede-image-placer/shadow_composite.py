@@ -0,0 +1,262 @@
+import math
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    from .image_utils import image_to_numpy, uint8_to_pil, rgb_view
+    from .blur import BLUR_STRATEGIES
+    from .drop_shadow import DropShadow
+    from .image_composite import ImageComposite
+    from .shadow_layer import placed_layer, QUALITIES
+    from .memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    from . import torch_backend
+    from . import compositing
+    from . import tiling
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_to_numpy, uint8_to_pil, rgb_view
+    from blur import BLUR_STRATEGIES
+    from drop_shadow import DropShadow
+    from image_composite import ImageComposite
+    from shadow_layer import placed_layer, QUALITIES
+    from memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    import torch_backend
+    import compositing
+    import tiling
+    import profiling
+    import parallel
+
+# DropShadow followed by ImageComposite in one node. The shadow canvas of
+# DropShadow (subject and shadow, padded to the largest item of the batch) is
+# never built, only its scale is computed. The parts of the canvas that are
+# resized and blended straight onto the background at their final position:
+#   * the shadow layer alone,
+#   * the subject over the shadow below it, on the rectangle of the subject;
+#     the resized shadow is cut out where this one lands.
+# Each part is resampled on the positions of the whole canvas, with the
+# pixels around it the filter reads (_resize_boxes), so the output is that of
+# chaining the two nodes up to the float rounding of the resize boxes in PIL
+# (a level or two on a few edge pixels).
+
+# Support of the BICUBIC filter in input pixels (when enlarging)
+BICUBIC_SUPPORT = 2.0
+
+
+def _resize_boxes(box, canvas_size, size):
+    # box = (x0, y0, x1, y1), the content on a transparent canvas of
+    # canvas_size, the canvas resized to `size` with BICUBIC. Returns the
+    # output rectangle the content reaches, the canvas rectangle its filter
+    # reads (clipped to the canvas, the filter is renormalized at the canvas
+    # edges like on the whole canvas) and the resize box in that rectangle;
+    # None if the content reaches no output pixel.
+    canvas_width, canvas_height = canvas_size
+    width, height = size
+    scale_x, scale_y = width / canvas_width, height / canvas_height
+    support_x = BICUBIC_SUPPORT * max(1.0, 1 / scale_x)
+    support_y = BICUBIC_SUPPORT * max(1.0, 1 / scale_y)
+
+    x0 = max(0, math.floor((box[0] - support_x) * scale_x) - 1)
+    y0 = max(0, math.floor((box[1] - support_y) * scale_y) - 1)
+    x1 = min(width, math.ceil((box[2] + support_x) * scale_x) + 1)
+    y1 = min(height, math.ceil((box[3] + support_y) * scale_y) + 1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    resize_box = (x0 / scale_x, y0 / scale_y, x1 / scale_x, y1 / scale_y)
+    source_x0 = max(0, math.floor(resize_box[0] - support_x) - 1)
+    source_y0 = max(0, math.floor(resize_box[1] - support_y) - 1)
+    source_x1 = min(canvas_width, math.ceil(resize_box[2] + support_x) + 1)
+    source_y1 = min(canvas_height, math.ceil(resize_box[3] + support_y) + 1)
+    resize_box = (resize_box[0] - source_x0, resize_box[1] - source_y0, resize_box[2] - source_x0, resize_box[3] - source_y0)
+    return (x0, y0, x1, y1), (source_x0, source_y0, source_x1, source_y1), resize_box
+
+
+def _resize(source, output_box, resize_box):
+    with profiling.stage("resize") as s:
+        return s.output(source.resize((output_box[2] - output_box[0], output_box[3] - output_box[1]), Image.BICUBIC, box=resize_box))
+
+
+class ShadowComposite:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "background_image": ("IMAGE",),
+                "subject_image": ("IMAGE",),
+                "spacing": ("INT", {
+                    "default": 10,
+                    "min": 0,
+                    "max": 50,
+                    "step": 1,
+                    "display": "slider"
+                }),
+                "shadow_angle": ("INT", {
+                    "default": 6,
+                    "min": 0,
+                    "max": 12,
+                    "step": 1,
+                    "display": "slider"
+                }),
+                "shadow_distance": ("INT", {
+                    "default": 50,
+                    "min": 0,
+                    "max": 500,
+                    "step": 1,
+                    "display": "slider"
+                }),
+                "shadow_blur": ("INT", {
+                    "default": 20,
+                    "min": 0,
+                    "max": 200,
+                    "step": 1,
+                    "display": "slider"
+                }),
+                "shadow_scale": ("FLOAT", {
+                    "default": 1.5,
+                    "min": 0.1,
+                    "max": 5.0,
+                    "step": 0.1,
+                    "display": "slider"
+                }),
+                "shadow_color": ("STRING", {
+                    "default": "#000000"
+                }),
+            },
+            "optional": {
+                "blur_strategy": (BLUR_STRATEGIES, {
+                    "default": "auto"
+                }),
+                "backend": (torch_backend.BACKENDS, {
+                    "default": "auto"
+                }),
+                "output_dtype": (OUTPUT_DTYPES, {
+                    "default": "float32"
+                }),
+                "max_megapixels": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 10000.0,
+                    "step": 1.0
+                }),
+                "oversize": (OVERSIZE_POLICIES, {
+                    "default": "downscale"
+                }),
+                "quality": (QUALITIES, {
+                    "default": "full"
+                }),
+                "tiled": (tiling.TILING_MODES, {
+                    "default": "auto"
+                }),
+            },
+        }
+
+    RETURN_TYPES = ("IMAGE", "IMAGE")
+    FUNCTION = "composite"
+
+    CATEGORY = "Goede"
+
+    @profiling.profiled("ShadowComposite")
+    def composite(self, background_image, subject_image, spacing, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", backend="auto",
+                  output_dtype="float32", max_megapixels=0.0, oversize="downscale", quality="full", tiled="auto"):
+        limit = MemoryLimit(max_megapixels, oversize, output_dtype)
+        shadow_args = (shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy, limit, quality)
+
+        if torch_backend.resolve_backend(backend, subject_image) == "torch":
+            # Stays on the device of the subject
+            shadowed = torch_backend.stack_planes(DropShadow().render_torch(subject_image, *shadow_args))
+            composite_tensor = ImageComposite().composite_torch(background_image, shadowed, spacing)[0].to(limit.dtype)
+            return (composite_tensor, rgb_view(composite_tensor))
+
+        backgrounds = image_to_numpy(background_image)
+        background_height, background_width = backgrounds.shape[1:3]
+        strip_rows = tiling.STRIP_ROWS if tiling.use_tiles(tiled, (background_width, background_height)) else 0
+        return self.composite_pil(backgrounds, image_to_numpy(subject_image), spacing, *shadow_args, strip_rows)
+
+    def composite_pil(self, backgrounds, subjects, spacing, shadow_angle, shadow_distance, shadow_blur, shadow_scale, shadow_color, blur_strategy="auto", limit=None,
+                      quality="full", strip_rows=0):
+        # backgrounds and subjects are [B,H,W,C] float arrays. The shadow
+        # stages are those of DropShadow, its canvas only sets the scale.
+        if len(backgrounds) != len(subjects) and 1 not in (len(backgrounds), len(subjects)):
+            raise ValueError(f"Batch sizes do not match: {len(backgrounds)} backgrounds, {len(subjects)} subjects")
+        batch_size = max(len(backgrounds), len(subjects))
+        limit = limit or MemoryLimit()
+        drop_shadow = DropShadow()
+        image_composite = ImageComposite()
+
+        offset_x, offset_y = drop_shadow._offset(shadow_angle, shadow_distance)
+        layouts = parallel.map_items(
+            lambda item: drop_shadow._layout(tiling.alpha_channel(item), shadow_angle, offset_x, offset_y, shadow_blur, shadow_scale, blur_strategy, limit, quality, strip_rows),
+            subjects
+        )
+        # DropShadow pads the items of a batch to a common canvas, it is
+        # scaled to the width of the background less the spacing
+        canvas_size = (max(w for _, _, _, (w, _) in layouts), max(h for _, _, _, (_, h) in layouts))
+        background_height, background_width = backgrounds.shape[1:3]
+        new_width, new_height, paste_x, paste_y = image_composite.placement(
+            (background_width, background_height), canvas_size, spacing
+        )
+
+        def placed_layers(item, layout):
+            # Shadow and subject of one item, resized onto the background
+            shadow_layer, (shadow_x, shadow_y), (image_x, image_y), _ = layout
+            shadow = placed_layer(shadow_layer, shadow_color, shadow_x, shadow_y)
+            subject = uint8_to_pil(tiling.to_uint8(item, strip_rows), "RGBA")
+            layers = []
+
+            # The subject over the shadow, canvas pixels only around the subject
+            subject_boxes = _resize_boxes((image_x, image_y, image_x + subject.width, image_y + subject.height), canvas_size, (new_width, new_height))
+            if subject_boxes is not None:
+                output_box, (x0, y0, x1, y1), resize_box = subject_boxes
+                region = compositing.composite([
+                    shadow._replace(x=shadow.x - x0, y=shadow.y - y0) if shadow is not None else None,
+                    compositing.image_layer(subject, image_x - x0, image_y - y0),
+                ], (x1 - x0, y1 - y0))
+                resized = np.asarray(_resize(Image.fromarray(region, "RGBA"), output_box, resize_box))
+                layers.append(compositing.image_layer(resized, paste_x + output_box[0], paste_y + output_box[1]))
+
+            # The rest of the shadow
+            if shadow is not None:
+                shadow_height, shadow_width = shadow.pixels.shape
+                shadow_boxes = _resize_boxes((shadow.x, shadow.y, shadow.x + shadow_width, shadow.y + shadow_height), canvas_size, (new_width, new_height))
+                if shadow_boxes is not None:
+                    output_box, (x0, y0, x1, y1), resize_box = shadow_boxes
+                    # In color: PIL resizes RGBA premultiplied in 8 bit, the
+                    # color of the resized shadow varies with its alpha
+                    region = compositing.composite([shadow._replace(x=shadow.x - x0, y=shadow.y - y0)], (x1 - x0, y1 - y0))
+                    resized = np.array(_resize(Image.fromarray(region, "RGBA"), output_box, resize_box))
+                    if subject_boxes is not None:
+                        # Cut out where the subject part lands
+                        sx0, sy0, sx1, sy1 = subject_boxes[0]
+                        resized[max(0, sy0 - output_box[1]):max(0, sy1 - output_box[1]), max(0, sx0 - output_box[0]):max(0, sx1 - output_box[0])] = 0
+                    layers.insert(0, compositing.image_layer(resized, paste_x + output_box[0], paste_y + output_box[1]))
+            return layers
+
+        layers = parallel.map_items(lambda i: placed_layers(subjects[i], layouts[i]), range(len(subjects)))
+
+        composite_tensor = torch.empty((batch_size, background_height, background_width, 4), dtype=limit.dtype)
+
+        def composite_item(i):
+            composite = composite_tensor[i]
+            image_composite.fill_background(composite, backgrounds[i % len(backgrounds)])
+            item_layers = layers[i % len(layers)]
+            if not item_layers:
+                return
+            # Only the rectangle the layers cover is blended
+            x0 = max(0, min(layer.x for layer in item_layers))
+            y0 = max(0, min(layer.y for layer in item_layers))
+            x1 = min(background_width, max(layer.x + layer.pixels.shape[1] for layer in item_layers))
+            y1 = min(background_height, max(layer.y + layer.pixels.shape[0] for layer in item_layers))
+            image_composite.blend(composite, item_layers, (x0, y0, x1, y1), strip_rows)
+
+        parallel.map_items(composite_item, range(batch_size))
+        return (composite_tensor, rgb_view(composite_tensor))
+
+NODE_CLASS_MAPPINGS = {
+    "ShadowComposite": ShadowComposite
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "ShadowComposite": "Shadow Composite"
+}
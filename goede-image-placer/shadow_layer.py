@@ -0,0 +1,205 @@
+import math
+from collections import namedtuple
+
+from PIL import Image
+
+try:
+    from .blur import blur_alpha, blur_margin, blur_alignment
+    from .stage_cache import STAGE_CACHE
+    from . import compositing
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from blur import blur_alpha, blur_margin, blur_alignment
+    from stage_cache import STAGE_CACHE
+    import compositing
+    import profiling
+    import parallel
+
+# Silhouette stages shared by the shadow nodes:
+#   alpha -> scaled (LANCZOS, around the center) -> blurred -> (elliptic)
+# Product cutouts usually cover a small part of their canvas, so every stage
+# works on an AlphaLayer: the part of a width x height alpha canvas that can
+# be non-zero, placed at (x, y). Everything outside of it is transparent.
+# Regions are padded so that each stage produces exactly the pixels it would
+# produce on the full canvas.
+#
+# The stages go through the stage cache, keyed by the content hash of the
+# alpha channel and the parameters of the stage and the stages before it.
+#
+# Quality "draft" (interactive previews) runs the stages on the alpha reduced
+# by DRAFT_FACTOR, with the blur radius and lengths scaled to match, and
+# upsamples the finished layer onto the full size canvas for the composite.
+# The canvas and the placement stay those of "full".
+
+AlphaLayer = namedtuple("AlphaLayer", ["image", "x", "y", "width", "height"])
+
+# Transparent border every layer keeps around its content (bicubic sampling
+# near the region border then sees the same zeros as on the full canvas)
+LAYER_PADDING = 4
+
+QUALITIES = ["full", "draft"]
+
+# Clock positions of light_from, rendered by the sweep nodes
+LIGHT_POSITIONS = list(range(1, 13))
+
+DRAFT_FACTOR = 4
+
+
+def _empty_layer(width, height):
+    return AlphaLayer(Image.new('L', (0, 0)), 0, 0, width, height)
+
+
+def is_empty(layer):
+    return layer.image.width == 0 or layer.image.height == 0
+
+
+def alpha_layer(alpha):
+    # Crop an "L" alpha canvas to its bounding box (plus padding)
+    box = alpha.getbbox()
+    if box is None:
+        return _empty_layer(alpha.width, alpha.height)
+    x0 = max(0, box[0] - LAYER_PADDING)
+    y0 = max(0, box[1] - LAYER_PADDING)
+    x1 = min(alpha.width, box[2] + LAYER_PADDING)
+    y1 = min(alpha.height, box[3] + LAYER_PADDING)
+    return AlphaLayer(alpha.crop((x0, y0, x1, y1)), x0, y0, alpha.width, alpha.height)
+
+
+def layer_to_image(layer):
+    # Full canvas "L" image of a layer
+    image = Image.new('L', (layer.width, layer.height), 0)
+    if not is_empty(layer):
+        image.paste(layer.image, (layer.x, layer.y))
+    return image
+
+
+def draft_alpha(alpha, alpha_key):
+    # Alpha reduced by DRAFT_FACTOR and the key its stages are cached under
+    draft_key = (alpha_key, "draft", DRAFT_FACTOR)
+    reduced = STAGE_CACHE.get_or_compute(("draft",) + draft_key, lambda: alpha.reduce(DRAFT_FACTOR))
+    return reduced, draft_key
+
+
+def upsample_layer(layer, width, height):
+    # Draft layer onto the full size width x height canvas. A draft pixel
+    # covers DRAFT_FACTOR x DRAFT_FACTOR full pixels; the reduced canvas is
+    # rounded down in the stages, a layer reaching its edge is stretched to
+    # the edge of the full canvas.
+    if is_empty(layer):
+        return _empty_layer(width, height)
+    x0, y0 = layer.x * DRAFT_FACTOR, layer.y * DRAFT_FACTOR
+    x1 = (layer.x + layer.image.width) * DRAFT_FACTOR
+    y1 = (layer.y + layer.image.height) * DRAFT_FACTOR
+    if layer.x + layer.image.width >= layer.width:
+        x1 = max(x1, width)
+    if layer.y + layer.image.height >= layer.height:
+        y1 = max(y1, height)
+    with profiling.stage("upsample") as s:
+        image = layer.image.resize((x1 - x0, y1 - y0), Image.BILINEAR)
+        return s.output(AlphaLayer(image, x0, y0, width, height))
+
+
+def scale_layer(alpha, layer, shadow_scale):
+    # `alpha` is the full canvas the layer was cut from. LANCZOS with a box
+    # computes its sample positions relative to the box, which rounds
+    # differently than on the full canvas, so this stage resizes the full
+    # canvas and crops the result.
+    if shadow_scale == 1.0:
+        return layer
+    new_w = int(layer.width * shadow_scale)
+    new_h = int(layer.height * shadow_scale)
+    if is_empty(layer):
+        return _empty_layer(new_w, new_h)
+    with profiling.stage("resize") as s:
+        return s.output(alpha_layer(alpha.resize((new_w, new_h), Image.LANCZOS)))
+
+
+def _blur_rows(layer, radius, strategy, x0, x1, y0, y1):
+    # The layer blurred within the rectangle x0..x1, y0..y1 of its canvas
+    with profiling.stage("blur") as s:
+        region = Image.new('L', (x1 - x0, y1 - y0), 0)
+        region.paste(layer.image, (layer.x - x0, layer.y - y0))
+        return s.output(blur_alpha(region, radius, strategy))
+
+
+def blur_layer(layer, radius, strategy="auto", strip_rows=0):
+    # strip_rows > 0 blurs the region in strips of (at least) that many rows,
+    # each with a halo of blur_margin() rows, instead of at once; the
+    # strips hold the same pixels as the region blurred as a whole
+    if radius <= 0 or is_empty(layer):
+        return layer
+    margin = blur_margin(radius, strategy)
+    step = blur_alignment(radius, strategy)
+    padding = margin + LAYER_PADDING
+    x0 = max(0, (layer.x - padding) // step * step)
+    y0 = max(0, (layer.y - padding) // step * step)
+    x1 = min(layer.width, -(-(layer.x + layer.image.width + padding) // step) * step)
+    y1 = min(layer.height, -(-(layer.y + layer.image.height + padding) // step) * step)
+    if strip_rows <= 0 or y1 - y0 <= strip_rows:
+        return AlphaLayer(_blur_rows(layer, radius, strategy, x0, x1, y0, y1), x0, y0, layer.width, layer.height)
+
+    # Strips start on multiples of the alignment, like the region
+    rows = -(-max(strip_rows, 2 * margin) // step) * step
+    image = Image.new('L', (x1 - x0, y1 - y0), 0)
+
+    def blur_strip(strip_y0):
+        strip_y1 = min(y1, strip_y0 + rows)
+        halo_y0 = max(y0, strip_y0 - -(-margin // step) * step)
+        halo_y1 = min(y1, strip_y1 + margin)
+        strip = _blur_rows(layer, radius, strategy, x0, x1, halo_y0, halo_y1)
+        image.paste(strip.crop((0, strip_y0 - halo_y0, x1 - x0, strip_y1 - halo_y0)), (0, strip_y0 - y0))
+    parallel.map_items(blur_strip, range(y0, y1, rows))
+    return AlphaLayer(image, x0, y0, layer.width, layer.height)
+
+
+def ellipse_layer(layer, ellipse_scale):
+    # Same as transforming the full canvas to (width, int(height * ellipse_scale))
+    # with the affine (1, 0, 0, 0, ellipse_scale, 0) and BICUBIC: output pixel
+    # (X, Y) samples (X + 0.5, ellipse_scale * (Y + 0.5)), bicubic reaches 2 px
+    out_h = int(layer.height * ellipse_scale)
+    if is_empty(layer):
+        return _empty_layer(layer.width, out_h)
+    reach = 2 + LAYER_PADDING
+    x0 = max(0, layer.x - reach)
+    x1 = min(layer.width, layer.x + layer.image.width + reach)
+    y0 = max(0, math.floor((layer.y - reach) / ellipse_scale - 0.5))
+    y1 = min(out_h, math.ceil((layer.y + layer.image.height + reach) / ellipse_scale))
+    if y1 <= y0:
+        return _empty_layer(layer.width, out_h)
+    # PIL steps the source row by ellipse_scale from the top of the output, so
+    # the rows above the layer are kept to accumulate the same sample
+    # positions. Columns are offset by whole pixels, that is exact.
+    with profiling.stage("affine") as s:
+        source = Image.new('L', (layer.image.width, layer.y + layer.image.height), 0)
+        source.paste(layer.image, (0, layer.y))
+        image = source.transform(
+            (x1 - x0, y1),
+            Image.AFFINE,
+            (1, 0, x0 - layer.x, 0, ellipse_scale, 0),
+            resample=Image.BICUBIC
+        )
+        return s.output(AlphaLayer(image.crop((0, y0, x1 - x0, y1)), x0, y0, layer.width, out_h))
+
+
+def placed_layer(layer, color, x, y):
+    # The shadow layer in a single color, its canvas starting at (x, y), as a
+    # layer of compositing.composite(); None if it is empty
+    if is_empty(layer):
+        return None
+    return compositing.color_layer(layer.image, color, x + layer.x, y + layer.y)
+
+
+def scaled_layer(alpha, alpha_key, shadow_scale):
+    return STAGE_CACHE.get_or_compute(
+        ("scaled", alpha_key, shadow_scale),
+        lambda: scale_layer(alpha, alpha_layer(alpha), shadow_scale)
+    )
+
+
+def blurred_layer(alpha, alpha_key, shadow_scale, shadow_blur, blur_strategy, strip_rows=0):
+    # Blurred in strips or not, the pixels are the same (one cache entry)
+    return STAGE_CACHE.get_or_compute(
+        ("blurred", alpha_key, shadow_scale, shadow_blur, blur_strategy),
+        lambda: blur_layer(scaled_layer(alpha, alpha_key, shadow_scale), shadow_blur, blur_strategy, strip_rows)
+    )
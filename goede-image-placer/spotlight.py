@@ -1,8 +1,31 @@
 import torch
-from PIL import Image, ImageFilter, ImageOps
+from PIL import Image, ImageOps
 import numpy as np
 import math
 
+try:
+    from .image_utils import image_batch_to_rgba, image_to_numpy, alpha_image, pil_batch_to_tensor, uint8_batch_to_tensor, align_images
+    from .blur import BLUR_STRATEGIES
+    from .shadow_layer import blurred_layer, placed_layer, draft_alpha, upsample_layer, QUALITIES, DRAFT_FACTOR, LIGHT_POSITIONS
+    from .stage_cache import content_hash
+    from .memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    from . import torch_backend
+    from . import compositing
+    from . import tiling
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_batch_to_rgba, image_to_numpy, alpha_image, pil_batch_to_tensor, uint8_batch_to_tensor, align_images
+    from blur import BLUR_STRATEGIES
+    from shadow_layer import blurred_layer, placed_layer, draft_alpha, upsample_layer, QUALITIES, DRAFT_FACTOR, LIGHT_POSITIONS
+    from stage_cache import content_hash
+    from memory_guard import MemoryLimit, OUTPUT_DTYPES, OVERSIZE_POLICIES
+    import torch_backend
+    import compositing
+    import tiling
+    import profiling
+    import parallel
+
 class Spotlight:
     @classmethod
     def INPUT_TYPES(s):
@@ -34,6 +57,32 @@ class Spotlight:
                     "default": "#000000"
                 }),
             },
+            "optional": {
+                "blur_strategy": (BLUR_STRATEGIES, {
+                    "default": "auto"
+                }),
+                "backend": (torch_backend.BACKENDS, {
+                    "default": "auto"
+                }),
+                "output_dtype": (OUTPUT_DTYPES, {
+                    "default": "float32"
+                }),
+                "max_megapixels": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 10000.0,
+                    "step": 1.0
+                }),
+                "oversize": (OVERSIZE_POLICIES, {
+                    "default": "downscale"
+                }),
+                "quality": (QUALITIES, {
+                    "default": "full"
+                }),
+                "tiled": (tiling.TILING_MODES, {
+                    "default": "auto"
+                }),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -41,37 +90,41 @@ class Spotlight:
 
     CATEGORY = "Goede"
 
-    def apply_spotlight(self, image, light_from, shadow_length, shadow_blur, shadow_color):
-        # Convert tensor to PIL image
-        image_pil = Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+    @profiling.profiled("Spotlight")
+    def apply_spotlight(self, image, light_from, shadow_length, shadow_blur, shadow_color, blur_strategy="auto", backend="auto",
+                        output_dtype="float32", max_megapixels=0.0, oversize="downscale", quality="full", tiled="auto"):
+        shadow_scale = shadow_length / 5.0
+        limit = MemoryLimit(max_megapixels, oversize, output_dtype)
+        offset_x, offset_y = self._offset(light_from, shadow_length)
 
-        # Ensure image is RGBA
-        if image_pil.mode != 'RGBA':
-            image_pil = image_pil.convert('RGBA')
+        if torch_backend.resolve_backend(backend, image) == "torch":
+            # Stays on the device of the input
+            composites = [
+                self._apply_spotlight_torch(planes, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy, limit, quality)
+                for planes in torch_backend.image_planes(image)
+            ]
+            return (torch_backend.planes_to_image(torch_backend.stack_planes(composites)).to(limit.dtype),)
 
-        # Extract alpha channel to create shadow
-        alpha = image_pil.getchannel('A')
-        shadow = Image.new('RGBA', image_pil.size, color=shadow_color)
-        shadow.putalpha(alpha)
+        # [B,H,W,C] (unbatched images get a batch axis)
+        image = image_to_numpy(image)
+        height, width = image.shape[1:3]
+        canvas_size = self._canvas_size(width, height, offset_x, offset_y, shadow_scale)
+        use_tiles = tiling.use_tiles(tiled, canvas_size)
+        limit.check_peak(canvas_size, len(image), use_tiles)
+        if use_tiles:
+            return (self.render_tiled(image, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy, limit, quality),)
 
-        shadow_scale = shadow_length / 5.0
+        # Convert tensor to RGBA uint8 arrays (one per batch item)
+        composite_images = parallel.map_items(
+            lambda image_np: self._apply_spotlight_single(image_np, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy, limit, quality),
+            image_batch_to_rgba(image)
+        )
 
-        # Schatten ggf. skalieren (um Mittelpunkt)
-        if shadow_scale != 1.0:
-            cx, cy = image_pil.width // 2, image_pil.height // 2
-            new_w = int(shadow.width * shadow_scale)
-            new_h = int(shadow.height * shadow_scale)
-            shadow = shadow.resize((new_w, new_h), Image.LANCZOS)
-            scale_offset_x = cx - new_w // 2
-            scale_offset_y = cy - new_h // 2
-        else:
-            scale_offset_x = 0
-            scale_offset_y = 0
-
-        # Schatten weichzeichnen
-        if shadow_blur > 0:
-            shadow = shadow.filter(ImageFilter.GaussianBlur(shadow_blur))
+        # Convert the composite images back to a tensor
+        composite_tensor = uint8_batch_to_tensor(composite_images, limit.dtype)
+        return (composite_tensor,)
 
+    def _offset(self, light_from, shadow_length):
         # Convert light_from (1-12) to an angle in degrees
         light_angle_map = {
             1: 30, 2: 60, 3: 90, 4: 120, 5: 150, 6: 180,
@@ -90,8 +143,88 @@ class Spotlight:
         # The shadow distance is controlled by the shadow_length
         shadow_distance = (shadow_length - 5) * 20
 
-        offset_x = int(round(dx_shadow * shadow_distance))
-        offset_y = int(round(dy_shadow * shadow_distance))
+        return int(round(dx_shadow * shadow_distance)), int(round(dy_shadow * shadow_distance))
+
+    def render_tiled(self, image, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy="auto", limit=None, quality="full"):
+        # Same output tensor as the PIL path, the items rendered strip by
+        # strip straight into it (see tiling)
+        limit = limit or MemoryLimit()
+        items = image_to_numpy(image)
+
+        def layout(item):
+            height, width = item.shape[:2]
+            alpha = tiling.alpha_channel(item)
+            scale, blur = limit.fit_shadow(
+                lambda scale: self._canvas_size(width, height, offset_x, offset_y, scale), shadow_scale, shadow_blur
+            )
+            shadow_layer = self._shadow_layer(alpha, scale, blur, blur_strategy, quality, tiling.STRIP_ROWS)
+            return (shadow_layer,) + self._placement(width, height, shadow_layer, offset_x, offset_y)
+        layouts = parallel.map_items(layout, items)
+
+        out = tiling.allocate([size for _, _, _, size in layouts], 4, limit.dtype)
+        for item, item_out, (shadow_layer, shadow_position, (image_x, image_y), (width, height)) in zip(items, out, layouts):
+            shadow = placed_layer(shadow_layer, shadow_color, *shadow_position)
+            tiling.render_strips(
+                item_out[:height, :width],
+                lambda y0, y1: [shadow, tiling.subject_layer(item, image_x, image_y, y0, y1)]
+            )
+        return out
+
+    def _canvas_size(self, width, height, offset_x, offset_y, shadow_scale):
+        # Output canvas of one item, known before any shadow stage runs
+        new_w = int(width * shadow_scale)
+        new_h = int(height * shadow_scale)
+        total_offset_x = width // 2 - new_w // 2 + offset_x
+        total_offset_y = height // 2 - new_h // 2 + offset_y
+        return (max(width, total_offset_x + new_w) - min(0, total_offset_x),
+                max(height, total_offset_y + new_h) - min(0, total_offset_y))
+
+    def _apply_spotlight_single(self, image_np, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy, limit, quality="full"):
+        # image_np is an RGBA uint8 array. Extract alpha channel to create shadow. The shadow has a single
+        # color, so only its alpha channel is scaled and blurred, and only
+        # within the bounding box of the silhouette (see shadow_layer). The
+        # stages are cached, moving light_from reuses them.
+        alpha = alpha_image(image_np)
+
+        # Größe der Ausgabe prüfen, bevor etwas angelegt wird
+        shadow_scale, shadow_blur = limit.fit_shadow(
+            lambda scale: self._canvas_size(alpha.width, alpha.height, offset_x, offset_y, scale), shadow_scale, shadow_blur
+        )
+
+        # Schatten ggf. skalieren (um Mittelpunkt) und weichzeichnen
+        shadow_layer = self._shadow_layer(alpha, shadow_scale, shadow_blur, blur_strategy, quality)
+        return self._compose(image_np, shadow_layer, shadow_color, offset_x, offset_y)[0]
+
+    def _shadow_layer(self, alpha, shadow_scale, shadow_blur, blur_strategy, quality="full", strip_rows=0):
+        # The scaled and blurred shadow, independent of light_from
+        if quality == "draft":
+            # Same stages on the reduced alpha, upsampled to the full size layer
+            reduced, draft_key = draft_alpha(alpha, content_hash(alpha))
+            return upsample_layer(
+                blurred_layer(reduced, draft_key, shadow_scale, shadow_blur / DRAFT_FACTOR, blur_strategy, strip_rows),
+                int(alpha.width * shadow_scale), int(alpha.height * shadow_scale)
+            )
+        return blurred_layer(alpha, content_hash(alpha), shadow_scale, shadow_blur, blur_strategy, strip_rows)
+
+    def _compose(self, image, shadow_layer, shadow_color, offset_x, offset_y):
+        # Places the shadow layer at the offset behind the image (an RGBA
+        # uint8 array). Returns the composite (an RGBA uint8 array) and the
+        # position of the image in it.
+        height, width = image.shape[:2]
+        shadow_position, image_position, size = self._placement(width, height, shadow_layer, offset_x, offset_y)
+        # Schatten und Originalbild (immer mittig) in einem Durchgang
+        composite = compositing.composite([
+            placed_layer(shadow_layer, shadow_color, *shadow_position),
+            compositing.image_layer(image, *image_position),
+        ], size)
+        return composite, image_position
+
+    def _placement(self, width, height, shadow_layer, offset_x, offset_y):
+        # Positions of the shadow layer and of the width x height image on the
+        # output canvas, and the size of the canvas
+        # Die Skalierung erfolgt um den Mittelpunkt (bei 1.0 kein Versatz)
+        scale_offset_x = width // 2 - shadow_layer.width // 2
+        scale_offset_y = height // 2 - shadow_layer.height // 2
 
         # Gesamt-Offset: Skalierung + Richtung
         total_offset_x = scale_offset_x + offset_x
@@ -100,31 +233,115 @@ class Spotlight:
         # Neue Bildgröße berechnen, damit alles reinpasst
         min_x = min(0, total_offset_x)
         min_y = min(0, total_offset_y)
-        max_x = max(image_pil.width, total_offset_x + shadow.width)
-        max_y = max(image_pil.height, total_offset_y + shadow.height)
+        max_x = max(width, total_offset_x + shadow_layer.width)
+        max_y = max(height, total_offset_y + shadow_layer.height)
         composite_width = max_x - min_x
         composite_height = max_y - min_y
 
-        composite_image = Image.new("RGBA", (composite_width, composite_height), (0, 0, 0, 0))
-
-        # Schatten einfügen
         shadow_x = total_offset_x - min_x
         shadow_y = total_offset_y - min_y
-        composite_image.paste(shadow, (shadow_x, shadow_y), shadow)
-
-        # Originalbild einfügen (immer mittig)
         image_x = -min_x
         image_y = -min_y
-        composite_image.paste(image_pil, (image_x, image_y), image_pil)
+        return (shadow_x, shadow_y), (image_x, image_y), (composite_width, composite_height)
 
-        # Convert the composite image back to a tensor
-        composite_tensor = torch.from_numpy(np.array(composite_image).astype(np.float32) / 255.0).unsqueeze(0)
-        return (composite_tensor,)
+    def _apply_spotlight_torch(self, planes, shadow_scale, offset_x, offset_y, shadow_blur, shadow_color, blur_strategy, limit, quality="full"):
+        # Same as _apply_spotlight_single on [4,H,W] planes, with torch_backend
+        alpha = planes[3]
+        height, width = alpha.shape
+        shadow_scale, shadow_blur = limit.fit_shadow(
+            lambda scale: self._canvas_size(width, height, offset_x, offset_y, scale), shadow_scale, shadow_blur
+        )
+
+        # Draft: the stages run at 1/DRAFT_FACTOR of the size
+        factor = DRAFT_FACTOR if quality == "draft" else 1
+        shadow_alpha = alpha
+        new_w = int(width * shadow_scale)
+        new_h = int(height * shadow_scale)
+        if shadow_scale != 1.0 or factor > 1:
+            shadow_alpha = torch_backend.resize(shadow_alpha, (max(1, new_w // factor), max(1, new_h // factor)))
+        scale_offset_x = width // 2 - new_w // 2
+        scale_offset_y = height // 2 - new_h // 2
+        shadow_alpha = torch_backend.blur(shadow_alpha, shadow_blur / factor, blur_strategy)
+        if factor > 1:
+            shadow_alpha = torch_backend.resize(shadow_alpha, (new_w, new_h), "bilinear")
+        shadow_height, shadow_width = shadow_alpha.shape
+
+        total_offset_x = scale_offset_x + offset_x
+        total_offset_y = scale_offset_y + offset_y
+        min_x = min(0, total_offset_x)
+        min_y = min(0, total_offset_y)
+        max_x = max(width, total_offset_x + shadow_width)
+        max_y = max(height, total_offset_y + shadow_height)
+        color = torch_backend.color_planes(shadow_color, planes)
+        return compositing.composite_planes([
+            compositing.color_plane_layer(shadow_alpha, color, total_offset_x - min_x, total_offset_y - min_y),
+            compositing.plane_layer(planes, -min_x, -min_y),
+        ], (max_x - min_x, max_y - min_y), like=planes)
+
+class SpotlightSweep(Spotlight):
+    # Renders the image once for every light_from (1-12): a batch of 12
+    # items per input item, in the order of LIGHT_POSITIONS. The scaled and
+    # blurred shadow does not depend on light_from, it is computed once; only
+    # the placement and the composite run per position, in parallel. All
+    # items share one canvas with the subject at the same position, so the
+    # batch can be played as an animation.
+    @classmethod
+    def INPUT_TYPES(s):
+        input_types = super().INPUT_TYPES()
+        required = dict(input_types["required"])
+        del required["light_from"]
+        optional = dict(input_types["optional"])
+        # The sweep runs on PIL, untiled
+        del optional["backend"]
+        del optional["tiled"]
+        return {"required": required, "optional": optional}
+
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "sweep"
+
+    CATEGORY = "Goede"
+
+    @profiling.profiled("SpotlightSweep")
+    def sweep(self, image, shadow_length, shadow_blur, shadow_color, blur_strategy="auto",
+              output_dtype="float32", max_megapixels=0.0, oversize="downscale", quality="full"):
+        limit = MemoryLimit(max_megapixels, oversize, output_dtype)
+        offsets = [self._offset(light_from, shadow_length) for light_from in LIGHT_POSITIONS]
+        image = image_to_numpy(image)
+        height, width = image.shape[1:3]
+        limit.check_peak(self._sweep_canvas_size(width, height, offsets, shadow_length / 5.0), len(image) * len(offsets))
+        composite_images = []
+        for image_np in image_batch_to_rgba(image):
+            composite_images.extend(self._sweep_single(
+                image_np, shadow_length / 5.0, offsets, shadow_blur, shadow_color, blur_strategy, limit, quality
+            ))
+        return (pil_batch_to_tensor(composite_images, limit.dtype),)
+
+    def _sweep_canvas_size(self, width, height, offsets, shadow_scale):
+        # Common canvas of the sweep items of one input item
+        new_w = int(width * shadow_scale)
+        new_h = int(height * shadow_scale)
+        xs = [width // 2 - new_w // 2 + offset_x for offset_x, _ in offsets]
+        ys = [height // 2 - new_h // 2 + offset_y for _, offset_y in offsets]
+        return (max(width, max(xs) + new_w) - min(0, min(xs)),
+                max(height, max(ys) + new_h) - min(0, min(ys)))
+
+    def _sweep_single(self, image_np, shadow_scale, offsets, shadow_blur, shadow_color, blur_strategy, limit, quality="full"):
+        alpha = alpha_image(image_np)
+        shadow_scale, shadow_blur = limit.fit_shadow(
+            lambda scale: self._sweep_canvas_size(alpha.width, alpha.height, offsets, scale), shadow_scale, shadow_blur
+        )
+        shadow_layer = self._shadow_layer(alpha, shadow_scale, shadow_blur, blur_strategy, quality)
+        placed = parallel.map_items(
+            lambda offset: self._compose(image_np, shadow_layer, shadow_color, *offset), offsets
+        )
+        return align_images([Image.fromarray(composite) for composite, _ in placed], [position for _, position in placed])
 
 NODE_CLASS_MAPPINGS = {
-    "Spotlight": Spotlight
+    "Spotlight": Spotlight,
+    "SpotlightSweep": SpotlightSweep
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "Spotlight": "Spotlight"
+    "Spotlight": "Spotlight",
+    "SpotlightSweep": "Spotlight Sweep"
 }
@@ -0,0 +1,114 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Bounded LRU cache for intermediate shadow stages (scaled, blurred and
+# transformed silhouettes). Keys start with the stage name and a content hash
+# of the input alpha, followed by every parameter the stage depends on, so
+# moving a slider that only affects later stages (offset, angle, color)
+# reuses the earlier results. Entries are evicted by memory use.
+#
+# GOEDE_STAGE_CACHE_MB sets the budget (default 512), 0 disables the cache.
+
+
+def _nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        return value.size[0] * value.size[1] * len(value.getbands())
+    return 64
+
+
+def content_hash(image):
+    # PIL image or numpy array
+    if isinstance(image, np.ndarray):
+        data = np.ascontiguousarray(image)
+        header = f"{data.shape}{data.dtype}"
+        payload = data.data
+    else:
+        header = f"{image.mode}{image.size}"
+        payload = image.tobytes()
+    h = hashlib.blake2b(header.encode(), digest_size=16)
+    h.update(payload)
+    return h.hexdigest()
+
+
+class StageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Hit/miss counts per stage name (the first key element)
+        self.stages = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            counts = self.stages.setdefault(key[0], {"hits": 0, "misses": 0})
+            if entry is None:
+                self.misses += 1
+                counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            counts["hits"] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        if self.max_bytes <= 0:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "stages": {stage: dict(counts) for stage, counts in self.stages.items()},
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.stages = {}
+
+
+STAGE_CACHE = StageCache(int(float(os.environ.get("GOEDE_STAGE_CACHE_MB", 512)) * 1024 * 1024))
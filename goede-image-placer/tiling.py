@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    from .image_utils import image_to_uint8, uint8_to_pil, uint8_to_tensor
+    from . import compositing
+    from . import profiling
+    from . import parallel
+except ImportError:
+    from image_utils import image_to_uint8, uint8_to_pil, uint8_to_tensor
+    import compositing
+    import profiling
+    import parallel
+
+# Tiled execution for very large canvases (print output on 8K-12K
+# backgrounds). Untiled, an item holds its input as an 8 bit RGBA image, the
+# 8 bit RGBA composite and the float output at the same time. Tiled, the
+# canvas is rendered in strips of STRIP_ROWS rows, written straight into the
+# output tensor:
+#   * the subject rows of a strip are converted from the float input when the
+#     strip is composited, only the alpha channel is kept at full size (for
+#     the shadow stages),
+#   * the composite of a strip goes into a strip buffer and is converted into
+#     its rows of the output,
+#   * the shadow blur runs in strips with a halo of blur_margin() rows on each
+#     side (shadow_layer.blur_layer), so the strips join without seams.
+# Compositing is per pixel and the halo covers everything a blur can reach,
+# so every mode produces the same output, bit for bit.
+#
+#   auto  tiled when the output canvas of an item exceeds
+#         GOEDE_TILE_MEGAPIXELS (default 24)
+#   on    always tiled
+#   off   never tiled
+
+TILING_MODES = ["auto", "on", "off"]
+
+DEFAULT_TILE_MEGAPIXELS = 24.0
+
+# Rows of a strip, each strip is one task of the thread pool
+STRIP_ROWS = 512
+
+
+def tile_megapixels():
+    return float(os.environ.get("GOEDE_TILE_MEGAPIXELS", DEFAULT_TILE_MEGAPIXELS))
+
+
+def use_tiles(tiling, canvas_size):
+    if tiling not in TILING_MODES:
+        raise ValueError(f"Unknown tiling mode: {tiling}")
+    if tiling == "auto":
+        width, height = canvas_size
+        return width * height > tile_megapixels() * 1e6
+    return tiling == "on"
+
+
+def strips(height, rows=None):
+    # (y0, y1) of the strips covering height rows (STRIP_ROWS by default)
+    rows = rows or STRIP_ROWS
+    return [(y0, min(height, y0 + rows)) for y0 in range(0, height, rows)]
+
+
+def rgba_rows(image_np, y0, y1):
+    # Rows y0..y1 of one [H,W,C] float image as an 8 bit RGBA array, the same
+    # pixels as those rows of image_batch_to_pil(image, mode='RGBA')
+    return np.asarray(uint8_to_pil(image_to_uint8(image_np[y0:y1])[0], 'RGBA'))
+
+
+def to_uint8(image_np, rows=None):
+    # One [H,W,C] float image as 8 bit, converted in strips (the float
+    # scratch buffer of image_to_uint8 stays the size of a strip)
+    out = np.empty(image_np.shape, dtype=np.uint8)
+    for y0, y1 in strips(image_np.shape[0], rows):
+        out[y0:y1] = image_to_uint8(image_np[y0:y1])[0]
+    return out
+
+
+def alpha_channel(image_np, rows=None):
+    # 'L' image of the alpha of one [H,W,C] float image, converted in strips
+    height, width, channels = image_np.shape
+    alpha = np.empty((height, width), dtype=np.uint8)
+    with profiling.stage("to_pil") as s:
+        for y0, y1 in strips(height, rows):
+            if channels == 4:
+                alpha[y0:y1] = image_to_uint8(image_np[y0:y1, :, 3:])[0, ..., 0]
+            else:
+                alpha[y0:y1] = rgba_rows(image_np, y0, y1)[..., 3]
+        return s.output(Image.fromarray(alpha, 'L'))
+
+
+def subject_layer(image_np, x, y, y0, y1):
+    # The rows of the subject (one [H,W,C] float image placed at (x, y)) that
+    # fall into the canvas rows y0..y1, as a layer of compositing.composite();
+    # None if there are none
+    height = image_np.shape[0]
+    row0, row1 = max(0, y0 - y), min(height, y1 - y)
+    if row1 <= row0:
+        return None
+    return compositing.image_layer(rgba_rows(image_np, row0, row1), x, y + row0)
+
+
+def allocate(sizes, channels, dtype=torch.float32):
+    # Output tensor of a batch of items of the given (width, height); items
+    # smaller than the batch are padded with zeros at the bottom/right (like
+    # image_utils.pil_batch_to_tensor)
+    width = max(w for w, _ in sizes)
+    height = max(h for _, h in sizes)
+    same_size = all(size == (width, height) for size in sizes)
+    allocate = torch.empty if same_size else torch.zeros
+    return allocate((len(sizes), height, width, channels), dtype=dtype)
+
+
+def render_strips(out, strip_layers, rows=None):
+    # Composites an item into out, its [H,W,4] output, strip by strip.
+    # strip_layers(y0, y1) returns the layers (in canvas coordinates) that
+    # touch the canvas rows y0..y1. Same values as
+    # uint8_to_tensor(compositing.composite(layers, (W, H)), out).
+    height, width = out.shape[:2]
+
+    def render(strip):
+        y0, y1 = strip
+        layers = [layer._replace(y=layer.y - y0) for layer in strip_layers(y0, y1) if layer is not None]
+        buffer = compositing.composite(layers, (width, y1 - y0))
+        with profiling.stage("to_tensor") as s:
+            s.output(uint8_to_tensor(buffer, out[y0:y1]))
+
+    parallel.map_items(render, strips(height, rows))
+    return out
@@ -0,0 +1,298 @@
+import os
+import math
+import functools
+
+import torch
+import torch.nn.functional as F
+from PIL import ImageColor
+
+try:
+    from .blur import resolve_strategy, box_half_width, downsample_factor, downsample_radius
+    from . import profiling
+except ImportError:
+    from blur import resolve_strategy, box_half_width, downsample_factor, downsample_radius
+    import profiling
+
+# Rendering path written only in torch ops. The PIL path moves every image to
+# the host and renders in 8 bit; this one keeps the [B,H,W,C] tensors on the
+# device they come in on (RMBG and LBMSampler leave them on the GPU) and
+# renders in float32:
+#   * alpha extraction and RGBA planes ([C,H,W] per batch item),
+#   * affine transforms and resizes with the taps and weights of PIL's
+#     transform() and resize(),
+#   * separable blur convolutions (the strategies of blur.py),
+#   * compositing with compositing.composite_planes().
+# The results follow the PIL path up to float instead of 8 bit intermediates
+# (PIL rounds, or truncates in transform(), after every stage).
+#
+# Nodes take a `backend` input: "pil", "torch" or "auto". "auto" renders
+# with PIL, the output of existing graphs stays the same, unless the
+# GOEDE_BACKEND environment variable opts in: "torch", or "auto" for torch
+# with images on an accelerator and PIL with images on the CPU.
+# PerfectShadow has no torch path (its smear is a sequential sweep along the
+# shadow), it always renders with PIL.
+
+BACKENDS = ["auto", "pil", "torch"]
+
+
+def resolve_backend(backend, image):
+    if backend == "auto":
+        backend = os.environ.get("GOEDE_BACKEND", "pil")
+        if backend == "auto":
+            on_accelerator = isinstance(image, torch.Tensor) and image.device.type != "cpu"
+            return "torch" if on_accelerator else "pil"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    return backend
+
+
+@profiling.timed("to_planes")
+def image_planes(image):
+    # [B,H,W,C] (or [H,W,C]) image -> float32 [B,4,H,W] RGBA planes on the
+    # same device. Gray and RGB images get an opaque alpha channel.
+    image = torch.as_tensor(image).detach()
+    if image.dim() == 3:
+        image = image.unsqueeze(0)
+    planes = image.to(torch.float32).permute(0, 3, 1, 2).clamp(0, 1)
+    if planes.shape[1] == 1:
+        planes = planes.expand(-1, 3, -1, -1)
+    if planes.shape[1] == 3:
+        planes = torch.cat((planes, torch.ones_like(planes[:, :1])), dim=1)
+    return planes
+
+
+@profiling.timed("to_image")
+def planes_to_image(planes):
+    # [B,C,H,W] planes -> [B,H,W,C] image
+    return planes.permute(0, 2, 3, 1).contiguous()
+
+
+def stack_planes(items):
+    # Same as pil_batch_to_uint8: items with different canvas sizes are padded
+    # with zeros at the bottom/right
+    if len(items) == 1:
+        return items[0].unsqueeze(0)
+    height = max(item.shape[1] for item in items)
+    width = max(item.shape[2] for item in items)
+    batch = items[0].new_zeros((len(items), items[0].shape[0], height, width))
+    for out, item in zip(batch, items):
+        out[:, :item.shape[1], :item.shape[2]] = item
+    return batch
+
+
+def color_planes(color, like):
+    # "#rrggbb" (or any PIL color name) -> [3,1,1] on the device of `like`
+    rgb = ImageColor.getrgb(color)[:3]
+    return torch.tensor(rgb, dtype=torch.float32, device=like.device).view(3, 1, 1) / 255.0
+
+
+def transparent(alpha):
+    # Pixels the PIL path sees as alpha 0 (it truncates 255 * alpha to 8 bit)
+    return alpha * 255.0 < 1.0
+
+
+def _transform_taps(position, size, mode):
+    # Taps and weights of PIL's transform() at the sample positions along
+    # one axis: the taps are clamped to the border, bicubic is the cubic
+    # with a = -1 (Geometry.c)
+    position = position - 0.5
+    first = torch.floor(position)
+    d = position - first
+    if mode == "bilinear":
+        weights = (1 - d, d)
+        offsets = (0, 1)
+    elif mode == "bicubic":
+        d2 = d * d
+        d3 = d2 * d
+        weights = (-d + 2 * d2 - d3, 1 - 2 * d2 + d3, d + d2 - d3, d3 - d2)
+        offsets = (-1, 0, 1, 2)
+    else:
+        raise ValueError(f"Unknown resampling mode: {mode}")
+    first = first.long()
+    return [((first + offset).clamp(0, size - 1), weight) for offset, weight in zip(offsets, weights)]
+
+
+@profiling.timed("affine")
+def affine(alpha, size, data, mode="bicubic"):
+    # Like alpha.transform(size, Image.AFFINE, data): output pixel (X, Y)
+    # samples the input at (a x + b y + c, d x + e y + f) with x = X + 0.5 and
+    # y = Y + 0.5, zero where that is outside of the input; the taps next to
+    # the border repeat the border pixel. alpha is a [H,W] plane.
+    width, height = size
+    a, b, c, d, e, f = data
+    in_height, in_width = alpha.shape
+    x = torch.arange(width, dtype=torch.float32, device=alpha.device) + 0.5
+    y = torch.arange(height, dtype=torch.float32, device=alpha.device) + 0.5
+    if b == 0 and d == 0:
+        # Axis aligned: rows and columns are sampled one after the other
+        sample_x = a * x + c
+        sample_y = e * y + f
+        rows = sum(alpha.index_select(0, row) * weight[:, None] for row, weight in _transform_taps(sample_y, in_height, mode))
+        out = sum(rows.index_select(1, column) * weight for column, weight in _transform_taps(sample_x, in_width, mode))
+        inside = ((sample_y >= 0) & (sample_y < in_height))[:, None] & ((sample_x >= 0) & (sample_x < in_width))
+    else:
+        y, x = torch.meshgrid(y, x, indexing="ij")
+        sample_x = a * x + b * y + c
+        sample_y = d * x + e * y + f
+        flat = alpha.reshape(-1)
+        columns = _transform_taps(sample_x, in_width, mode)
+        out = sum(sum(flat[row * in_width + column] * column_weight for column, column_weight in columns) * row_weight
+                  for row, row_weight in _transform_taps(sample_y, in_height, mode))
+        inside = (sample_x >= 0) & (sample_x < in_width) & (sample_y >= 0) & (sample_y < in_height)
+    return torch.where(inside, out, torch.zeros_like(out)).clamp(0, 1)
+
+
+def _resample_filter(name):
+    # PIL's resampling filters (Resample.c): (support, filter)
+    if name == "box":
+        return 0.5, lambda x: ((x > -0.5) & (x <= 0.5)).double()
+    if name == "bilinear":
+        return 1.0, lambda x: (1.0 - x.abs()).clamp_min(0.0)
+    if name == "bicubic":
+        def bicubic(x, a=-0.5):
+            x = x.abs()
+            near = ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0
+            far = (((x - 5.0) * x + 8.0) * x - 4.0) * a
+            return torch.where(x < 1.0, near, torch.where(x < 2.0, far, torch.zeros_like(x)))
+        return 2.0, bicubic
+    if name == "lanczos":
+        return 3.0, lambda x: torch.where(x.abs() < 3.0, torch.sinc(x) * torch.sinc(x / 3.0), torch.zeros_like(x))
+    raise ValueError(f"Unknown resampling filter: {name}")
+
+
+# Ab hier lohnt sich die Matrix
+_GATHER_TAPS = 8
+
+
+@functools.lru_cache(maxsize=64)
+def _resample_taps(in_size, out_size, name):
+    # First input pixel and weights [out, taps] of every output pixel when
+    # resizing one axis like PIL's resize(), on the host
+    # (precompute_coeffs in Resample.c)
+    support, resample_filter = _resample_filter(name)
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support *= filter_scale
+    center = (torch.arange(out_size, dtype=torch.float64) + 0.5) * scale
+    first = torch.trunc(center - support + 0.5).clamp_min(0)
+    count = torch.trunc(center + support + 0.5).clamp_max(in_size) - first
+    taps = torch.arange(int(count.max()), dtype=torch.float64)
+    weights = resample_filter((first[:, None] + taps - center[:, None] + 0.5) / filter_scale)
+    weights = torch.where(taps < count[:, None], weights, torch.zeros_like(weights))
+    total = weights.sum(dim=1, keepdim=True)
+    weights = torch.where(total != 0, weights / total, weights)
+    return first.long(), weights.float()
+
+
+def _resample_axis(planes, size, dim, name):
+    # One axis (dim -1 or -2) of planes resized to size, clipped to 0..1.
+    # Few taps (upscales) are gathered, many (downscales) go through a
+    # dense [size, in] matrix
+    in_size = planes.shape[dim]
+    first, weights = _resample_taps(in_size, size, name)
+    first, weights = first.to(planes.device), weights.to(planes.device)
+    taps = weights.shape[1]
+    if taps > _GATHER_TAPS:
+        index = (first[:, None] + torch.arange(taps, device=planes.device)).clamp_max(in_size - 1)
+        matrix = torch.zeros((size, in_size), dtype=planes.dtype, device=planes.device)
+        matrix.scatter_add_(1, index, weights.to(planes.dtype))
+        out = planes @ matrix.T if dim == -1 else matrix @ planes
+        return out.clamp(0, 1)
+    # Ganze Zeilen sammeln, Spalten nur über die Transponierte
+    rows = planes if dim == -2 else planes.transpose(-1, -2).contiguous()
+    out = 0
+    for tap in range(taps):
+        index = (first + tap).clamp_max(in_size - 1)
+        out = out + rows.index_select(rows.dim() - 2, index) * weights[:, tap, None]
+    out = out if dim == -2 else out.transpose(-1, -2)
+    return out.clamp(0, 1)
+
+
+def _resample(planes, size, name):
+    # [..., H, W] planes resized to size = (width, height), rows then
+    # columns; each pass is clipped to 0..1 like PIL's 8 bit passes
+    width, height = size
+    in_height, in_width = planes.shape[-2:]
+    out = planes
+    if width != in_width:
+        out = _resample_axis(out, width, -1, name)
+    if height != in_height:
+        out = _resample_axis(out, height, -2, name)
+    return out
+
+
+@profiling.timed("resize")
+def resize(alpha, size, resample="lanczos"):
+    # Resize of a [H,W] plane to size = (width, height) with the weights of
+    # PIL's resize() and its filter `resample` ("lanczos", "bicubic",
+    # "bilinear" or "box")
+    return _resample(alpha, size, resample)
+
+
+@profiling.timed("resize")
+def resize_rgba(planes, size, resample="bicubic"):
+    # Resize [B,4,H,W] planes like PIL resizes RGBA images: with premultiplied
+    # alpha, so that transparent pixels do not bleed their color. The
+    # default filter is the one of Image.resize().
+    premultiplied = torch.cat((planes[:, :3] * planes[:, 3:], planes[:, 3:]), dim=1)
+    out = _resample(premultiplied, size, resample)
+    alpha = out[:, 3:]
+    rgb = torch.where(alpha > 0, out[:, :3] / alpha.clamp_min(1e-6), torch.zeros_like(out[:, :3]))
+    return torch.cat((rgb.clamp(0, 1), alpha), dim=1)
+
+
+def _box_pass(alpha, half_width, dim):
+    # One pass of PIL's BoxBlur along `dim` of a [H,W] plane: a box of width
+    # 2 * half_width + 1, the outermost taps cover the fraction, the border
+    # pixels are repeated. Running sums: the work per pixel does not depend
+    # on the width.
+    whole = int(math.floor(half_width))
+    size = alpha.shape[dim]
+    edge = whole + 1
+    padded = torch.cat((alpha.narrow(dim, 0, 1).repeat_interleave(edge, dim), alpha,
+                        alpha.narrow(dim, size - 1, 1).repeat_interleave(edge, dim)), dim)
+    sums = torch.cat((torch.zeros_like(alpha.narrow(dim, 0, 1)), padded.cumsum(dim)), dim)
+    inner = sums.narrow(dim, 2 * whole + 2, size) - sums.narrow(dim, 1, size)
+    outer = padded.narrow(dim, 0, size) + padded.narrow(dim, 2 * whole + 2, size)
+    return (inner + (half_width - whole) * outer) / (2 * half_width + 1)
+
+
+def _box_blur(alpha, half_width, passes):
+    # `passes` box passes along the rows, then along the columns
+    for dim in (1, 0):
+        for _ in range(passes):
+            alpha = _box_pass(alpha, half_width, dim)
+    return alpha
+
+
+def _gaussian_blur(alpha, radius):
+    # PIL's GaussianBlur: three box passes whose half width gives the
+    # variance radius^2 / 3 each (_gaussian_blur_radius in BoxBlur.c)
+    variance = radius * radius / 3
+    length = math.sqrt(12 * variance + 1)
+    whole = math.floor((length - 1) / 2)
+    fraction = (2 * whole + 1) * (whole * (whole + 1) - 3 * variance) / (6 * (variance - (whole + 1) * (whole + 1)))
+    return _box_blur(alpha, whole + fraction, 3)
+
+
+@profiling.timed("blur")
+def blur(alpha, radius, strategy="auto"):
+    # Same strategies as blur.blur_alpha, on a [H,W] plane
+    if radius <= 0:
+        return alpha
+    strategy = resolve_strategy(radius, strategy)
+    if strategy == "downsample" and downsample_factor(radius) == 1:
+        strategy = "exact"
+    if strategy == "exact":
+        return _gaussian_blur(alpha, radius)
+    if strategy == "box":
+        return _box_blur(alpha, box_half_width(radius), 2)
+    if strategy == "downsample":
+        factor = downsample_factor(radius)
+        height, width = alpha.shape
+        small = F.avg_pool2d(alpha[None, None], factor, ceil_mode=True)[0, 0]
+        small = _gaussian_blur(small, downsample_radius(radius, factor))
+        out = F.interpolate(small[None, None], scale_factor=factor, mode="bilinear",
+                            align_corners=False, recompute_scale_factor=False)
+        return out[0, 0, :height, :width]
+    raise ValueError(f"Unknown blur strategy: {strategy}")
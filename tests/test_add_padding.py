@@ -0,0 +1,36 @@
+import torch
+import sys
+sys.path.insert(0, './goede-image-placer')
+from add_padding import AddPadding
+
+def test_add_padding():
+    image = torch.rand(2, 30, 40, 3)
+
+    image_4_channel, image_3_channel, mask = AddPadding().add_padding(image, 5, 6, 7, 8)
+
+    assert image_4_channel.shape == (2, 44, 52, 4)
+    assert image_3_channel.shape == (2, 44, 52, 3)
+    assert mask.shape == (2, 44, 52)
+
+    # The image is placed unchanged and opaque, the border is transparent
+    assert torch.equal(image_4_channel[:, 6:36, 5:45, :3], image)
+    assert torch.all(image_4_channel[:, 6:36, 5:45, 3] == 1)
+    assert image_4_channel[:, :6].sum() == 0 and image_4_channel[:, :, 45:].sum() == 0
+
+    # The mask is 1 - alpha, the 3-channel output is a view
+    assert torch.equal(mask, 1 - image_4_channel[..., 3])
+    assert image_3_channel.data_ptr() == image_4_channel.data_ptr()
+
+def test_add_padding_keeps_alpha_and_dtype():
+    image = torch.rand(1, 10, 10, 4, dtype=torch.float16)
+
+    image_4_channel, _, mask = AddPadding().add_padding(image, 1, 0, 0, 2)
+
+    assert image_4_channel.dtype == torch.float16
+    assert image_4_channel.device == image.device
+    assert torch.equal(image_4_channel[0, :10, 1:], image[0])
+    assert torch.all(mask[0, 10:] == 1)
+
+if __name__ == "__main__":
+    test_add_padding()
+    test_add_padding_keeps_alpha_and_dtype()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from background_index import BackgroundIndex, INDEX_NAME, list_images, refresh_index, wait_for_refresh
+
+def test_index_is_incremental():
+    with tempfile.TemporaryDirectory() as image_dir:
+        Image.new('RGB', (300, 200), (200, 30, 30)).save(os.path.join(image_dir, "red.jpg"))
+        Image.new('RGB', (100, 400), (30, 30, 200)).save(os.path.join(image_dir, "blue.png"))
+        with open(os.path.join(image_dir, "notes.txt"), "w") as f:
+            f.write("not an image")
+        index = BackgroundIndex(image_dir)
+
+        # Reading does not create the index
+        assert index.entries() == [] and index.get("red.jpg") is None
+        assert not os.path.exists(os.path.join(image_dir, INDEX_NAME))
+
+        assert index.update() == {"added": 3, "updated": 0, "removed": 0, "unchanged": 0}
+        # The index file itself is not listed
+        assert INDEX_NAME not in list_images(image_dir)
+        assert [entry.name for entry in index.entries()] == ["blue.png", "red.jpg"]
+        red = index.get("red.jpg")
+        assert (red.width, red.height, red.mode) == (300, 200, "RGB")
+        assert index.thumbnail("red.jpg").size == (128, 85)
+        assert index.get("notes.txt").width is None
+
+        assert [entry.name for entry in index.find(orientation="portrait")] == ["blue.png"]
+        assert [entry.name for entry in index.find(min_width=200)] == ["red.jpg"]
+        assert [entry.name for entry in index.find(color="#c81e1e")] == ["red.jpg"]
+
+        # Only changed files are scanned again
+        Image.new('RGB', (50, 50), (0, 200, 0)).save(os.path.join(image_dir, "red.jpg"))
+        os.utime(os.path.join(image_dir, "red.jpg"), ns=(0, 10 ** 9))
+        os.remove(os.path.join(image_dir, "blue.png"))
+        os.utime(image_dir, ns=(0, 10 ** 9))
+        assert index.update() == {"added": 0, "updated": 1, "removed": 1, "unchanged": 1}
+        red = index.get("red.jpg")
+        assert (red.width, red.height) == (50, 50)
+        assert red.content_hash != index.get("notes.txt").content_hash
+        assert index.find(orientation="portrait") == []
+
+def test_refresh_in_background():
+    with tempfile.TemporaryDirectory() as image_dir:
+        Image.new('RGB', (300, 200)).save(os.path.join(image_dir, "a.jpg"))
+        thread = refresh_index(image_dir)
+        thread.join()
+        assert [entry.name for entry in BackgroundIndex(image_dir).entries()] == ["a.jpg"]
+        # Nothing to do until files are added or removed (the index file
+        # itself does not count)
+        assert refresh_index(image_dir) is None
+
+        Image.new('RGB', (300, 200)).save(os.path.join(image_dir, "b.jpg"))
+        os.utime(image_dir, ns=(0, 10 ** 9))
+        wait_for_refresh(image_dir)
+        assert [entry.name for entry in BackgroundIndex(image_dir).entries()] == ["a.jpg", "b.jpg"]
+        assert refresh_index(image_dir) is None
+
+if __name__ == "__main__":
+    test_index_is_incremental()
+    test_refresh_in_background()
@@ -0,0 +1,36 @@
+import sys
+sys.path.insert(0, './benchmarks')
+from bench_nodes import compare_results, build_cases, load_package
+
+def _result(node, wall, rss, status="ok"):
+    return {"node": node, "case": "default", "size": [512, 512], "batch": 1, "backend": None,
+            "status": status, "wall_s_median": wall, "peak_rss_mb": rss}
+
+def test_compare_flags_regressions():
+    baseline = {"results": [_result("DropShadow", 1.0, 500), _result("Spotlight", 1.0, 500)]}
+    current = {"results": [_result("DropShadow", 1.1, 640), _result("Spotlight", 1.3, 500), _result("AddPadding", 9.0, 900)]}
+
+    regressions = compare_results(baseline, current, 0.2)
+
+    # Only cases present in both runs count, within the threshold is fine
+    assert [(key[0], metric) for key, metric, _, _ in regressions] == [("DropShadow", "peak_rss_mb"), ("Spotlight", "wall_s_median")]
+
+def test_every_node_has_cases():
+    class Args:
+        nodes = None
+        sizes = ["512"]
+        batches = [1]
+        backend = None
+        repeat = 1
+        warm = False
+        max_megapixels = 1.0
+
+    node_names = load_package().NODE_CLASS_MAPPINGS.keys()
+    cases = build_cases(Args, node_names)
+    assert {case["node"] for case in cases} == set(node_names)
+    # Too large for the budget, the case is recorded but not run
+    assert any(case.get("status") == "skipped" for case in cases)
+
+if __name__ == "__main__":
+    test_compare_flags_regressions()
+    test_every_node_has_cases()
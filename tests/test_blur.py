@@ -0,0 +1,35 @@
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from blur import blur_alpha, choose_strategy
+
+def make_silhouettes(size):
+    square = np.zeros((size, size), dtype=np.uint8)
+    square[size // 4:3 * size // 4, size // 4:3 * size // 4] = 255
+    line = np.zeros((size, size), dtype=np.uint8)
+    line[:, size // 2:size // 2 + 2] = 255
+    ring = np.array(Image.open('tests/testring.png').getchannel('A').resize((size, size)))
+    return [Image.fromarray(a) for a in (square, line, ring)]
+
+def test_blur_error_bounds():
+    bounds = {"exact": 0, "box": 7, "downsample": 3}
+    for radius in (3, 20, 60, 200):
+        size = max(256, 8 * radius)
+        for alpha in make_silhouettes(size):
+            reference = np.array(blur_alpha(alpha, radius, "exact")).astype(int)
+            for strategy, bound in bounds.items():
+                blurred = blur_alpha(alpha, radius, strategy)
+                assert blurred.mode == 'L' and blurred.size == alpha.size
+                error = np.abs(np.array(blurred).astype(int) - reference).max()
+                assert error <= bound, f"{strategy} at radius {radius}: {error} > {bound}"
+
+def test_auto_strategy():
+    assert choose_strategy(10) == "exact"
+    assert choose_strategy(200) == "downsample"
+    alpha = make_silhouettes(64)[0]
+    assert blur_alpha(alpha, 0) is alpha
+
+if __name__ == "__main__":
+    test_blur_error_bounds()
+    test_auto_strategy()
@@ -0,0 +1,76 @@
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+import compositing
+
+def test_over_transparent():
+    # A semi-transparent layer keeps its alpha and color
+    alpha = np.full((4, 4), 128, dtype=np.uint8)
+    out = compositing.composite([compositing.color_layer(alpha, "#ff0000", 1, 1)], (6, 6))
+    assert (out[1:5, 1:5] == [255, 0, 0, 128]).all()
+    # Outside of the layer nothing is written, not even the color
+    assert out[0].sum() == 0 and out[:, 0].sum() == 0
+
+    # 50 % white over 50 % black: alpha 0.75, a third of the color is black
+    subject = np.full((4, 4, 4), [255, 255, 255, 128], dtype=np.uint8)
+    out = compositing.composite([
+        compositing.color_layer(alpha, (0, 0, 0), 0, 0),
+        compositing.image_layer(subject, 2, -2),
+    ], (6, 6))
+    assert (out[0:2, 2:4] == [170, 170, 170, 192]).all()
+    assert (out[2:4, 0:2] == [0, 0, 0, 128]).all()
+    assert (out[0:2, 4:6] == [255, 255, 255, 128]).all()
+    assert out[4:, 4:].sum() == 0
+
+def test_over_opaque_matches_pil_paste():
+    # Over an opaque backdrop, the same 8 bit blend as PIL's paste
+    rng = np.random.default_rng(0)
+    background = Image.fromarray(rng.integers(0, 256, (50, 60, 3), dtype=np.uint8)).convert("RGBA")
+    subject = Image.fromarray(rng.integers(0, 256, (40, 30, 4), dtype=np.uint8))
+    out = compositing.composite([compositing.image_layer(subject, 40, -10)], out=np.array(background))
+    background.paste(subject, (40, -10), subject)
+    expected = np.array(background)
+    assert (out[..., :3] == expected[..., :3]).all()
+    assert (out[..., 3] == 255).all()
+
+def test_bands():
+    # The result does not depend on the band height
+    rng = np.random.default_rng(1)
+    layers = [
+        compositing.color_layer(rng.integers(0, 256, (70, 50), dtype=np.uint8), "#203040", -5, 3),
+        compositing.image_layer(rng.integers(0, 256, (40, 60, 4), dtype=np.uint8), 10, 20),
+    ]
+    expected = compositing.composite(layers, (64, 80))
+    band_rows = compositing.BAND_ROWS
+    compositing.BAND_ROWS = 7
+    try:
+        assert (compositing.composite(layers, (64, 80)) == expected).all()
+    finally:
+        compositing.BAND_ROWS = band_rows
+
+def test_planes_match_arrays():
+    rng = np.random.default_rng(2)
+    alpha = rng.integers(0, 256, (30, 40), dtype=np.uint8)
+    subject = rng.integers(0, 256, (20, 25, 4), dtype=np.uint8)
+    expected = compositing.composite([
+        compositing.color_layer(alpha, (32, 48, 64), 3, -4),
+        compositing.image_layer(subject, 12, 10),
+    ], (45, 35))
+
+    subject_planes = torch.from_numpy(subject).permute(2, 0, 1).float() / 255
+    color = torch.tensor([32, 48, 64], dtype=torch.float32).view(3, 1, 1) / 255
+    planes = compositing.composite_planes([
+        compositing.color_plane_layer(torch.from_numpy(alpha).float() / 255, color, 3, -4),
+        compositing.plane_layer(subject_planes, 12, 10),
+    ], (45, 35), like=subject_planes)
+    result = planes.permute(1, 2, 0).numpy() * 255
+    assert planes.shape == (4, 35, 45)
+    assert np.abs(result - expected).max() <= 0.5 + 1e-3
+
+if __name__ == "__main__":
+    test_over_transparent()
+    test_over_opaque_matches_pil_paste()
+    test_bands()
+    test_planes_match_arrays()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import numpy as np
+import torch
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+import image_selector
+from image_selector import ImageSelector, DECODED_CACHE
+from disk_cache import DiskCache
+
+def test_lru_eviction():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DiskCache(cache_dir, 2500)
+        for i in range(3):
+            cache.put(("image", i), np.full((10, 100), i, dtype=np.uint8))
+            os.utime(cache.path(("image", i)), ns=(0, (i + 1) * 10 ** 9))
+        # Only two entries fit, the oldest one is gone after the next write
+        cache.evict()
+        assert cache.get(("image", 0)) is None
+        first = cache.get(("image", 1))
+        assert isinstance(first, np.memmap) and (first == 1).all()
+        # The hit makes it the most recently used entry
+        cache.put(("image", 3), np.zeros((10, 100), dtype=np.uint8))
+        assert cache.get(("image", 2)) is None
+        assert cache.get(("image", 1)) is not None
+        assert cache.size() <= 2500
+        # Too large for the cap, not stored
+        cache.put(("image", 4), np.zeros((100, 100), dtype=np.uint8))
+        assert cache.get(("image", 4)) is None
+
+def test_selector_loads_from_disk():
+    with tempfile.TemporaryDirectory() as image_dir, tempfile.TemporaryDirectory() as cache_dir:
+        image_path = os.path.join(image_dir, "bg.jpg")
+        rng = np.random.default_rng(0)
+        Image.fromarray(rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)).save(image_path)
+        original_dir, original_cache = image_selector.IMAGE_DIR, image_selector.DISK_CACHE
+        image_selector.IMAGE_DIR = image_dir
+        image_selector.DISK_CACHE = DiskCache(cache_dir, 1 << 20)
+        selector = ImageSelector()
+        decode = selector._decode
+        try:
+            DECODED_CACHE.clear()
+            decoded, = selector.select_image("bg.jpg")
+            assert len(image_selector.DISK_CACHE.entries()) == 1
+
+            # A new run: no decode, the same pixels
+            DECODED_CACHE.clear()
+            selector._decode = None
+            loaded, = selector.select_image("bg.jpg")
+            assert torch.equal(loaded, decoded)
+
+            # A changed file is decoded again
+            Image.new('RGB', (80, 60), (255, 0, 0)).save(image_path)
+            os.utime(image_path, ns=(0, 10 ** 9))
+            selector._decode = decode
+            changed, = selector.select_image("bg.jpg")
+            assert changed[0, 0, 0, 0] > 0.9
+            assert len(image_selector.DISK_CACHE.entries()) == 2
+        finally:
+            image_selector.IMAGE_DIR, image_selector.DISK_CACHE = original_dir, original_cache
+            DECODED_CACHE.clear()
+
+def test_directory_created_on_first_write():
+    with tempfile.TemporaryDirectory() as base_dir:
+        cache_dir = os.path.join(base_dir, "cache")
+        os.environ["GOEDE_DECODE_CACHE_DIR"] = cache_dir
+        try:
+            cache = DiskCache.from_env()
+        finally:
+            del os.environ["GOEDE_DECODE_CACHE_DIR"]
+        assert not os.path.exists(cache_dir)
+        assert cache.get(("image", 0)) is None and cache.entries() == []
+        cache.put(("image", 0), np.zeros((4, 4), dtype=np.uint8))
+        assert cache.get(("image", 0)) is not None
+
+        # A directory that cannot be created turns the cache off
+        blocked = os.path.join(base_dir, "file")
+        open(blocked, "w").close()
+        cache = DiskCache(os.path.join(blocked, "cache"), 1 << 20)
+        cache.put(("image", 0), np.zeros((4, 4), dtype=np.uint8))
+        assert not cache.enabled
+        assert cache.get(("image", 0)) is None
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_directory_created_on_first_write()
+    test_selector_loads_from_disk()
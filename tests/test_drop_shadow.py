@@ -3,7 +3,8 @@ import numpy as np
 from PIL import Image
 import sys
 sys.path.insert(0, './goede-image-placer')
-from drop_shadow import DropShadow
+from drop_shadow import DropShadow, SHADOW_ANGLES, ray_direction, contour_rays, contour_points
+from stage_cache import STAGE_CACHE
 
 def test_drop_shadow():
     # Create a dummy image
@@ -69,6 +70,88 @@ def test_drop_shadow_angles():
             assert diff < 40, f"Horizontalspiegelung bei Winkel {angle} nicht erkannt (diff={diff})"
     print("Alle Winkel- und Spiegelungstests bestanden!")
 
+def test_drop_shadow_batch():
+    # Two different cutouts in one batch, the shadow lands differently per item
+    first = Image.new('RGBA', (100, 100), (0, 0, 0, 0))
+    first.paste((255, 0, 0, 255), (20, 20, 80, 80))
+    second = Image.new('RGBA', (100, 100), (0, 0, 0, 0))
+    second.paste((0, 255, 0, 255), (40, 10, 60, 90))
+    batch = torch.from_numpy(np.stack([np.array(first), np.array(second)]).astype(np.float32) / 255.0)
+
+    drop_shadow_node = DropShadow()
+    shadow_tensor, = drop_shadow_node.add_shadow(batch, 6, 30, 5, 1.2, "#000000")
+    assert shadow_tensor.shape[0] == 2
+
+    # Every item matches a single-image run (padded to the common canvas)
+    for i in range(2):
+        single, = drop_shadow_node.add_shadow(batch[i:i + 1], 6, 30, 5, 1.2, "#000000")
+        h, w = single.shape[1:3]
+        assert torch.equal(shadow_tensor[i, :h, :w], single[0])
+        assert shadow_tensor[i, h:].abs().sum() == 0
+        assert shadow_tensor[i, :, w:].abs().sum() == 0
+
+def _contour_point_loop(alpha_np, dx, dy):
+    # Pixel by pixel search along the ray (the original implementation)
+    h, w = alpha_np.shape
+    cx, cy = w // 2, h // 2
+    for r in range(1, int(1.5 * max(cx, cy))):
+        x = int(round(cx + r * dx))
+        y = int(round(cy + r * dy))
+        if not (0 <= x < w and 0 <= y < h):
+            break
+        if alpha_np[y, x] == 0:
+            return int(round(cx + (r - 1) * dx)), int(round(cy + (r - 1) * dy))
+    return cx, cy
+
+def test_contour_points_all_angles():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        h, w = rng.integers(1, 60, 2)
+        alpha_np = ((rng.random((h, w)) > 0.3) * 255).astype(np.uint8)
+        xs, ys, _ = contour_rays(w, h)
+        points = contour_points(alpha_np[ys, xs] == 0, w, h)
+        for i, angle in enumerate(SHADOW_ANGLES):
+            assert tuple(points[i]) == _contour_point_loop(alpha_np, *ray_direction(angle))
+
+def test_drop_shadow_contour_cached():
+    image = Image.new('RGBA', (120, 120), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (30, 30, 90, 90))
+    image_tensor = torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+
+    # One search per alpha mask covers every angle
+    STAGE_CACHE.clear()
+    for angle in SHADOW_ANGLES:
+        DropShadow().add_shadow(image_tensor, angle, 20, 10, 1.5, "#000000")
+    assert STAGE_CACHE.stats()["stages"]["contour"] == {"hits": 12, "misses": 1}
+
+def test_drop_shadow_unbatched():
+    # An [H,W,C] image renders like a batch of one
+    image = torch.rand(60, 80, 4)
+    for tiled in ["off", "on"]:
+        expected, = DropShadow().add_shadow(image[None], 4, 20, 5, 1.2, "#000000", backend="pil", tiled=tiled)
+        result, = DropShadow().add_shadow(image, 4, 20, 5, 1.2, "#000000", backend="pil", tiled=tiled)
+        assert torch.equal(result, expected)
+
+def test_drop_shadow_tiny_images():
+    # 1 px wide/high images have no ray to search, the edge point is the center
+    xs, ys, lengths = contour_rays(1, 1)
+    assert xs.shape == (len(SHADOW_ANGLES), 0) and lengths.tolist() == [0] * len(SHADOW_ANGLES)
+    assert contour_points(np.zeros(xs.shape, dtype=bool), 1, 1).tolist() == [[0, 0]] * len(SHADOW_ANGLES)
+    for height, width in [(1, 1), (1, 7), (7, 1), (6, 5)]:
+        image = torch.rand(1, height, width, 4)
+        expected, = DropShadow().add_shadow(image, 6, 5, 2, 1.5, "#000000", backend="pil")
+        assert expected.shape[1] >= height and expected.shape[2] >= width
+        # Every path renders the same canvas
+        for options in [{"backend": "torch"}, {"tiled": "on"}, {"quality": "draft"}]:
+            STAGE_CACHE.clear()
+            result, = DropShadow().add_shadow(image, 6, 5, 2, 1.5, "#000000", **options)
+            assert result.shape == expected.shape
+
 if __name__ == "__main__":
     test_drop_shadow()
     test_drop_shadow_angles()
+    test_drop_shadow_batch()
+    test_contour_points_all_angles()
+    test_drop_shadow_contour_cached()
+    test_drop_shadow_unbatched()
+    test_drop_shadow_tiny_images()
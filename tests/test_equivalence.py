@@ -0,0 +1,91 @@
+import sys
+import torch
+sys.path.insert(0, './benchmarks')
+from equivalence import compare_outputs, run_comparisons, parameter_grid, load_package, approximations
+from bench_nodes import synthetic_cutout, synthetic_background
+
+def _inputs():
+    return [("cutout", synthetic_cutout(1, 48, 40))]
+
+def test_compare_outputs():
+    reference = torch.zeros(1, 8, 8, 4)
+    reference[0, 2:6, 2:6] = 1.0
+    assert compare_outputs(reference, reference.clone())["max"] == [0.0] * 4
+
+    result = reference.clone()
+    result[0, 2, 2, 3] = 0.5
+    errors = compare_outputs(reference, result)
+    assert errors["max"][3] == errors["alpha_edge_max"] == 127.5
+    # Color counts premultiplied with alpha
+    assert errors["max"][0] == 127.5
+
+    # Color of transparent pixels is not visible, the inside is no edge
+    result = reference.clone()
+    result[0, 0, 0, :3] = 1.0
+    result[0, 4, 4, 3] = 0.9
+    errors = compare_outputs(reference, result)
+    assert abs(errors["max"][0] - 25.5) < 1e-3
+    assert errors["alpha_edge_max"] == 0.0
+
+    assert "shape" in compare_outputs(reference, torch.zeros(1, 8, 9, 4))
+
+def test_grid():
+    spotlight = load_package().NODE_CLASS_MAPPINGS["Spotlight"]
+    quick = parameter_grid(spotlight)
+    # Defaults first, then one parameter at a time; the fast path options
+    # are no parameters
+    assert quick[0] == {"light_from": 12, "shadow_length": 5, "shadow_blur": 20, "shadow_color": "#000000", "blur_strategy": "auto"}
+    assert {params["light_from"] for params in quick} == set(range(1, 13))
+    assert all(sum(params[name] != quick[0][name] for name in params) == 1 for params in quick[1:])
+    assert len(parameter_grid(spotlight, "full")) == 12 * 3 * 3 * 2 * 4
+
+def test_tiled_path_matches_pil():
+    results = run_comparisons(["Spotlight", "ImageComposite"], ["pil", "tiled"], inputs=_inputs())
+    pil = [result for result in results if result["path"] == "pil"]
+    tiled = [result for result in results if result["path"] == "tiled"]
+    assert pil and len(pil) == len(tiled)
+    # Same pixels as the untiled path, whatever they are against the reference
+    for expected, result in zip(pil, tiled):
+        assert result["params"] == expected["params"]
+        assert result["max"] == expected["max"] and result["status"] == expected["status"]
+        assert result["path_s"] > 0
+
+def test_opaque_composite_matches_reference():
+    # Over an opaque background "over" and PIL's paste are the same blend
+    inputs = [("opaque_rgb", synthetic_background(1, 48, 40))]
+    results = run_comparisons(["ImageComposite"], ["pil"], inputs=inputs)
+    assert results and all(result["status"] == "ok" for result in results)
+    assert all(max(result["max"]) == 0 for result in results)
+
+def test_tolerance_fails():
+    results = run_comparisons(["DropShadow"], ["torch"], inputs=_inputs(), tolerances={"torch": (0.0, 0.0)})
+    assert any(result["status"] == "fail" for result in results)
+    # Nodes without the options of a path are left out
+    assert run_comparisons(["PerfectShadow"], ["tiled"], inputs=_inputs()) == []
+
+def test_quick_grid_passes():
+    # The paths that render the reference pixels pass the quick grid on the
+    # whole corpus, inside the bounds of the approximations they select
+    results = run_comparisons(paths=["pil", "tiled", "float16"])
+    assert {result["path"] for result in results} == {"pil", "tiled", "float16"}
+    failed = [result for result in results if result["status"] != "ok"]
+    assert not failed, failed[:3]
+
+def test_approximations():
+    package = load_package()
+    assert approximations(package, "DropShadow", {"shadow_blur": 20, "blur_strategy": "auto"}) == []
+    assert approximations(package, "DropShadow", {"shadow_blur": 20, "blur_strategy": "box"}) == ["box"]
+    assert approximations(package, "Spotlight", {"shadow_blur": 200, "blur_strategy": "auto"}) == ["downsample"]
+    # A downsample by 1 is the exact blur
+    assert approximations(package, "Spotlight", {"shadow_blur": 5, "blur_strategy": "downsample"}) == []
+    assert approximations(package, "PerfectShadow", {"light_from": 12}) == []
+    assert approximations(package, "PerfectShadow", {"light_from": 7}) == ["oblique smear"]
+
+if __name__ == "__main__":
+    test_compare_outputs()
+    test_grid()
+    test_tiled_path_matches_pil()
+    test_opaque_composite_matches_reference()
+    test_tolerance_fails()
+    test_quick_grid_passes()
+    test_approximations()
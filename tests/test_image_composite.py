@@ -57,5 +57,66 @@ def test_image_composite():
 
     print("Test passed!")
 
+def test_image_composite_batch():
+    backgrounds = torch.stack([
+        torch.from_numpy(np.array(Image.new('RGB', (200, 200), color=color)).astype(np.float32) / 255.0)
+        for color in ('blue', 'green', 'white')
+    ])
+    subject = Image.new('RGB', (100, 50), color='red')
+    subject_tensor = torch.from_numpy(np.array(subject).astype(np.float32) / 255.0).unsqueeze(0)
+
+    image_composite_node = ImageComposite()
+
+    # One subject is placed on every background of the batch
+    composite_tensor, composite_tensor_rgb = image_composite_node.composite(backgrounds, subject_tensor, 20)
+    assert composite_tensor.shape == (3, 200, 200, 4)
+    assert composite_tensor_rgb.shape == (3, 200, 200, 3)
+    for i in range(3):
+        single, single_rgb = image_composite_node.composite(backgrounds[i:i + 1], subject_tensor, 20)
+        assert torch.equal(composite_tensor[i], single[0])
+        assert torch.equal(composite_tensor_rgb[i], single_rgb[0])
+
+    # Mismatching batch sizes cannot be paired
+    try:
+        image_composite_node.composite(backgrounds, subject_tensor.repeat(2, 1, 1, 1), 20)
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected a ValueError for mismatching batch sizes"
+
+def test_image_composite_matches_pil_paste():
+    # Semi-transparent subject, taller than the background (clipped at the top
+    # and bottom)
+    rng = np.random.default_rng(0)
+    background_tensor = torch.from_numpy(rng.random((1, 120, 160, 3), dtype=np.float32))
+    subject_tensor = torch.from_numpy(rng.random((1, 200, 100, 4), dtype=np.float32))
+
+    composite_tensor, composite_tensor_rgb = ImageComposite().composite(background_tensor, subject_tensor, 10)
+
+    background = Image.fromarray((background_tensor[0].numpy() * 255).astype(np.uint8)).convert("RGBA")
+    subject = Image.fromarray((subject_tensor[0].numpy() * 255).astype(np.uint8)).resize((140, 280))
+    background.paste(subject, (10, (120 - 280) // 2), subject)
+    expected = torch.from_numpy(np.array(background).astype(np.float32) / 255.0)
+    # Same colors as PIL's blend; the background stays opaque (PIL blends the
+    # alpha channel as well)
+    assert torch.equal(composite_tensor[0, ..., :3], expected[..., :3])
+    assert torch.all(composite_tensor[0, ..., 3] == 1.0)
+
+    # The RGB output shares the memory of the RGBA one
+    assert composite_tensor_rgb.data_ptr() == composite_tensor.data_ptr()
+
+def test_image_composite_unbatched():
+    # [H,W,C] background and subject composite like batches of one
+    rng = np.random.default_rng(1)
+    background_tensor = torch.from_numpy(rng.random((120, 160, 3), dtype=np.float32))
+    subject_tensor = torch.from_numpy(rng.random((80, 100, 4), dtype=np.float32))
+    for tiled in ["off", "on"]:
+        expected, _ = ImageComposite().composite(background_tensor[None], subject_tensor[None], 10, backend="pil", tiled=tiled)
+        composite_tensor, _ = ImageComposite().composite(background_tensor, subject_tensor, 10, backend="pil", tiled=tiled)
+        assert torch.equal(composite_tensor, expected)
+
 if __name__ == "__main__":
     test_image_composite()
+    test_image_composite_batch()
+    test_image_composite_matches_pil_paste()
+    test_image_composite_unbatched()
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+import image_selector
+from image_selector import ImageSelector, ImageFinder, DECODED_CACHE, list_images, decode_size
+import threading
+import background_index
+from background_index import INDEX_NAME, wait_for_refresh
+
+def test_selector_caches_decoded_images():
+    with tempfile.TemporaryDirectory() as image_dir:
+        image_path = os.path.join(image_dir, "bg.png")
+        Image.new('RGB', (40, 30), (0, 0, 255)).save(image_path)
+        original_dir = image_selector.IMAGE_DIR
+        image_selector.IMAGE_DIR = image_dir
+        try:
+            selector = ImageSelector()
+            DECODED_CACHE.clear()
+            first, = selector.select_image("bg.png")
+            second, = selector.select_image("bg.png")
+            assert first.shape == (1, 30, 40, 3)
+            assert torch.equal(second, first)
+            assert DECODED_CACHE.stats()["hits"] == 1
+
+            # Every output is a copy, writing into it leaves the cache intact
+            first.zero_()
+            fourth, = selector.select_image("bg.png")
+            assert torch.equal(fourth[0, 0, 0], torch.tensor([0.0, 0.0, 1.0]))
+            assert DECODED_CACHE.stats()["hits"] == 2
+
+            # A rewritten file is decoded again and reported as changed
+            signature = ImageSelector.IS_CHANGED("bg.png")
+            Image.new('RGB', (40, 30), (255, 0, 0)).save(image_path)
+            os.utime(image_path, ns=(0, 10 ** 9))
+            assert ImageSelector.IS_CHANGED("bg.png") != signature
+            third, = selector.select_image("bg.png")
+            assert torch.equal(third[0, 0, 0], torch.tensor([1.0, 0.0, 0.0]))
+        finally:
+            image_selector.IMAGE_DIR = original_dir
+
+def test_reduced_resolution_decoding():
+    # Height from the width like ImageComposite, no upscaling
+    assert decode_size(4210, 5946, max_width=1024) == (1024, 1446)
+    assert decode_size(4210, 5946, max_megapixels=2.0) == (1189, 1679)
+    assert decode_size(400, 300, max_width=1024, max_megapixels=2.0) == (400, 300)
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, 800, dtype=np.float32)
+    pixels = np.stack([np.tile(gradient, (600, 1)), np.tile(gradient[:600, None], (1, 800)), np.full((600, 800), 128, np.float32)], -1)
+    pixels += rng.normal(0, 4, pixels.shape)
+    with tempfile.TemporaryDirectory() as image_dir:
+        original_dir = image_selector.IMAGE_DIR
+        image_selector.IMAGE_DIR = image_dir
+        try:
+            for name in ["bg.jpg", "bg.png"]:
+                Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(os.path.join(image_dir, name))
+                full, = ImageSelector().select_image(name)
+                reduced, = ImageSelector().select_image(name, max_width=200)
+                assert reduced.shape == (1, 150, 200, 3)
+                # Close to the full image resized
+                expected = full[0].permute(2, 0, 1)[None]
+                expected = torch.nn.functional.interpolate(expected, size=(150, 200), mode="area")[0].permute(1, 2, 0)
+                assert (reduced[0] - expected).abs().mean() < 0.02
+
+                limited, = ImageSelector().select_image(name, max_megapixels=0.1)
+                assert limited.shape[2] * limited.shape[1] <= 100000
+        finally:
+            image_selector.IMAGE_DIR = original_dir
+
+def test_listing_follows_directory_changes():
+    with tempfile.TemporaryDirectory() as image_dir:
+        Image.new('RGB', (4, 4)).save(os.path.join(image_dir, "a.jpg"))
+        os.mkdir(os.path.join(image_dir, "subdir"))
+        assert list_images(image_dir) == ["a.jpg"]
+
+        Image.new('RGB', (4, 4)).save(os.path.join(image_dir, "b.jpg"))
+        os.utime(image_dir, ns=(0, 10 ** 9))
+        assert list_images(image_dir) == ["a.jpg", "b.jpg"]
+
+def _library(image_dir):
+    Image.new('RGB', (300, 200), (200, 30, 30)).save(os.path.join(image_dir, "red.jpg"))
+    Image.new('RGB', (100, 400), (30, 30, 200)).save(os.path.join(image_dir, "blue.png"))
+    Image.new('RGB', (400, 100), (30, 30, 200)).save(os.path.join(image_dir, "wide_blue.png"))
+    with open(os.path.join(image_dir, "notes.txt"), "w") as f:
+        f.write("not an image")
+
+def test_listing_from_index():
+    with tempfile.TemporaryDirectory() as image_dir:
+        _library(image_dir)
+        original_dir = image_selector.IMAGE_DIR
+        image_selector.IMAGE_DIR = image_dir
+        scan_file = background_index.scan_file
+        release = threading.Event()
+
+        def blocked_scan(path):
+            release.wait()
+            return scan_file(path)
+        background_index.scan_file = blocked_scan
+        try:
+            # The index is built in the background, the listing does not
+            # wait for it
+            assert ImageSelector.INPUT_TYPES()["required"]["image"][0] == ["blue.png", "notes.txt", "red.jpg", "wide_blue.png"]
+            release.set()
+            wait_for_refresh(image_dir)
+            assert os.path.exists(os.path.join(image_dir, INDEX_NAME))
+            # Then only readable backgrounds
+            assert ImageSelector.INPUT_TYPES()["required"]["image"][0] == ["blue.png", "red.jpg", "wide_blue.png"]
+            Image.new('RGB', (4, 4)).save(os.path.join(image_dir, "a.jpg"))
+            os.utime(image_dir, ns=(0, 10 ** 9))
+            assert ImageSelector.INPUT_TYPES()["required"]["image"][0][0] == "a.jpg"
+        finally:
+            release.set()
+            background_index.scan_file = scan_file
+            image_selector.IMAGE_DIR = original_dir
+            wait_for_refresh(image_dir)
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        # No index can be written: the directory is listed
+        _library(image_dir)
+        os.mkdir(os.path.join(image_dir, INDEX_NAME))
+        original_dir = image_selector.IMAGE_DIR
+        image_selector.IMAGE_DIR = image_dir
+        try:
+            assert ImageSelector.INPUT_TYPES()["required"]["image"][0] == ["blue.png", "notes.txt", "red.jpg", "wide_blue.png"]
+            wait_for_refresh(image_dir)
+            assert ImageSelector.INPUT_TYPES()["required"]["image"][0] == ["blue.png", "notes.txt", "red.jpg", "wide_blue.png"]
+        finally:
+            image_selector.IMAGE_DIR = original_dir
+
+def test_image_finder():
+    with tempfile.TemporaryDirectory() as image_dir:
+        _library(image_dir)
+        original_dir = image_selector.IMAGE_DIR
+        image_selector.IMAGE_DIR = image_dir
+        try:
+            finder = ImageFinder()
+            image, name = finder.find_image(0, 0, "portrait", "", 64, 0)
+            assert name == "blue.png" and image.shape == (1, 400, 100, 3)
+            # The position counts through the matches, sorted by name
+            assert finder.find_image(0, 0, "any", "#1e1ec8", 64, 1)[1] == "wide_blue.png"
+            assert finder.find_image(0, 0, "any", "#1e1ec8", 64, 2)[1] == "blue.png"
+            image, name = finder.find_image(250, 0, "any", "", 64, 0, max_width=100)
+            assert name == "red.jpg" and image.shape[2] == 100
+            assert ImageFinder.IS_CHANGED(0, 0, "portrait", "", 64, 0) == ImageSelector.IS_CHANGED("blue.png")
+            # Without a match the node always runs (and raises)
+            changed = ImageFinder.IS_CHANGED(1000, 1000, "any", "", 64, 0)
+            assert changed != changed
+            try:
+                finder.find_image(1000, 1000, "any", "", 64, 0)
+                assert False, "No background is that large"
+            except ValueError:
+                pass
+        finally:
+            image_selector.IMAGE_DIR = original_dir
+
+if __name__ == "__main__":
+    test_selector_caches_decoded_images()
+    test_reduced_resolution_decoding()
+    test_listing_follows_directory_changes()
+    test_listing_from_index()
+    test_image_finder()
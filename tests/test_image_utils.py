@@ -0,0 +1,83 @@
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+import image_utils
+from image_utils import image_to_uint8, image_batch_to_pil, image_batch_to_rgba, alpha_image, pil_batch_to_tensor, uint8_batch_to_tensor, rgb_view, uint8_to_tensor, quantize_to_tensor
+
+def test_conversions_match_reference():
+    image_tensor = torch.rand(2, 16, 12, 4)
+
+    # float -> uint8 gives the same values as the per-node conversion did before
+    reference = np.clip(255. * image_tensor.numpy(), 0, 255).astype(np.uint8)
+    assert np.array_equal(image_to_uint8(image_tensor), reference)
+
+    # uint8 -> float as well
+    assert torch.equal(uint8_to_tensor(reference), torch.from_numpy(reference.astype(np.float32) / 255.0))
+
+    # Numpy input and unbatched images are accepted
+    assert len(image_batch_to_pil(image_tensor.numpy()[0])) == 1
+
+def test_channel_handling():
+    rgb = torch.rand(1, 8, 8, 3)
+    images = image_batch_to_pil(rgb, mode='RGBA')
+    assert images[0].mode == 'RGBA'
+    assert images[0].getpixel((0, 0))[3] == 255
+
+    # The 3-channel output shares the 4-channel buffer
+    rgba = pil_batch_to_tensor(images)
+    rgb_out = rgb_view(rgba)
+    assert rgb_out.shape == (1, 8, 8, 3)
+    assert rgb_out.data_ptr() == rgba.data_ptr()
+
+def test_rgba_arrays_match_pil():
+    # Same pixels as the PIL images in RGBA, for every channel count
+    for channels in [1, 3, 4]:
+        image = torch.rand(2, 9, 7, channels)
+        arrays = image_batch_to_rgba(image)
+        for array, image_pil in zip(arrays, image_batch_to_pil(image, mode='RGBA')):
+            assert np.array_equal(array, np.asarray(image_pil))
+        assert np.array_equal(np.asarray(alpha_image(arrays[0])), np.asarray(image_batch_to_pil(image, mode='RGBA')[0].getchannel('A')))
+        assert torch.equal(uint8_batch_to_tensor(arrays), pil_batch_to_tensor(image_batch_to_pil(image, mode='RGBA')))
+
+def test_padding_to_common_canvas():
+    small = Image.new('RGBA', (4, 3), (255, 0, 0, 255))
+    large = Image.new('RGBA', (6, 5), (0, 255, 0, 255))
+    batch = pil_batch_to_tensor([small, large])
+    assert batch.shape == (2, 5, 6, 4)
+    assert batch[0, :3, :4].min() == 0 and batch[0, :3, :4, 0].min() == 1
+    assert batch[0, 3:].abs().sum() == 0
+    assert batch[0, :, 4:].abs().sum() == 0
+
+def test_quantize_to_float16():
+    # Same 8 bit levels as in float32, then rounded to float16
+    image = np.random.default_rng(0).random((32, 32, 3), dtype=np.float32)
+    expected = quantize_to_tensor(image, torch.empty(32, 32, 3))
+    half = quantize_to_tensor(image, torch.empty(32, 32, 3, dtype=torch.float16))
+    assert torch.equal(half, expected.half())
+
+def test_scratch_buffer_is_bounded():
+    # Converted in strips, the kept buffer stays small for large batches
+    values = image_utils.SCRATCH_VALUES
+    image_utils.SCRATCH_VALUES = 100
+    image_utils._scratch.buffer = None
+    try:
+        image = torch.rand(3, 40, 7, 4)
+        reference = np.clip(255. * image.numpy(), 0, 255).astype(np.uint8)
+        assert np.array_equal(image_to_uint8(image), reference)
+        assert image_utils._scratch.buffer.size <= 100
+        # A row wider than the buffer is converted on its own
+        wide = torch.rand(1, 2, 30, 4)
+        assert np.array_equal(image_to_uint8(wide), np.clip(255. * wide.numpy(), 0, 255).astype(np.uint8))
+        assert image_utils._scratch.buffer.size <= 100
+    finally:
+        image_utils.SCRATCH_VALUES = values
+
+if __name__ == "__main__":
+    test_conversions_match_reference()
+    test_channel_handling()
+    test_rgba_arrays_match_pil()
+    test_padding_to_common_canvas()
+    test_quantize_to_float16()
+    test_scratch_buffer_is_bounded()
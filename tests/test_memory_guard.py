@@ -0,0 +1,100 @@
+import os
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from memory_guard import MemoryLimit, CanvasTooLargeError, estimate_peak_bytes
+from drop_shadow import DropShadow
+from spotlight import Spotlight
+from image_utils import pil_batch_to_tensor
+
+def _cutout():
+    image = Image.new('RGBA', (200, 160), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (50, 30, 150, 130))
+    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+
+def test_float16_output():
+    image = _cutout()
+    full, = DropShadow().add_shadow(image, 6, 50, 20, 1.5, "#000000")
+    half, = DropShadow().add_shadow(image, 6, 50, 20, 1.5, "#000000", output_dtype="float16")
+    assert half.dtype == torch.float16
+    assert torch.allclose(half.float(), full, atol=1e-3)
+
+    full, = Spotlight().apply_spotlight(image, 3, 7.5, 20, "#000000")
+    half, = Spotlight().apply_spotlight(image, 3, 7.5, 20, "#000000", output_dtype="float16")
+    assert half.dtype == torch.float16
+    assert torch.allclose(half.float(), full, atol=1e-3)
+
+    # Batches of different canvas sizes are padded in the requested dtype
+    small = Image.new('RGBA', (4, 3), (255, 0, 0, 255))
+    large = Image.new('RGBA', (6, 5), (0, 255, 0, 255))
+    batch = pil_batch_to_tensor([small, large], torch.float16)
+    assert batch.dtype == torch.float16 and batch.shape == (2, 5, 6, 4)
+    assert batch[0, 3:].abs().sum() == 0
+
+def test_megapixel_limit():
+    image = _cutout()
+    unlimited, = DropShadow().add_shadow(image, 6, 50, 20, 5.0, "#000000")
+    assert unlimited.shape[1] * unlimited.shape[2] > 0.2e6
+
+    # Fails before rendering
+    try:
+        DropShadow().add_shadow(image, 6, 50, 20, 5.0, "#000000", max_megapixels=0.2, oversize="error")
+    except CanvasTooLargeError as error:
+        assert "megapixels" in str(error)
+    else:
+        assert False, "Expected a CanvasTooLargeError"
+
+    # Renders a smaller shadow within the limit
+    for backend in ["pil", "torch"]:
+        limited, = DropShadow().add_shadow(image, 6, 50, 20, 5.0, "#000000", "auto", backend, max_megapixels=0.2)
+        assert limited.shape[1] * limited.shape[2] <= 0.2e6
+        limited, = Spotlight().apply_spotlight(image, 3, 10, 20, "#000000", "auto", backend, max_megapixels=0.05)
+        assert limited.shape[1] * limited.shape[2] <= 0.05e6
+
+    # Canvases within the limit are left alone
+    assert MemoryLimit(1).fit_shadow(lambda scale: (100, 100), 1.5, 20) == (1.5, 20)
+
+def test_estimate_peak_bytes():
+    assert estimate_peak_bytes((1000, 1000)) == 1000 * 1000 * (4 + 16 + 3)
+    assert estimate_peak_bytes((1000, 1000), 2, "float16") == 1000 * 1000 * (2 * (4 + 8) + 3)
+    assert estimate_peak_bytes((1000, 1000), 2, tiled=True) == 1000 * 1000 * (2 * 16 + 1 + 3)
+
+def test_no_limit_by_default():
+    # Without GOEDE_MAX_MEGAPIXELS existing graphs render unchanged
+    assert "GOEDE_MAX_MEGAPIXELS" not in os.environ
+    limit = MemoryLimit()
+    assert limit.fits((20000, 20000))
+    assert limit.fit_shadow(lambda scale: (int(20000 * scale), 20000), 5.0, 200) == (5.0, 200)
+
+def test_peak_checked_before_rendering():
+    image = _cutout()
+    os.environ["GOEDE_MAX_MEMORY_MB"] = "2"
+    try:
+        for render in [
+            lambda: DropShadow().add_shadow(image, 6, 50, 20, 5.0, "#000000", backend="pil"),
+            lambda: Spotlight().apply_spotlight(image, 3, 10, 20, "#000000", backend="pil"),
+        ]:
+            try:
+                render()
+            except CanvasTooLargeError as error:
+                assert "GiB" in str(error)
+            else:
+                assert False, "Expected a CanvasTooLargeError"
+        # A canvas that fits into the memory renders
+        small, = DropShadow().add_shadow(image, 6, 10, 0, 0.5, "#000000", backend="pil")
+        assert small.shape[0] == 1
+        # The estimate follows the canvas the megapixel limit leaves
+        assert MemoryLimit(0.01).check_peak((1000, 1000)) == estimate_peak_bytes((10000, 1))
+        os.environ["GOEDE_MAX_MEMORY_MB"] = "0"
+        assert MemoryLimit().check_peak((100000, 100000)) > 2 ** 37
+    finally:
+        del os.environ["GOEDE_MAX_MEMORY_MB"]
+
+if __name__ == "__main__":
+    test_float16_output()
+    test_megapixel_limit()
+    test_estimate_peak_bytes()
+    test_no_limit_by_default()
+    test_peak_checked_before_rendering()
@@ -0,0 +1,130 @@
+import os
+import threading
+import torch
+import sys
+sys.path.insert(0, './goede-image-placer')
+import parallel
+import profiling
+from drop_shadow import DropShadow
+from spotlight import Spotlight
+from image_composite import ImageComposite
+from stage_cache import STAGE_CACHE
+sys.path.insert(0, './benchmarks')
+from bench_nodes import synthetic_cutout, synthetic_background
+
+def _render(image, background):
+    STAGE_CACHE.clear()
+    shadowed, = DropShadow().add_shadow(image, 4, 50, 20, 1.5, "#000000")
+    spotlight, = Spotlight().apply_spotlight(image, 3, 7.5, 20, "#000000")
+    composite, _ = ImageComposite().composite(background, image, 10)
+    return shadowed, spotlight, composite
+
+def test_threads_match_serial():
+    image = synthetic_cutout(3, 160, 120)
+    background = synthetic_background(3, 200, 150)
+    try:
+        parallel.set_max_workers(1)
+        serial = _render(image, background)
+        parallel.set_max_workers(4)
+        threaded = _render(image, background)
+        # Single items use the stage parallelism instead
+        single = _render(image[1:2], background[1:2])
+    finally:
+        parallel.set_max_workers(None)
+    for expected, result in zip(serial, threaded):
+        assert torch.equal(expected, result)
+    for expected, result in zip(serial, single):
+        # Batch items are padded to a common canvas
+        height, width = result.shape[1:3]
+        assert torch.equal(expected[1, :height, :width], result[0])
+
+def test_map_items():
+    try:
+        parallel.set_max_workers(2)
+        # Order is kept, nested calls run inline on the worker
+        result = parallel.map_items(lambda i: parallel.map_items(lambda j: (i, j, threading.current_thread().name), range(3)), range(4))
+        assert [[(i, j) for i, j, _ in row] for row in result] == [[(i, j) for j in range(3)] for i in range(4)]
+        assert all(len({name for _, _, name in row}) == 1 for row in result)
+
+        # Errors are raised by the caller
+        try:
+            parallel.map_items(lambda i: 1 // i, [1, 0])
+        except ZeroDivisionError:
+            pass
+        else:
+            assert False, "Expected a ZeroDivisionError"
+    finally:
+        parallel.set_max_workers(None)
+
+def test_worker_stages_are_profiled():
+    records = []
+    try:
+        parallel.set_max_workers(4)
+        profiling.enable()
+        profiling.add_listener(records.append)
+        STAGE_CACHE.clear()
+        DropShadow().add_shadow(synthetic_cutout(2, 160, 120), 6, 50, 20, 1.5, "#000000")
+    finally:
+        profiling.remove_listener(records.append)
+        profiling.disable()
+        parallel.set_max_workers(None)
+    threads = {entry["thread"] for entry in records[0]["stages"] if entry["name"] == "blur"}
+    assert all(name.startswith("goede") for name in threads)
+
+def test_pool_off_by_default():
+    assert "GOEDE_THREADS" not in os.environ
+    assert parallel.max_workers() == 1
+    names = parallel.map_items(lambda i: threading.current_thread().name, range(4))
+    assert names == [threading.current_thread().name] * 4
+    os.environ["GOEDE_THREADS"] = "0"
+    try:
+        assert parallel.max_workers() == min(parallel.MAX_DEFAULT_WORKERS, os.cpu_count() or 1)
+        os.environ["GOEDE_THREADS"] = "3"
+        assert parallel.max_workers() == 3
+    finally:
+        del os.environ["GOEDE_THREADS"]
+
+def test_resize_while_busy():
+    # Tasks keep being submitted from other threads while the pool is resized
+    errors = []
+    stop = threading.Event()
+
+    def work():
+        try:
+            while not stop.is_set():
+                assert parallel.map_items(lambda i: i * i, range(16)) == [i * i for i in range(16)]
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    try:
+        parallel.set_max_workers(2)
+        for thread in threads:
+            thread.start()
+        for count in [3, 1, 4, 2, 5] * 4:
+            parallel.set_max_workers(count)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        parallel.set_max_workers(None)
+    assert not errors
+
+    # A task cannot resize the pool it runs on
+    try:
+        parallel.set_max_workers(2)
+        try:
+            parallel.submit(parallel.set_max_workers, 3).result()
+        except RuntimeError:
+            pass
+        else:
+            assert False, "Expected a RuntimeError"
+    finally:
+        parallel.set_max_workers(None)
+
+if __name__ == "__main__":
+    test_threads_match_serial()
+    test_map_items()
+    test_worker_stages_are_profiled()
+    test_pool_off_by_default()
+    test_resize_while_busy()
@@ -1,8 +1,9 @@
+import math
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFilter
 import sys
 sys.path.insert(0, './goede-image-placer')
-from perfect_shadow import PerfectShadow
+from perfect_shadow import PerfectShadow, directional_smear
 
 def test_perfect_shadow():
     # Load the test image
@@ -33,5 +34,94 @@ def test_perfect_shadow():
 
     print("Test passed! All shadow images generated.")
 
+def _paste_loop(silhouette, dx, dy, length):
+    # The former paste loop: the silhouette pasted with its own alpha at
+    # (int(i * dx), int(i * dy))
+    shadow = Image.new('RGBA', silhouette.size, (0, 0, 0, 255))
+    shadow.putalpha(silhouette)
+    reference = Image.new('RGBA', silhouette.size, (0, 0, 0, 0))
+    for i in range(length):
+        reference.paste(shadow, (int(i * dx), int(i * dy)), shadow)
+    return reference.getchannel('A')
+
+def test_directional_smear_matches_paste_loop():
+    # Soft-edged silhouette, smeared with the former paste loop as reference
+    silhouette = Image.new('L', (120, 90), 0)
+    silhouette.paste(255, (40, 30, 70, 60))
+    silhouette.paste(128, (70, 30, 73, 60))
+
+    length = 25
+    for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        reference = _paste_loop(silhouette, dx, dy, length)
+        smeared = np.array(directional_smear(silhouette, dx, dy, length)).astype(int)
+        assert np.abs(smeared - np.array(reference).astype(int)).max() <= 2
+
+def test_directional_smear_oblique():
+    # Oblique and fractional clock positions differ from the paste loop on
+    # edge pixels; after the blur of the node (radius 10) by at most 4
+    # levels on anti-aliased edges, 16 on hard 0/255 edges
+    hard = Image.new('L', (60, 50), 0)
+    ImageDraw.Draw(hard).ellipse((8, 6, 50, 44), fill=255)
+    soft = hard.filter(ImageFilter.GaussianBlur(1.5))
+    soft.paste(128, (30, 2, 34, 48))
+    hard.paste(255, (30, 2, 34, 48))
+    for disc, bound, mean_bound in [(soft, 4, 1.0), (hard, 16, 2.5)]:
+        for length in [40, 125]:
+            for light_from in [1, 2, 4, 5, 7, 8, 10, 11, 2.5, 7.3]:
+                dx, dy = PerfectShadow()._shear(light_from)
+                width, height = disc.width + abs(int(length * dx)), disc.height + abs(int(length * dy))
+                silhouette = Image.new('L', (width, height), 0)
+                silhouette.paste(disc, ((width - disc.width) // 2, (height - disc.height) // 2))
+                reference = _paste_loop(silhouette, dx, dy, length)
+                smeared = directional_smear(silhouette, dx, dy, length)
+                expected = np.array(reference.filter(ImageFilter.GaussianBlur(10))).astype(int)
+                blurred = np.array(smeared.filter(ImageFilter.GaussianBlur(10))).astype(int)
+                assert np.abs(blurred - expected).max() <= bound, (light_from, length)
+                assert np.abs(blurred - expected).mean() <= mean_bound
+
+def test_perfect_shadow_fractional_angle():
+    image = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (16, 16, 48, 48))
+    image_array = (np.array(image).astype(np.float32) / 255.0)[np.newaxis, ...]
+
+    perfect_shadow_node = PerfectShadow()
+    shadow_array, = perfect_shadow_node.apply_shadow(image_array, 2.5, 1, 1.0)
+
+    # Half past two: the light comes from 105 degrees, the 100 px shadow
+    # points to 285 degrees
+    dx = math.cos(math.radians(285))
+    dy = math.sin(math.radians(285))
+    assert shadow_array.shape == (1, 64 + abs(int(100 * dy)), 64 + abs(int(100 * dx)), 4)
+
+    # The shadow ends up above and right of the square
+    alpha = shadow_array[0, ..., 3].numpy()
+    height, width = alpha.shape
+    assert alpha[:height // 4, width // 2:].sum() > alpha[:height // 4, :width // 2].sum()
+    assert alpha[:height // 4].sum() > alpha[-height // 4:].sum()
+
+def test_perfect_shadow_opacity():
+    image = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (16, 16, 48, 48))
+    image_array = (np.array(image).astype(np.float32) / 255.0)[np.newaxis, ...]
+
+    for quality in ["full", "draft"]:
+        opaque, = PerfectShadow().apply_shadow(image_array, 3, 1, 1.0, quality)
+        half, = PerfectShadow().apply_shadow(image_array, 3, 1, 0.5, quality)
+        clear, = PerfectShadow().apply_shadow(image_array, 3, 1, 0.0, quality)
+        # The subject stays (centered in the canvas), the shadow alpha is
+        # scaled by the opacity
+        assert half.shape == opaque.shape
+        y, x = (opaque.shape[1] - 64) // 2 + 16, (opaque.shape[2] - 64) // 2 + 16
+        assert np.array_equal(half[0, y:y + 32, x:x + 32].numpy(), opaque[0, y:y + 32, x:x + 32].numpy())
+        shadow = opaque[0, ..., 3].numpy() > 0
+        shadow[y:y + 32, x:x + 32] = False
+        assert shadow.any()
+        assert np.allclose(half[0, ..., 3].numpy()[shadow], opaque[0, ..., 3].numpy()[shadow] * 0.5, atol=1 / 255)
+        assert clear[0, ..., 3].numpy()[shadow].max() == 0
+
 if __name__ == "__main__":
     test_perfect_shadow()
+    test_directional_smear_matches_paste_loop()
+    test_directional_smear_oblique()
+    test_perfect_shadow_fractional_angle()
+    test_perfect_shadow_opacity()
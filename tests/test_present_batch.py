@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+import present_batch
+from image_utils import image_batch_to_pil
+from add_padding import AddPadding
+from drop_shadow import DropShadow
+from image_composite import ImageComposite
+
+def _write_inputs(directory, count):
+    for i in range(count):
+        image = Image.new('RGBA', (80 + 10 * i, 60), (0, 0, 0, 0))
+        image.paste((255, 40 * i, 0, 255), (20, 10, 60, 50))
+        image.save(os.path.join(directory, f"cutout_{i}.png"))
+    Image.new('RGB', (300, 200), (0, 0, 255)).save(os.path.join(directory, "background.jpg"))
+
+def test_present_batch():
+    directory = tempfile.mkdtemp()
+    try:
+        inputs = os.path.join(directory, "in")
+        outputs = os.path.join(directory, "out")
+        os.makedirs(inputs)
+        _write_inputs(inputs, 3)
+        background = os.path.join(inputs, "background.jpg")
+        args = ["--input", inputs, "--output", outputs, "--background", background, "--padding", "10", "10", "10", "10", "--spacing", "20"]
+
+        assert present_batch.main(args + ["--workers", "2", "--queue-size", "2"]) == 0
+        assert sorted(os.listdir(outputs)) == ["cutout_0.png", "cutout_1.png", "cutout_2.png"]
+
+        # Same pixels as the node chain of the workflow
+        cutout = present_batch.load_cutout(os.path.join(inputs, "cutout_1.png"))
+        padded, _, _ = AddPadding().add_padding(cutout, 10, 10, 10, 10)
+        shadowed, = DropShadow().add_shadow(padded, 6, 50, 20, 1.5, "#000000")
+        _, expected = ImageComposite().composite(present_batch.load_background(background), shadowed, 20)
+        with Image.open(os.path.join(outputs, "cutout_1.png")) as result:
+            assert np.array_equal(np.array(result), np.array(image_batch_to_pil(expected)[0]))
+
+        # Resumable: existing outputs are skipped, missing ones rendered
+        os.remove(os.path.join(outputs, "cutout_2.png"))
+        with open(os.path.join(directory, "manifest.txt"), "w") as f:
+            f.write("# nightly\nin/cutout_0.png\nin/cutout_2.png\nin/missing.png\n")
+        args[0:2] = ["--manifest", os.path.join(directory, "manifest.txt")]
+        assert present_batch.main(args + ["--workers", "0"]) == 1
+        assert os.path.exists(os.path.join(outputs, "cutout_2.png"))
+        assert not any(name.endswith(".part") for name in os.listdir(outputs))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_present_batch()
@@ -0,0 +1,60 @@
+import os
+import json
+import torch
+import numpy as np
+import sys
+sys.path.insert(0, './goede-image-placer')
+import profiling
+from drop_shadow import DropShadow
+from image_composite import ImageComposite
+from stage_cache import STAGE_CACHE
+
+def _cutout(height=80, width=100):
+    yy, xx = np.mgrid[:height, :width]
+    image = np.zeros((1, height, width, 4), dtype=np.float32)
+    image[..., :3] = 0.5
+    image[0, ..., 3] = np.clip(1.2 - np.hypot((yy - 40) / 25, (xx - 50) / 30), 0, 1)
+    return torch.from_numpy(image)
+
+def test_profiling_disabled():
+    profiling.disable()
+    count = len(profiling.RECORDS)
+    DropShadow().add_shadow(_cutout(), 6, 50, 20, 1.5, "#000000")
+    assert len(profiling.RECORDS) == count
+    assert profiling.stage("blur") is profiling._NULL_STAGE
+
+def test_profiling_records_stages():
+    records = []
+    profiling.enable()
+    profiling.add_listener(records.append)
+    try:
+        STAGE_CACHE.clear()
+        DropShadow().add_shadow(_cutout(), 6, 50, 20, 1.5, "#000000")
+        ImageComposite().composite(torch.rand(1, 100, 120, 3), _cutout(), 10)
+    finally:
+        profiling.remove_listener(records.append)
+        profiling.disable()
+
+    assert [record["node"] for record in records] == ["DropShadow", "ImageComposite"]
+    assert profiling.RECORDS[-1] is records[-1]
+
+    shadow = records[0]
+    names = [entry["name"] for entry in shadow["stages"]]
+    for name in ["to_uint8", "contour", "resize", "blur", "affine", "paste", "to_tensor"]:
+        assert name in names
+    assert names[0] == "to_uint8" and names[-1] == "to_tensor"
+    stages = {entry["name"]: entry for entry in shadow["stages"]}
+    assert stages["to_uint8"]["output"] == [80, 100, 4]
+    assert stages["to_tensor"]["output"][0] == 1
+    assert sum(entry["duration"] for entry in shadow["stages"] if entry["depth"] == 0) <= shadow["duration"]
+
+    profiling.dump_trace("test_trace.json", records)
+    with open("test_trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    os.remove("test_trace.json")
+    assert len(events) == 2 + sum(len(record["stages"]) for record in records)
+    assert events[0]["name"] == "DropShadow" and events[0]["ph"] == "X"
+
+if __name__ == "__main__":
+    test_profiling_disabled()
+    test_profiling_records_stages()
@@ -0,0 +1,48 @@
+import torch
+import sys
+sys.path.insert(0, './goede-image-placer')
+from drop_shadow import DropShadow
+from spotlight import Spotlight
+from perfect_shadow import PerfectShadow
+sys.path.insert(0, './benchmarks')
+from bench_nodes import synthetic_cutout
+
+def _premultiplied(image):
+    # The color of nearly transparent pixels is not visible
+    return torch.cat((image[..., :3] * image[..., 3:], image[..., 3:]), -1)
+
+def _assert_preview(full, draft, max_error):
+    # Same canvas, the shadow nearly the same
+    assert full.shape == draft.shape
+    error = (_premultiplied(full) - _premultiplied(draft)).abs()
+    assert error.max() <= max_error
+    assert error.mean() <= 0.002
+
+def test_draft_quality():
+    image = synthetic_cutout(2, 256, 192)
+    for backend in ["pil", "torch"]:
+        full, = DropShadow().add_shadow(image, 4, 50, 20, 1.5, "#000000", "auto", backend)
+        draft, = DropShadow().add_shadow(image, 4, 50, 20, 1.5, "#000000", "auto", backend, quality="draft")
+        _assert_preview(full, draft, 0.1)
+
+        full, = Spotlight().apply_spotlight(image, 4, 7.5, 20, "#000000", "auto", backend)
+        draft, = Spotlight().apply_spotlight(image, 4, 7.5, 20, "#000000", "auto", backend, quality="draft")
+        _assert_preview(full, draft, 0.1)
+
+    full, = PerfectShadow().apply_shadow(image, 4, 2, 1.0)
+    draft, = PerfectShadow().apply_shadow(image, 4, 2, 1.0, quality="draft")
+    _assert_preview(full, draft, 0.25)
+
+def test_draft_quality_hard_edges():
+    # Opaque square with hard edges inside the reduced pixels: the draft
+    # smear keeps the shadow behind such an edge opaque
+    image = torch.zeros(1, 130, 150, 4)
+    image[:, 33:95, 41:103] = torch.tensor([0.8, 0.2, 0.1, 1.0])
+    for light_from in [12, 3, 4, 8]:
+        full, = PerfectShadow().apply_shadow(image, light_from, 2, 1.0)
+        draft, = PerfectShadow().apply_shadow(image, light_from, 2, 1.0, quality="draft")
+        _assert_preview(full, draft, 0.1)
+
+if __name__ == "__main__":
+    test_draft_quality()
+    test_draft_quality_hard_edges()
@@ -0,0 +1,77 @@
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from shadow_composite import ShadowComposite
+from drop_shadow import DropShadow
+from image_composite import ImageComposite
+
+def _cutouts():
+    first = Image.new('RGBA', (100, 120), (0, 0, 0, 0))
+    first.paste((255, 0, 0, 255), (20, 20, 80, 100))
+    second = Image.new('RGBA', (100, 120), (0, 0, 0, 0))
+    second.paste((0, 255, 0, 200), (40, 10, 60, 110))
+    return torch.from_numpy(np.stack([np.array(first), np.array(second)]).astype(np.float32) / 255.0)
+
+def test_shadow_composite_matches_chain():
+    subjects = _cutouts()
+    background = torch.rand(1, 240, 320, 3)
+    for shadow_args, spacing, quality in [
+        ((6, 50, 20, 1.5, "#000000"), 20, "full"),
+        ((2, 30, 0, 0.8, "#203040"), 20, "full"),
+        ((10, 85, 19, 1.5, "#305080"), 32, "full"),
+        ((3, 164, 4, 2.5, "#305080"), 42, "draft"),
+    ]:
+        shadowed, = DropShadow().add_shadow(subjects, *shadow_args, backend="pil", quality=quality)
+        expected = ImageComposite().composite(background, shadowed, spacing, backend="pil")
+
+        result = ShadowComposite().composite(background, subjects, spacing, *shadow_args, backend="pil", quality=quality)
+
+        # Up to the rounding of the resize boxes on a few edge pixels
+        error = (result[0] - expected[0]).abs() * 255
+        assert error.max() <= 2.01
+        assert (error > 0.5).float().mean() < 0.01
+        assert result[1].data_ptr() == result[0].data_ptr()
+
+def test_shadow_composite_options():
+    subjects = _cutouts()
+    background = torch.rand(1, 240, 320, 3)
+    shadow_args = (4, 60, 10, 1.5, "#000000")
+    expected = ShadowComposite().composite(background, subjects, 20, *shadow_args, backend="pil", tiled="off")
+    tiled = ShadowComposite().composite(background, subjects, 20, *shadow_args, backend="pil", tiled="on")
+    assert torch.equal(tiled[0], expected[0])
+
+    half = ShadowComposite().composite(background, subjects, 20, *shadow_args, backend="pil", output_dtype="float16")
+    assert half[0].dtype == torch.float16
+    assert (half[0].float() - expected[0]).abs().max() < 0.5 / 255
+
+    # The memory limit applies to the shadow canvas like in DropShadow
+    shadowed, = DropShadow().add_shadow(subjects, *shadow_args, backend="pil", max_megapixels=0.05)
+    chained = ImageComposite().composite(background, shadowed, 20, backend="pil")
+    limited = ShadowComposite().composite(background, subjects, 20, *shadow_args, backend="pil", max_megapixels=0.05)
+    assert ((limited[0] - chained[0]).abs() * 255).max() <= 2.01
+
+def test_shadow_composite_torch_backend():
+    subjects = _cutouts()
+    background = torch.rand(1, 240, 320, 3)
+    shadowed, = DropShadow().add_shadow(subjects, 6, 50, 20, 1.5, "#000000", "auto", "torch")
+    expected = ImageComposite().composite(background, shadowed, 20, "torch")
+
+    result = ShadowComposite().composite(background, subjects, 20, 6, 50, 20, 1.5, "#000000", "auto", "torch")
+
+    assert torch.allclose(result[0], expected[0], atol=1e-5)
+
+def test_shadow_composite_tiny_subject():
+    # 1 px subjects (and subjects below the draft factor) render
+    background = torch.rand(1, 60, 80, 3)
+    for subject in [torch.rand(1, 1, 1, 4), torch.rand(1, 3, 7, 4)]:
+        for options in [{"backend": "pil"}, {"backend": "torch"}, {"tiled": "on"}, {"quality": "draft"}]:
+            result = ShadowComposite().composite(background, subject, 10, 6, 5, 2, 1.5, "#000000", **options)
+            assert result[0].shape[:3] == (1, 60, 80)
+
+if __name__ == "__main__":
+    test_shadow_composite_matches_chain()
+    test_shadow_composite_options()
+    test_shadow_composite_torch_backend()
+    test_shadow_composite_tiny_subject()
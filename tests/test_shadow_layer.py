@@ -0,0 +1,37 @@
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from shadow_layer import alpha_layer, scale_layer, blur_layer, ellipse_layer, layer_to_image
+from blur import blur_alpha
+
+def _silhouette(width, height, center_x, center_y, radius):
+    yy, xx = np.mgrid[:height, :width]
+    alpha = np.clip(1.2 - np.hypot(yy - center_y, xx - center_x) / radius, 0, 1)
+    return Image.fromarray((alpha * 255).round().astype(np.uint8))
+
+def test_layer_stages_match_full_canvas():
+    # A centered silhouette and one touching the top left corner
+    for alpha in [_silhouette(160, 120, 72, 60, 24), _silhouette(83, 97, 8, 10, 20)]:
+        layer = alpha_layer(alpha)
+        assert np.array_equal(np.asarray(layer_to_image(layer)), np.asarray(alpha))
+
+        for scale in [0.7, 1.3]:
+            expected = alpha.resize((int(alpha.width * scale), int(alpha.height * scale)), Image.LANCZOS)
+            assert np.array_equal(np.asarray(layer_to_image(scale_layer(alpha, layer, scale))), np.asarray(expected))
+
+        for radius, strategy in [(10, "exact"), (20, "box"), (60, "downsample")]:
+            expected = blur_alpha(alpha, radius, strategy)
+            assert np.array_equal(np.asarray(layer_to_image(blur_layer(layer, radius, strategy))), np.asarray(expected))
+
+        expected = alpha.transform((alpha.width, int(alpha.height * 0.6)), Image.AFFINE, (1, 0, 0, 0, 0.6, 0), resample=Image.BICUBIC)
+        assert np.array_equal(np.asarray(layer_to_image(ellipse_layer(layer, 0.6))), np.asarray(expected))
+
+def test_empty_layer():
+    layer = alpha_layer(Image.new('L', (40, 30), 0))
+    assert np.asarray(layer_to_image(blur_layer(layer, 10))).max() == 0
+    assert layer_to_image(ellipse_layer(layer, 0.6)).size == (40, 18)
+
+if __name__ == "__main__":
+    test_layer_stages_match_full_canvas()
+    test_empty_layer()
@@ -30,5 +30,14 @@ def test_spotlight():
 
     print("Test passed!")
 
+def test_spotlight_unbatched():
+    # An [H,W,C] image renders like a batch of one
+    image = torch.rand(60, 80, 4)
+    for tiled in ["off", "on"]:
+        expected, = Spotlight().apply_spotlight(image[None], 4, 3, 10, "#000000", backend="pil", tiled=tiled)
+        result, = Spotlight().apply_spotlight(image, 4, 3, 10, "#000000", backend="pil", tiled=tiled)
+        assert torch.equal(result, expected)
+
 if __name__ == "__main__":
     test_spotlight()
+    test_spotlight_unbatched()
@@ -0,0 +1,51 @@
+import torch
+import numpy as np
+from PIL import Image
+import sys
+sys.path.insert(0, './goede-image-placer')
+from stage_cache import StageCache, STAGE_CACHE
+from drop_shadow import DropShadow
+
+def test_lru_eviction_by_memory():
+    cache = StageCache(max_bytes=3000)
+    for i in range(3):
+        cache.put(("stage", i), np.zeros(1000, dtype=np.uint8))
+    assert cache.get(("stage", 0)) is not None  # 0 is now the most recent entry
+
+    cache.put(("stage", 3), np.zeros(1000, dtype=np.uint8))
+    assert cache.get(("stage", 1)) is None
+    assert cache.get(("stage", 0)) is not None
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] <= 3000
+    assert stats["stages"]["stage"] == {"hits": 2, "misses": 1}
+
+    # Values larger than the whole budget are not stored
+    cache.put(("stage", 4), np.zeros(5000, dtype=np.uint8))
+    assert cache.get(("stage", 4)) is None
+
+def test_drop_shadow_reuses_stages():
+    image = Image.new('RGBA', (120, 120), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (30, 30, 90, 90))
+    image_tensor = torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+    drop_shadow_node = DropShadow()
+
+    STAGE_CACHE.clear()
+    first, = drop_shadow_node.add_shadow(image_tensor, 6, 20, 10, 1.5, "#000000")
+    assert STAGE_CACHE.stats()["stages"]["ellipse"]["hits"] == 0
+
+    # Moving the shadow only recomposites, the silhouette comes from the cache
+    moved, = drop_shadow_node.add_shadow(image_tensor, 6, 60, 10, 1.5, "#000000")
+    stats = STAGE_CACHE.stats()["stages"]
+    assert stats["ellipse"]["hits"] == 1
+    assert stats["blurred"]["misses"] == 1
+
+    # Cached and fresh results are identical
+    STAGE_CACHE.clear()
+    fresh, = drop_shadow_node.add_shadow(image_tensor, 6, 60, 10, 1.5, "#000000")
+    assert torch.equal(moved, fresh)
+
+if __name__ == "__main__":
+    test_lru_eviction_by_memory()
+    test_drop_shadow_reuses_stages()
@@ -0,0 +1,52 @@
+import sys
+sys.path.insert(0, './goede-image-placer')
+from spotlight import Spotlight, SpotlightSweep
+from perfect_shadow import PerfectShadow, PerfectShadowSweep
+from shadow_layer import LIGHT_POSITIONS
+import parallel
+sys.path.insert(0, './benchmarks')
+from bench_nodes import synthetic_cutout
+
+def _assert_aligned(sweep, singles, anchors):
+    # Every sweep item holds the single render, with the subject at the same
+    # position in all items and nothing outside of the single render
+    assert sweep.shape[0] == len(singles)
+    left = max(x for x, _ in anchors)
+    top = max(y for _, y in anchors)
+    for item, single, (x, y) in zip(sweep, singles, anchors):
+        height, width = single.shape[1:3]
+        x0, y0 = left - x, top - y
+        assert (item[y0:y0 + height, x0:x0 + width] == single[0]).all()
+        assert item.count_nonzero() == single.count_nonzero()
+
+def test_spotlight_sweep():
+    image = synthetic_cutout(2, 160, 120)
+    parallel.set_max_workers(4)
+    try:
+        sweep, = SpotlightSweep().sweep(image, 7.5, 20, "#202020")
+    finally:
+        parallel.set_max_workers(None)
+    assert sweep.shape[0] == 2 * len(LIGHT_POSITIONS)
+    for i in range(2):
+        singles, anchors = [], []
+        for light_from in LIGHT_POSITIONS:
+            singles.append(Spotlight().apply_spotlight(image[i:i + 1], light_from, 7.5, 20, "#202020", backend="pil")[0])
+            offset_x, offset_y = Spotlight()._offset(light_from, 7.5)
+            anchors.append((-min(0, 160 // 2 - int(160 * 1.5) // 2 + offset_x),
+                            -min(0, 120 // 2 - int(120 * 1.5) // 2 + offset_y)))
+        _assert_aligned(sweep[12 * i:12 * (i + 1)], singles, anchors)
+
+def test_perfect_shadow_sweep():
+    image = synthetic_cutout(1, 96, 80)
+    parallel.set_max_workers(4)
+    try:
+        sweep, = PerfectShadowSweep().sweep(image, 1, 1.0)
+    finally:
+        parallel.set_max_workers(None)
+    singles = [PerfectShadow().apply_shadow(image, light_from, 1, 1.0)[0] for light_from in LIGHT_POSITIONS]
+    anchors = [((single.shape[2] - 96) // 2, (single.shape[1] - 80) // 2) for single in singles]
+    _assert_aligned(sweep, singles, anchors)
+
+if __name__ == "__main__":
+    test_spotlight_sweep()
+    test_perfect_shadow_sweep()
@@ -0,0 +1,89 @@
+import os
+import sys
+sys.path.insert(0, './goede-image-placer')
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+from drop_shadow import DropShadow
+from spotlight import Spotlight
+from image_composite import ImageComposite
+from shadow_layer import alpha_layer, blur_layer
+from stage_cache import STAGE_CACHE
+import tiling
+sys.path.insert(0, './benchmarks')
+from bench_nodes import synthetic_cutout, synthetic_background
+
+def _small_strips(test):
+    # Many strips on small test images
+    def run():
+        rows = tiling.STRIP_ROWS
+        tiling.STRIP_ROWS = 48
+        try:
+            test()
+        finally:
+            tiling.STRIP_ROWS = rows
+    run.__name__ = test.__name__
+    return run
+
+def test_blur_strips_match_whole_region():
+    alpha = Image.new('L', (160, 400), 0)
+    ImageDraw.Draw(alpha).ellipse((10, 0, 150, 380), fill=255)
+    layer = alpha_layer(alpha)
+    for strategy in ["exact", "box", "downsample"]:
+        for radius in [2, 12, 40]:
+            expected = blur_layer(layer, radius, strategy)
+            for strip_rows in [1, 32, 100]:
+                tiled = blur_layer(layer, radius, strategy, strip_rows)
+                assert tiled[1:] == expected[1:]
+                assert np.array_equal(np.asarray(tiled.image), np.asarray(expected.image))
+
+@_small_strips
+def test_drop_shadow_tiled():
+    image = synthetic_cutout(2, 120, 160)
+    for shadow_angle, shadow_scale, quality in [(6, 1.5, "full"), (2, 1.0, "full"), (10, 2.0, "draft")]:
+        STAGE_CACHE.clear()
+        expected, = DropShadow().add_shadow(image, shadow_angle, 40, 12, shadow_scale, "#203040", backend="pil", quality=quality, tiled="off")
+        STAGE_CACHE.clear()
+        tiled, = DropShadow().add_shadow(image, shadow_angle, 40, 12, shadow_scale, "#203040", backend="pil", quality=quality, tiled="on")
+        assert torch.equal(tiled, expected)
+
+@_small_strips
+def test_spotlight_tiled():
+    image = synthetic_cutout(2, 120, 160)[..., :3]
+    for output_dtype in ["float32", "float16"]:
+        STAGE_CACHE.clear()
+        expected, = Spotlight().apply_spotlight(image, 4, 8.5, 30, "#101010", backend="pil", output_dtype=output_dtype, tiled="off")
+        STAGE_CACHE.clear()
+        tiled, = Spotlight().apply_spotlight(image, 4, 8.5, 30, "#101010", backend="pil", output_dtype=output_dtype, tiled="on")
+        assert tiled.dtype == expected.dtype
+        assert torch.equal(tiled, expected)
+    image = synthetic_cutout(1, 120, 160)
+    expected, = Spotlight().apply_spotlight(image, 9, 3, 10, "#101010", backend="pil", tiled="off")
+    tiled, = Spotlight().apply_spotlight(image, 9, 3, 10, "#101010", backend="pil", tiled="on")
+    assert torch.equal(tiled, expected)
+
+@_small_strips
+def test_image_composite_tiled():
+    background = synthetic_background(2, 150, 300)
+    subject = synthetic_cutout(2, 120, 160)
+    expected = ImageComposite().composite(background, subject, 10, backend="pil", tiled="off")
+    tiled = ImageComposite().composite(background, subject, 10, backend="pil", tiled="on")
+    assert torch.equal(tiled[0], expected[0])
+    assert torch.equal(tiled[1], expected[1])
+
+def test_auto_tiles_large_canvases():
+    os.environ["GOEDE_TILE_MEGAPIXELS"] = "1"
+    try:
+        assert not tiling.use_tiles("auto", (1000, 1000))
+        assert tiling.use_tiles("auto", (1000, 1001))
+    finally:
+        del os.environ["GOEDE_TILE_MEGAPIXELS"]
+    assert tiling.use_tiles("on", (10, 10))
+    assert not tiling.use_tiles("off", (10000, 10000))
+
+if __name__ == "__main__":
+    test_blur_strips_match_whole_region()
+    test_drop_shadow_tiled()
+    test_spotlight_tiled()
+    test_image_composite_tiled()
+    test_auto_tiles_large_canvases()
@@ -0,0 +1,92 @@
+import os
+import torch
+import numpy as np
+import sys
+sys.path.insert(0, './goede-image-placer')
+import torch_backend
+from drop_shadow import DropShadow
+from spotlight import Spotlight
+from image_composite import ImageComposite
+
+def _cutout(batch_size=2, height=120, width=160):
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:height, :width]
+    image = np.zeros((batch_size, height, width, 4), dtype=np.float32)
+    image[..., :3] = rng.random((batch_size, height, width, 3))
+    for i in range(batch_size):
+        image[i, ..., 3] = np.clip(1.2 - np.hypot((yy - 50 - 10 * i) / 30, (xx - 70 - 20 * i) / 40), 0, 1)
+    return torch.from_numpy(image)
+
+def _premultiplied(image):
+    # The color of nearly transparent pixels is not visible
+    return torch.cat((image[..., :3] * image[..., 3:], image[..., 3:]), -1)
+
+def _assert_close(torch_result, pil_result, max_error, mean_error=0.005):
+    # Same canvas, pixels within resampling differences of the PIL path
+    assert torch_result.shape == pil_result.shape
+    error = (_premultiplied(torch_result.cpu()) - _premultiplied(pil_result)).abs()
+    assert error.max() <= max_error
+    assert error.mean() <= mean_error
+
+def test_resolve_backend():
+    cpu_image = torch.zeros(1, 4, 4, 4)
+    assert torch_backend.resolve_backend("auto", cpu_image) == "pil"
+    assert torch_backend.resolve_backend("torch", cpu_image) == "torch"
+    # Images off the CPU stay on PIL unless GOEDE_BACKEND opts in
+    device_image = torch.zeros(1, 4, 4, 4, device="meta")
+    assert torch_backend.resolve_backend("auto", device_image) == "pil"
+    os.environ["GOEDE_BACKEND"] = "torch"
+    try:
+        assert torch_backend.resolve_backend("auto", cpu_image) == "torch"
+        assert torch_backend.resolve_backend("pil", cpu_image) == "pil"
+        os.environ["GOEDE_BACKEND"] = "auto"
+        assert torch_backend.resolve_backend("auto", cpu_image) == "pil"
+        assert torch_backend.resolve_backend("auto", device_image) == "torch"
+    finally:
+        del os.environ["GOEDE_BACKEND"]
+
+def test_shadow_nodes_torch_backend():
+    image = _cutout()
+    for strategy in ["exact", "box", "downsample"]:
+        pil_result, = DropShadow().add_shadow(image, 6, 50, 20, 1.5, "#203040", strategy, "pil")
+        torch_result, = DropShadow().add_shadow(image, 6, 50, 20, 1.5, "#203040", strategy, "torch")
+        _assert_close(torch_result, pil_result, 4 / 255)
+
+    pil_result, = Spotlight().apply_spotlight(image, 3, 7.5, 60, "#112233", "auto", "pil")
+    torch_result, = Spotlight().apply_spotlight(image, 3, 7.5, 60, "#112233", "auto", "torch")
+    _assert_close(torch_result, pil_result, 4 / 255)
+
+def test_composite_torch_backend():
+    image = _cutout()
+    background = torch.rand(1, 200, 300, 3)
+    pil_result = ImageComposite().composite(background, image, 10, "pil")
+    torch_result = ImageComposite().composite(background, image, 10, "torch")
+    _assert_close(torch_result[0], pil_result[0], 4 / 255)
+    assert torch_result[1].shape == pil_result[1].shape
+
+def test_resampling_matches_pil():
+    # Same taps and weights as PIL, only the 8 bit rounding differs (after
+    # each of the six box passes of the blur)
+    from PIL import Image, ImageFilter
+    alpha = _cutout(1)[0, ..., 3].numpy()
+    pil_alpha = Image.fromarray(np.round(alpha * 255).astype(np.uint8))
+    plane = torch.from_numpy(np.asarray(pil_alpha, dtype=np.float32) / 255)
+    def assert_levels(result, expected, levels=1.5):
+        expected = np.asarray(expected, dtype=np.float32)
+        assert result.shape == expected.shape
+        assert np.abs(result.numpy() * 255 - expected).max() <= levels
+    for size in [(200, 150), (61, 43)]:
+        for name, resample in [("lanczos", Image.LANCZOS), ("bicubic", Image.BICUBIC),
+                               ("bilinear", Image.BILINEAR), ("box", Image.BOX)]:
+            assert_levels(torch_backend.resize(plane, size, name), pil_alpha.resize(size, resample))
+    data = (1.2, 0.0, -7.5, 0.0, 0.8, 4.25)
+    assert_levels(torch_backend.affine(plane, (140, 110), data),
+                  pil_alpha.transform((140, 110), Image.AFFINE, data, Image.BICUBIC))
+    for radius in [2, 9.5]:
+        assert_levels(torch_backend.blur(plane, radius, "exact"), pil_alpha.filter(ImageFilter.GaussianBlur(radius)), 2)
+
+if __name__ == "__main__":
+    test_resolve_backend()
+    test_shadow_nodes_torch_backend()
+    test_composite_torch_backend()
+    test_resampling_matches_pil()